@@ -1,4 +1,3 @@
-<<<<<<< HEAD
 import os
 from django.core.wsgi import get_wsgi_application
 
@@ -6,9 +5,8 @@ os.environ.setdefault(
     "DJANGO_SETTINGS_MODULE",
     "ecommerce_site.settings"
 )
+# Trimmed apps and middleware for cold starts (see settings.SERVERLESS)
+os.environ.setdefault("DJANGO_SERVERLESS", "1")
 
 application = get_wsgi_application()
 app = application
-=======
-
->>>>>>> c96ac8f73fa5f681dd3e7840b9089ce00ba98bb7
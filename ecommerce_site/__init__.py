@@ -1,5 +0,0 @@
-# If you installed PyMySQL instead of mysqlclient, uncomment below to use it as MySQLdb shim:
-# import pymysql
-# pymysql.install_as_MySQLdb()
-import pymysql
-pymysql.install_as_MySQLdb()
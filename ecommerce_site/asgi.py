@@ -0,0 +1,14 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE',
+    'ecommerce_site.settings'
+)
+# Serve the async catalog/history views (see shop/urls.py)
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')
+# Connections are per thread and each async request gets its own, so
+# persistent connections would pile up; use a pool instead (database.py).
+os.environ.setdefault('CONN_MAX_AGE', '0')
+
+application = get_asgi_application()
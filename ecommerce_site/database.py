@@ -0,0 +1,58 @@
+"""
+Database settings built from URLs (``DATABASE_URL``, ``DATABASE_REPLICA_URL``).
+
+* Connections are persistent (``CONN_MAX_AGE``) and health-checked before
+  reuse.
+* SQLite takes the write lock at BEGIN so concurrent checkouts queue up
+  instead of failing with "database is locked". ``SQLITE_WAL=1`` also
+  switches it to WAL mode so readers never block the writer; that setting is
+  stored in the database file itself (and adds -wal/-shm files next to it),
+  so it is opt-in rather than applied to whatever file the URL points at.
+* PostgreSQL uses psycopg's connection pool when ``DATABASE_POOL_MAX_SIZE``
+  is set; pooling replaces persistent connections.
+"""
+import os
+from pathlib import Path
+
+import dj_database_url
+
+CONN_MAX_AGE = int(os.environ.get("CONN_MAX_AGE", "60"))
+POOL_MIN_SIZE = int(os.environ.get("DATABASE_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.environ.get("DATABASE_POOL_MAX_SIZE", "0"))
+
+SQLITE_WAL = os.environ.get("SQLITE_WAL", "0") == "1"
+
+SQLITE_PRAGMAS = (
+    "PRAGMA foreign_keys=ON;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=134217728;"
+)
+# synchronous=NORMAL is only safe against corruption in WAL mode; the rollback
+# journal keeps the default FULL
+SQLITE_WAL_PRAGMAS = "PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;"
+
+
+def database_config(url):
+    config = dj_database_url.parse(url, conn_max_age=CONN_MAX_AGE, conn_health_checks=True)
+    options = config.setdefault("OPTIONS", {})
+
+    if config["ENGINE"] == "django.db.backends.sqlite3":
+        options.update({
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+            "init_command": (SQLITE_WAL_PRAGMAS if SQLITE_WAL else "") + SQLITE_PRAGMAS,
+        })
+        # A file rather than shared-cache memory, so threaded tests see the
+        # same locking (busy timeout, IMMEDIATE) as the site
+        if config["NAME"] != ":memory:":
+            name = Path(config["NAME"])
+            config["TEST"] = {"NAME": str(name.with_name(f"test_{name.name}"))}
+    elif config["ENGINE"] == "django.db.backends.postgresql" and POOL_MAX_SIZE:
+        options["pool"] = {"min_size": POOL_MIN_SIZE, "max_size": POOL_MAX_SIZE}
+        config["CONN_MAX_AGE"] = 0
+    elif config["ENGINE"] == "django.db.backends.mysql":
+        # PyMySQL stands in for mysqlclient; only imported when MySQL is used
+        import pymysql
+        pymysql.install_as_MySQLdb()
+
+    return config
@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from .database import database_config
+
 # ================= BASE =================
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -9,6 +11,11 @@ DEBUG = False
 
 ALLOWED_HOSTS = ["*"]
 
+# api/index.py (Vercel) sets DJANGO_SERVERLESS=1. Every cold start imports
+# the settings, apps and URLconf, so that profile leaves out what a function
+# instance does not need; see `manage.py startup_profile --serverless`.
+SERVERLESS = os.environ.get("DJANGO_SERVERLESS", "0") == "1"
+
 # ================= INSTALLED APPS =================
 INSTALLED_APPS = [
     "django.contrib.auth",
@@ -25,10 +32,23 @@ INSTALLED_APPS = [
     "shop",
 ]
 
+if SERVERLESS:
+    # No template uses crispy_forms. The admin is served by a regular
+    # (WSGI/ASGI) deployment unless SERVERLESS_ADMIN=1.
+    INSTALLED_APPS.remove("crispy_forms")
+    if os.environ.get("SERVERLESS_ADMIN", "0") != "1":
+        INSTALLED_APPS.remove("django.contrib.admin")
+
 # ================= MIDDLEWARE =================
 MIDDLEWARE = [
+    "shop.profiling.ProfilingMiddleware",
+    "shop.routers.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Serves collected static files (see STORAGES["staticfiles"])
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    # Anonymous carts live in their own signed cookie (see shop/cart.py)
+    "shop.cart.CartCookieMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -36,22 +56,67 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-# ================= URL & WSGI =================
+if SERVERLESS:
+    # Per-process metrics mean little on short-lived function instances
+    MIDDLEWARE.remove("shop.profiling.ProfilingMiddleware")
+
+# ================= URL & WSGI/ASGI =================
 ROOT_URLCONF = "ecommerce_site.urls"
 WSGI_APPLICATION = "ecommerce_site.wsgi.application"
+ASGI_APPLICATION = "ecommerce_site.asgi.application"
+# Async versions of the read-heavy views; enabled by ecommerce_site/asgi.py,
+# e.g. `uvicorn ecommerce_site.asgi:application`
+ASYNC_VIEWS = os.environ.get("DJANGO_ASYNC_VIEWS", "0") == "1"
 
 # ================= DATABASE =================
+# DATABASE_URL selects the backend (sqlite:///path, postgres://...); see
+# ecommerce_site/database.py for connection reuse, pooling and SQLite pragmas.
 DATABASES = {
+    "default": database_config(
+        os.environ.get("DATABASE_URL", f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
+    ),
+}
+
+# Optional read replica for GET requests (see shop/routers.py). Locally, two
+# SQLite files work: DATABASE_REPLICA_URL=sqlite:///replica.sqlite3
+if os.environ.get("DATABASE_REPLICA_URL"):
+    DATABASES["replica"] = database_config(os.environ["DATABASE_REPLICA_URL"])
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["shop.routers.PrimaryReplicaRouter"]
+# Seconds a client keeps reading the primary after it wrote something
+REPLICA_PIN_SECONDS = 5
+
+# ================= CACHE =================
+# Per-process cache unless REDIS_URL is set (needs the redis package). The
+# catalog page cache (shop/caching.py) is invalidated by bumping version keys
+# that every worker has to see, so it is off with a per-process cache.
+# CATALOG_PAGE_CACHE=1 turns it on anyway, which is only safe with a single
+# worker process; `manage.py check` warns about it (shop.W001).
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "ecommerce",
     }
 }
+if os.environ.get("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+CATALOG_PAGE_CACHE = {"1": True, "0": False}.get(os.environ.get("CATALOG_PAGE_CACHE", ""))
+
+# ================= SESSIONS =================
+# Server-side sessions, so logout and password changes revoke them. Anonymous
+# visitors get none: their cart is a signed cookie (shop.cart.CookieCart).
+# Expired rows are removed by `python manage.py clearsessions`.
+SESSION_ENGINE = "django.contrib.sessions.backends.db"
 
 # ================= TEMPLATES =================
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates with render timing for shop.profiling
+        "BACKEND": "shop.profiling.ProfiledDjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -60,6 +125,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "shop.context_processors.cart",
             ],
         },
     },
@@ -79,14 +145,74 @@ USE_TZ = True
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_DIRS = [
-    BASE_DIR / "static"
+    BASE_DIR / "static",
+    # Tailwind build output (npm run build in theme/static_src)
+    BASE_DIR / "theme" / "static",
 ]
 
 # ================= MEDIA =================
-# Disabled (Vercel does not support persistent media storage)
+# Vercel does not support persistent media storage; point MEDIA_ROOT at a
+# mounted volume or swap the "default" storage for an object store there.
+MEDIA_URL = "/media/"
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", BASE_DIR / "media")
+
+# ================= STORAGES =================
+# "invoices" holds rendered invoice PDFs keyed by order id + content hash.
+# Point INVOICE_CACHE_DIR at a writable volume (e.g. /tmp on Vercel).
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # Content-hashed names plus .gz/.br variants, written by collectstatic;
+    # WhiteNoise serves them as immutable for a year. See shop/staticfiles.py.
+    "staticfiles": {
+        "BACKEND": "shop.staticfiles.StaticFilesStorage",
+    },
+    "invoices": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": os.environ.get("INVOICE_CACHE_DIR", BASE_DIR / "invoice_cache"),
+        },
+    },
+}
+
+# ================= INVOICES =================
+# Letterhead logo, and an optional Unicode TrueType pair so invoices can
+# print the rupee sign; without them they use Helvetica and "Rs.".
+INVOICE_LOGO = os.environ.get("INVOICE_LOGO", str(BASE_DIR / "static" / "images" / "logo.png"))
+INVOICE_FONT = os.environ.get("INVOICE_FONT", "")
+INVOICE_FONT_BOLD = os.environ.get("INVOICE_FONT_BOLD", "")
+
+# ================= SYSTEM CHECKS =================
+# Covering-index columns (Index.include) are used on PostgreSQL and ignored
+# elsewhere, which is intended.
+SILENCED_SYSTEM_CHECKS = ["models.W040"]
 
 # ================= DEFAULT PK =================
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # ================= CRISPY FORMS =================
 CRISPY_TEMPLATE_PACK = "bootstrap4"
+
+# ================= BACKGROUND JOBS =================
+# Consumed by `python manage.py run_worker`
+JOB_RETRY_BASE_SECONDS = 30
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_STALE_SECONDS = 600
+
+# ================= STOCK RESERVATIONS =================
+# How long items added to a cart stay held for the shopper; expired holds
+# are returned by `python manage.py expire_reservations`
+STOCK_HOLD_SECONDS = 60 * 15
+
+# ================= PROFILING =================
+# Fraction of requests measured by shop.profiling.ProfilingMiddleware
+# (Server-Timing header + /metrics); 0 disables it.
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0.05"))
+PROFILING_DUPLICATE_QUERY_THRESHOLD = 3
+# /metrics is open to staff users and to scrapers that send
+# "Authorization: Bearer $METRICS_TOKEN" (no token: staff only).
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Opt-in, comma-separated addresses allowed without credentials. Only for
+# scrapers that connect directly: behind a proxy every client shares its IP.
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get("METRICS_ALLOWED_IPS", "").split(",") if ip]
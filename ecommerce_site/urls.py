@@ -1,15 +1,24 @@
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from shop.profiling import metrics_view
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', include(('shop.urls', 'shop'), namespace='shop')),
+    path('api/v1/', include('shop.api_urls', namespace='api-v1')),
     path('accounts/', include('django.contrib.auth.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
 ]
 
+# Left out of the serverless profile (see settings.SERVERLESS)
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
+
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL,
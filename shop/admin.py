@@ -1,6 +1,18 @@
-from django.contrib import admin
-from .models import Product, Category, Order, OrderItem
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import render
+from django.urls import path
+from django.utils import timezone
+from .models import Product, Category, Order, OrderItem, Job, SalesDay
 from .models import HeroSection
+from . import analytics
+from .exports import export_rows, streaming_export
+from .imports import FORMATS as IMPORT_FORMATS, import_uploaded_file
+from .invoice import asend_invoice_emails
 
 @admin.register(HeroSection)
 class HeroSectionAdmin(admin.ModelAdmin):
@@ -10,24 +22,143 @@ class HeroSectionAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name')
+    list_display = ('id', 'name', 'tax_rate')
     prepopulated_fields = {'slug': ('name',)}
 
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or JSONL; large files are better loaded with manage.py import_catalog.")
+    format = forms.ChoiceField(
+        choices=[('', 'From file extension')] + [(fmt, fmt.upper()) for fmt in IMPORT_FORMATS],
+        required=False,
+    )
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'price', 'category')
+    list_display = ('id', 'name', 'price', 'category', 'stock', 'reserved')
     list_filter = ('category',)
     prepopulated_fields = {'slug': ('name',)}
+    change_list_template = 'admin/shop/product/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='shop_product_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+
+        report = None
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            report = import_uploaded_file(form.cleaned_data['file'], form.cleaned_data['format'] or None)
+
+        return render(request, 'admin/shop/product/import.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import products',
+            'form': form,
+            'report': report,
+        })
 
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
-    readonly_fields = ('product', 'price')
+    # Amounts are priced once at checkout; editing a line would leave the
+    # stored order totals stale
+    readonly_fields = ('product', 'price', 'quantity', 'discount', 'tax_rate', 'tax', 'total')
 
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "total_price", "created_at")
-    readonly_fields = ("total_price", "created_at")
+    list_display = ("id", "user", "item_count", "subtotal", "tax_total", "total_price", "status", "created_at")
+    list_filter = ("status", "created_at")
+    date_hierarchy = "created_at"
+    readonly_fields = ("subtotal", "discount_total", "tax_total", "total_price", "item_count", "created_at")
+    actions = ("export_csv", "export_jsonl", "resend_invoices")
+
+    @admin.action(description="Export selected orders as CSV")
+    def export_csv(self, request, queryset):
+        return streaming_export(export_rows(orders=queryset), "csv")
+
+    @admin.action(description="Export selected orders as JSONL")
+    def export_jsonl(self, request, queryset):
+        return streaming_export(export_rows(orders=queryset), "jsonl")
+
+    @admin.action(description="Resend invoice emails")
+    def resend_invoices(self, request, queryset):
+        orders = list(queryset.select_related("user").prefetch_related("items__product"))
+        errors = async_to_sync(asend_invoice_emails)(orders)
+        sent = sum(1 for order in orders if order.user.email and order.id not in errors)
+        self.message_user(request, f"Sent {sent} invoice email(s).")
+        if errors:
+            self.message_user(
+                request,
+                "Failed for order(s) " + ", ".join(f"#{order_id}" for order_id in sorted(errors)),
+                messages.ERROR,
+            )
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "run_at", "created_at")
+    list_filter = ("status", "name")
+    readonly_fields = ("created_at", "locked_by", "locked_at", "last_error")
+    actions = ("retry_jobs",)
+
+    @admin.action(description="Retry selected jobs")
+    def retry_jobs(self, request, queryset):
+        queryset.update(status="Pending", attempts=0, run_at=timezone.now(), locked_by="", locked_at=None)
+
+
+class SalesDashboardForm(forms.Form):
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    status = forms.MultipleChoiceField(
+        choices=Order.STATUS_CHOICES, required=False, widget=forms.CheckboxSelectMultiple,
+    )
+
+
+@admin.register(SalesDay)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """Sales dashboard in place of the SalesDay change list; reads only the rollups."""
+
+    DEFAULT_DAYS = 30
+    DEFAULT_STATUSES = ['Placed', 'Shipped', 'Delivered']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        form = SalesDashboardForm(request.GET or None)
+        cleaned = form.cleaned_data if form.is_valid() else {}
+        end = cleaned.get('end') or timezone.localdate()
+        start = cleaned.get('start') or end - timedelta(days=self.DEFAULT_DAYS - 1)
+        statuses = cleaned.get('status') or self.DEFAULT_STATUSES
+        if not form.is_bound:
+            form = SalesDashboardForm(initial={'start': start, 'end': end, 'status': statuses})
+
+        days = analytics.daily_series(start, end, statuses)
+        return render(request, 'admin/shop/sales_dashboard.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sales dashboard',
+            'form': form,
+            'days': days,
+            'totals': {
+                key: sum(day[key] for day in days) for key in ('revenue', 'orders', 'units')
+            },
+            'top_products': analytics.top_products(start, end, statuses),
+            'top_categories': analytics.top_categories(start, end, statuses),
+        })
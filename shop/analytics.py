@@ -0,0 +1,218 @@
+"""
+Sales analytics.
+
+Reports never scan ``Order``/``OrderItem``. Instead three rollup tables hold
+revenue, order count and units per local day and order status, in total
+(``SalesDay``), per product (``ProductSalesDay``) and per category
+(``CategorySalesDay``).
+
+The rollups are maintained incrementally by signals (see ``shop.signals``):
+a new order is added under its status once its transaction commits, a status
+change moves it from the old status to the new one, and a deleted order is
+subtracted. Every change is a single ``INSERT ... ON CONFLICT DO UPDATE``
+increment per table, so concurrent checkouts cannot lose updates.
+``manage.py rebuild_sales_rollups`` recomputes any date range from the order
+tables, e.g. after a backfill or manual edits to order lines.
+
+Revenue is the sum of the order lines' stored net amounts: after discount,
+before GST (``total - tax``). A line is counted under its product's category
+at the time the order is recorded.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CategorySalesDay, OrderItem, ProductSalesDay, SalesDay
+
+TOP_LIMIT = 10
+REBUILD_BATCH_SIZE = 2000
+REVENUE = Sum(F('total') - F('tax'))
+
+# Rollup rows not yet applied: one per (product, category) of an order
+OrderLine = namedtuple('OrderLine', 'product_id category_id revenue units')
+OrderSnapshot = namedtuple('OrderSnapshot', 'date status lines')
+
+
+# ================= INCREMENTAL UPDATES =================
+
+def snapshot(order_id):
+    """Read what an order contributes to the rollups, or None if it has no lines."""
+    rows = list(
+        OrderItem.objects.filter(order_id=order_id)
+        .values('order__created_at', 'order__status', 'product_id', 'product__category_id')
+        .annotate(revenue=REVENUE, units=Sum('quantity'))
+        .order_by()
+    )
+    if not rows:
+        return None
+    lines = [
+        OrderLine(row['product_id'], row['product__category_id'], row['revenue'], row['units'])
+        for row in rows
+    ]
+    return OrderSnapshot(timezone.localdate(rows[0]['order__created_at']), rows[0]['order__status'], lines)
+
+
+def _increment(model, key_fields, rows):
+    """
+    Add ``(revenue, orders, units)`` to the rollup row identified by each key.
+
+    ``rows`` is a list of ``key values + (revenue, orders, units)`` tuples.
+    """
+    if not rows:
+        return
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return _increment_fallback(model, key_fields, rows)
+
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [model._meta.get_field(name).column for name in key_fields]
+    values = ['revenue', 'orders', 'units']
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(c) for c in columns + values)}) "
+        f"VALUES ({', '.join(['%s'] * (len(columns) + len(values)))}) "
+        f"ON CONFLICT ({', '.join(qn(c) for c in columns)}) DO UPDATE SET "
+        + ', '.join(f"{qn(c)} = {table}.{qn(c)} + excluded.{qn(c)}" for c in values)
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _increment_fallback(model, key_fields, rows):
+    for row in rows:
+        keys = dict(zip(key_fields, row))
+        revenue, orders, units = row[len(key_fields):]
+        changes = {'revenue': F('revenue') + revenue, 'orders': F('orders') + orders, 'units': F('units') + units}
+        if not model.objects.filter(**keys).update(**changes):
+            model.objects.create(**keys, revenue=revenue, orders=orders, units=units)
+
+
+def apply(snap, status=None, sign=1):
+    """Add (``sign=1``) or subtract (``sign=-1``) an order snapshot under ``status``."""
+    if snap is None or not snap.lines:
+        return
+    status = status or snap.status
+
+    categories = {}
+    for line in snap.lines:
+        revenue, units = categories.get(line.category_id, (0, 0))
+        categories[line.category_id] = (revenue + line.revenue, units + line.units)
+
+    with transaction.atomic():
+        _increment(SalesDay, ['date', 'status'], [(
+            snap.date, status,
+            sign * sum(line.revenue for line in snap.lines), sign, sign * sum(line.units for line in snap.lines),
+        )])
+        _increment(ProductSalesDay, ['date', 'status', 'product'], [
+            (snap.date, status, line.product_id, sign * line.revenue, sign, sign * line.units)
+            for line in snap.lines
+        ])
+        _increment(CategorySalesDay, ['date', 'status', 'category'], [
+            (snap.date, status, category_id, sign * revenue, sign, sign * units)
+            for category_id, (revenue, units) in categories.items()
+        ])
+
+
+def record_order(order_id, status):
+    apply(snapshot(order_id), status)
+
+
+def move_order(order_id, old_status, new_status):
+    snap = snapshot(order_id)
+    with transaction.atomic():
+        apply(snap, old_status, sign=-1)
+        apply(snap, new_status)
+
+
+# ================= REBUILD =================
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(since=None, until=None):
+    """Recompute the rollups for ``since``..``until`` (inclusive dates, open-ended if None)."""
+    items = OrderItem.objects.all()
+    rollups = [SalesDay.objects.all(), ProductSalesDay.objects.all(), CategorySalesDay.objects.all()]
+    if since:
+        items = items.filter(order__created_at__gte=_day_start(since))
+        rollups = [qs.filter(date__gte=since) for qs in rollups]
+    if until:
+        items = items.filter(order__created_at__lt=_day_start(until + timedelta(days=1)))
+        rollups = [qs.filter(date__lte=until) for qs in rollups]
+
+    items = items.annotate(
+        day=TruncDate('order__created_at', tzinfo=timezone.get_current_timezone()),
+        status=F('order__status'),
+    ).order_by()
+    totals = dict(revenue=REVENUE, orders=Count('order', distinct=True), units=Sum('quantity'))
+
+    with transaction.atomic():
+        for qs in rollups:
+            qs.delete()
+        count = 0
+        for model, group in (
+            (SalesDay, ()),
+            (ProductSalesDay, ('product',)),
+            (CategorySalesDay, ('product__category',)),
+        ):
+            rows = items.values('day', 'status', *group).annotate(**totals)
+            batch = []
+            for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+                extra = {}
+                if group:
+                    field = 'category_id' if model is CategorySalesDay else 'product_id'
+                    extra[field] = row[group[0]]
+                batch.append(model(
+                    date=row['day'], status=row['status'],
+                    revenue=row['revenue'], orders=row['orders'], units=row['units'], **extra,
+                ))
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    model.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            model.objects.bulk_create(batch)
+            count += len(batch)
+    return count
+
+
+# ================= REPORTS =================
+
+def _rollups(model, start, end, statuses):
+    return model.objects.filter(date__gte=start, date__lte=end, status__in=statuses).order_by()
+
+
+def daily_series(start, end, statuses):
+    """One ``{date, revenue, orders, units}`` dict per day in range, zero-filled."""
+    rows = {
+        row['date']: row
+        for row in _rollups(SalesDay, start, end, statuses)
+        .values('date').annotate(revenue=Sum('revenue'), orders=Sum('orders'), units=Sum('units'))
+    }
+    days = []
+    day = start
+    while day <= end:
+        days.append(rows.get(day, {'date': day, 'revenue': 0, 'orders': 0, 'units': 0}))
+        day += timedelta(days=1)
+    return days
+
+
+def top_products(start, end, statuses, limit=TOP_LIMIT):
+    return list(
+        _rollups(ProductSalesDay, start, end, statuses)
+        .values('product_id', 'product__name')
+        .annotate(revenue=Sum('revenue'), orders=Sum('orders'), units=Sum('units'))
+        .order_by('-revenue')[:limit]
+    )
+
+
+def top_categories(start, end, statuses, limit=TOP_LIMIT):
+    return list(
+        _rollups(CategorySalesDay, start, end, statuses)
+        .values('category_id', 'category__name')
+        .annotate(revenue=Sum('revenue'), orders=Sum('orders'), units=Sum('units'))
+        .order_by('-revenue')[:limit]
+    )
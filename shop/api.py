@@ -0,0 +1,333 @@
+"""
+JSON API, version 1, mounted at ``/api/v1/``.
+
+* ``GET products``: a keyset page of the catalog, with the same filters,
+  sorts and cursors as the product list (``shop.catalog``), or
+  ``?ids=1,2,3`` for a batch in one query.
+* ``GET products/<slug>``
+* ``GET cart``, ``GET orders`` and ``GET orders/<id>``: the signed-in
+  user's (session authentication), 401 otherwise.
+
+Every resource takes ``?fields=a,b`` and is built from ``.values()`` rows,
+never model instances. The ETag is a hash of the query string and of the
+version columns of the rows in the response (``updated_at``, quantities,
+free stock), so it is known before anything is serialized and a matching
+``If-None-Match`` is answered with a 304 and no body. Clients revalidate on
+every use (``Cache-Control: no-cache``).
+"""
+import hashlib
+from decimal import Decimal
+from functools import wraps
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import cart as cart_module
+from . import catalog, reservations
+from .models import Order, OrderItem, Product
+
+API_VERSION = 1
+MAX_PAGE_SIZE = 100
+MAX_IDS = 100
+ORDERS_PAGE_SIZE = 20
+
+# API field -> values() lookup
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'name': 'name',
+    'description': 'description',
+    'price': 'price',
+    'category': 'category__slug',
+    'category_name': 'category__name',
+    'image': 'image',
+    'available': 'available',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+PRODUCT_LIST_FIELDS = ['id', 'slug', 'name', 'price', 'category', 'image', 'available']
+# Category renames do not touch Product.updated_at
+PRODUCT_VERSION = ['id', 'updated_at', 'available', 'category__slug', 'category__name']
+
+CART_FIELDS = {
+    'id': 'id',
+    'product': 'product_id',
+    'slug': 'product__slug',
+    'name': 'product__name',
+    'price': 'product__price',
+    'image': 'product__image',
+    'quantity': 'quantity',
+    'available': 'available',
+    'held_until': 'held_until',
+    'added_at': 'added_at',
+}
+CART_VERSION = ['id', 'quantity', 'updated_at', 'product__updated_at', 'available', 'held_until']
+
+ORDER_FIELDS = {
+    'id': 'id',
+    'status': 'status',
+    'item_count': 'item_count',
+    'subtotal': 'subtotal',
+    'discount_total': 'discount_total',
+    'tax_total': 'tax_total',
+    'total_price': 'total_price',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+ORDER_VERSION = ['id', 'updated_at']
+
+ORDER_ITEM_FIELDS = {
+    'product': 'product_id',
+    'slug': 'product__slug',
+    'name': 'product__name',
+    'price': 'price',
+    'quantity': 'quantity',
+    'discount': 'discount',
+    'tax_rate': 'tax_rate',
+    'tax': 'tax',
+    'total': 'total',
+}
+# Lines are written once at checkout; only the product they show can change
+ORDER_ITEM_VERSION = ['id', 'product__updated_at']
+
+
+class ApiError(Exception):
+    status = 400
+
+
+class NotAuthenticated(ApiError):
+    status = 401
+
+
+class NotFound(ApiError):
+    status = 404
+
+
+def api_view(view):
+    """Answer only GET/HEAD, and report ``ApiError`` as a JSON body."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = JsonResponse({'error': "Method not allowed."}, status=405)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as exc:
+            return JsonResponse({'error': str(exc)}, status=exc.status)
+    return wrapper
+
+
+# ================= HELPERS =================
+
+def _fields(request, known, default):
+    """The API fields asked for with ``?fields=``, else ``default``."""
+    names = [name for name in request.GET.get('fields', '').split(',') if name]
+    if not names:
+        return list(default)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Known: {', '.join(known)}.")
+    return list(dict.fromkeys(names))
+
+
+def _lookups(fields, known, *extra):
+    """The values() lookups for ``fields`` plus the ones versions and cursors need."""
+    return list(dict.fromkeys([known[field] for field in fields] + [name for group in extra for name in group]))
+
+
+def _page_size(request, default):
+    try:
+        size = int(request.GET.get('limit') or default)
+    except ValueError:
+        raise ApiError("limit must be a number.")
+    if not 1 <= size <= MAX_PAGE_SIZE:
+        raise ApiError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return size
+
+
+def _user(request):
+    if not request.user.is_authenticated:
+        raise NotAuthenticated("Sign in to see this resource.")
+    return request.user
+
+
+def _versions(rows, columns):
+    return [tuple(row[column] for column in columns) for row in rows]
+
+
+def _shape(row, fields, known):
+    item = {field: row[known[field]] for field in fields}
+    if 'image' in item:
+        item['image'] = default_storage.url(item['image']) if item['image'] else None
+    return item
+
+
+def _etag(request, versions):
+    key = repr((API_VERSION, request.path, sorted(request.GET.lists()), versions))
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+def _respond(request, versions, build, private=False):
+    """
+    A 304 when the client holds the ETag of ``versions``, otherwise the JSON
+    of ``build()``, which therefore only runs when a body is sent.
+    """
+    etag = _etag(request, versions)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(build(), encoder=DjangoJSONEncoder, json_dumps_params={'separators': (',', ':')})
+    response['ETag'] = etag
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+# ================= CATALOG =================
+
+def _product_rows(queryset, lookups):
+    return queryset.annotate(available=reservations.available()).values(*lookups)
+
+
+@api_view
+def products(request):
+    fields = _fields(request, PRODUCT_FIELDS, PRODUCT_LIST_FIELDS)
+    if 'ids' in request.GET:
+        return _product_batch(request, fields)
+
+    page_size = _page_size(request, catalog.PAGE_SIZE)
+    queryset, filters = catalog.page_queryset(request.GET, page_size)
+    # The HTML catalog ignores a bad price filter; API clients are told
+    for name in ('min_price', 'max_price'):
+        if request.GET.get(name) and filters[name] is None:
+            raise ApiError(f"{name} must be a finite number.")
+    _, sort_field, _ = catalog.SORTS[filters['sort']]
+    rows = list(_product_rows(queryset, _lookups(fields, PRODUCT_FIELDS, PRODUCT_VERSION, [sort_field])))
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = catalog.encode_cursor(rows[-1][sort_field], rows[-1]['id'])
+
+    return _respond(request, [next_cursor, *_versions(rows, PRODUCT_VERSION)], lambda: {
+        'results': [_shape(row, fields, PRODUCT_FIELDS) for row in rows],
+        'next_cursor': next_cursor,
+    })
+
+
+def _product_batch(request, fields):
+    """``?ids=``: the products in the order asked for, in one query."""
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.GET['ids'].split(',') if pk))
+    except ValueError:
+        raise ApiError("ids must be comma-separated product ids.")
+    if not 1 <= len(ids) <= MAX_IDS:
+        raise ApiError(f"Ask for between 1 and {MAX_IDS} ids.")
+
+    found = {
+        row['id']: row
+        for row in _product_rows(Product.objects.filter(pk__in=ids), _lookups(fields, PRODUCT_FIELDS, PRODUCT_VERSION))
+    }
+    rows = [found[pk] for pk in ids if pk in found]
+    missing = [pk for pk in ids if pk not in found]
+
+    return _respond(request, [missing, *_versions(rows, PRODUCT_VERSION)], lambda: {
+        'results': [_shape(row, fields, PRODUCT_FIELDS) for row in rows],
+        'missing': missing,
+    })
+
+
+@api_view
+def product_detail(request, slug):
+    fields = _fields(request, PRODUCT_FIELDS, PRODUCT_FIELDS)
+    row = _product_rows(
+        Product.objects.filter(slug=slug), _lookups(fields, PRODUCT_FIELDS, PRODUCT_VERSION),
+    ).first()
+    if row is None:
+        raise NotFound(f"No product {slug!r}.")
+    return _respond(request, _versions([row], PRODUCT_VERSION), lambda: _shape(row, fields, PRODUCT_FIELDS))
+
+
+# ================= CART =================
+
+@api_view
+def cart(request):
+    user = _user(request)
+    fields = _fields(request, CART_FIELDS, CART_FIELDS)
+    rows = list(cart_module.cart_lines(user).values(
+        *_lookups(fields, CART_FIELDS, CART_VERSION, ['product__price'])
+    ))
+
+    def build():
+        return {
+            'lines': [_shape(row, fields, CART_FIELDS) for row in rows],
+            'count': sum(row['quantity'] for row in rows),
+            'total': sum((row['product__price'] * row['quantity'] for row in rows), Decimal('0.00')),
+        }
+
+    return _respond(request, _versions(rows, CART_VERSION), build, private=True)
+
+
+# ================= ORDERS =================
+
+@api_view
+def orders(request):
+    user = _user(request)
+    fields = _fields(request, ORDER_FIELDS, ORDER_FIELDS)
+    page_size = _page_size(request, ORDERS_PAGE_SIZE)
+
+    queryset = Order.objects.filter(user=user)
+    cursor = catalog.decode_cursor(request.GET.get('cursor') or '', 'created_at', Order)
+    if cursor is not None:
+        created_at, pk = cursor
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(
+        queryset.order_by('-created_at', '-id')
+        .values(*_lookups(fields, ORDER_FIELDS, ORDER_VERSION, ['created_at']))[:page_size + 1]
+    )
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = catalog.encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    return _respond(request, [next_cursor, *_versions(rows, ORDER_VERSION)], lambda: {
+        'results': [_shape(row, fields, ORDER_FIELDS) for row in rows],
+        'next_cursor': next_cursor,
+    }, private=True)
+
+
+@api_view
+def order_detail(request, order_id):
+    user = _user(request)
+    fields = _fields(request, {**ORDER_FIELDS, 'items': None}, [*ORDER_FIELDS, 'items'])
+    order_fields = [field for field in fields if field != 'items']
+
+    row = Order.objects.filter(user=user, id=order_id).values(
+        *_lookups(order_fields, ORDER_FIELDS, ORDER_VERSION)
+    ).first()
+    if row is None:
+        raise NotFound(f"No order {order_id}.")
+
+    items = []
+    if 'items' in fields:
+        items = list(
+            OrderItem.objects.filter(order_id=order_id).order_by('id')
+            .values(*ORDER_ITEM_FIELDS.values(), *ORDER_ITEM_VERSION)
+        )
+
+    def build():
+        body = _shape(row, order_fields, ORDER_FIELDS)
+        if 'items' in fields:
+            body['items'] = [_shape(item, ORDER_ITEM_FIELDS, ORDER_ITEM_FIELDS) for item in items]
+        return body
+
+    return _respond(
+        request, [*_versions([row], ORDER_VERSION), *_versions(items, ORDER_ITEM_VERSION)], build, private=True,
+    )
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import api
+
+app_name = 'api'
+
+# No trailing slashes: these are resource URLs, not pages
+urlpatterns = [
+    path('products', api.products, name='products'),
+    path('products/<slug:slug>', api.product_detail, name='product_detail'),
+    path('cart', api.cart, name='cart'),
+    path('orders', api.orders, name='orders'),
+    path('orders/<int:order_id>', api.order_detail, name='order_detail'),
+]
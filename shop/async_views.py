@@ -0,0 +1,63 @@
+"""
+Async versions of the read-heavy views, served when running under ASGI
+(``ecommerce_site.asgi`` sets ``ASYNC_VIEWS``; see ``shop.urls``).
+
+Database reads use the async ORM, so a worker is free to serve other
+clients while queries run and while slow clients receive their responses.
+Template rendering stays synchronous: context processors and lazy objects
+such as ``request.user`` may still query, so it runs via ``sync_to_async``.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import render
+
+from . import catalog, orders, reservations
+from .caching import cache_page_for_anonymous
+from .models import HeroSection, Product
+
+
+async def arender(request, template_name, context):
+    # The templates read request.user synchronously; give them the user
+    # already loaded by request.auser() instead of a lazy object that would
+    # query it a second time
+    request.user = await request.auser()
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@cache_page_for_anonymous(lambda: ['hero'])
+async def index(request):
+    hero = await HeroSection.objects.filter(is_active=True).order_by('-id').afirst()
+    return await arender(request, "shop/index.html", {"hero": hero})
+
+
+@cache_page_for_anonymous(lambda: ['catalog'])
+async def product_list(request):
+    page = await catalog.aproduct_page(request.GET)
+    return await arender(request, 'shop/product_list.html', {
+        'products': page.products,
+        'next_cursor': page.next_cursor,
+        'filters': page.filters,
+        'categories': await catalog.acategory_choices(),
+        'sorts': [(key, label) for key, (label, _, _) in catalog.SORTS.items()],
+    })
+
+
+@cache_page_for_anonymous(lambda slug: [f'product:{slug}'])
+async def product_detail(request, slug):
+    try:
+        product = await Product.objects.annotate(available=reservations.available()).aget(slug=slug)
+    except Product.DoesNotExist:
+        raise Http404("No Product matches the given query.")
+    return await arender(request, 'shop/product_detail.html', {
+        'product': product
+    })
+
+
+@login_required
+async def order_history(request):
+    page = await orders.aorder_history_page(await request.auser(), request.GET.get('page'))
+    return await arender(request, 'shop/order_history.html', {
+        'orders': page.object_list,
+        'page_obj': page,
+    })
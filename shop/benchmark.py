@@ -0,0 +1,366 @@
+"""
+Benchmark harness for the storefront views.
+
+``seed()`` builds a deterministic synthetic catalog with users and order
+history. Scenarios then drive the real views through the Django test client,
+so every request passes through the URLconf, middleware, templates and
+database exactly as in production:
+
+* ``run_scenarios()`` runs each scenario sequentially and records latency
+  and SQL query counts, which are checked against ``QUERY_BUDGETS``.
+* ``run_load()`` replays a scenario mix from several threads at once and
+  reports throughput and latency percentiles under contention.
+* ``run_drop()`` has hundreds of shoppers race for a few units of one
+  product through ``shop.reservations`` and checks nothing was oversold.
+
+Every scenario signs in a seeded user, so catalog pages bypass the anonymous
+page cache and their query counts reflect the view itself.
+``manage.py benchmark`` wraps this module and runs it against a throwaway
+database.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connections
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from . import pricing, reservations
+from .models import CartItem, Category, Order, OrderItem, Product, StockReservation
+from .profiling import Profile
+
+Scale = namedtuple('Scale', 'categories products users orders_per_user items_per_order')
+DEFAULT_SCALE = Scale(categories=20, products=2000, users=50, orders_per_user=10, items_per_order=3)
+
+Sample = namedtuple('Sample', 'scenario seconds queries duplicates status')
+
+# Most SQL queries one request of each scenario may run
+# Every scenario is signed in, so each count includes the session read
+QUERY_BUDGETS = {
+    'product_list': 5,
+    'product_detail': 5,
+    'add_to_cart': 7,
+    'cart_view': 5,
+    'place_order': 16,
+    'order_history': 7,
+    'download_invoice': 7,
+}
+
+SEED_BATCH_SIZE = 1000
+
+
+# ================= SEEDING =================
+
+class BenchData:
+    """Ids of the seeded rows the scenarios pick from."""
+
+    def __init__(self, user_ids, product_ids, product_slugs, orders_by_user):
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+        self.product_slugs = product_slugs
+        self.orders_by_user = orders_by_user
+
+
+def seed(scale=DEFAULT_SCALE, seed=0, prefix='bench'):
+    """Create the synthetic dataset; the same ``seed`` always gives the same data."""
+    rng = random.Random(seed)
+
+    Category.objects.bulk_create([
+        Category(name=f"{prefix.title()} category {i}", slug=f"{prefix}-category-{i}")
+        for i in range(scale.categories)
+    ])
+    category_ids = list(
+        Category.objects.filter(slug__startswith=f"{prefix}-category-").values_list('id', flat=True)
+    )
+
+    Product.objects.bulk_create(
+        (
+            Product(
+                category_id=rng.choice(category_ids),
+                name=f"{prefix.title()} artwork {i}",
+                slug=f"{prefix}-artwork-{i}",
+                description=f"Synthetic benchmark product number {i}",
+                price=Decimal(rng.randint(100, 100000)) / 100,
+                stock=10 ** 6,
+            )
+            for i in range(scale.products)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    products = list(
+        Product.objects.filter(slug__startswith=f"{prefix}-artwork-").values_list('id', 'slug', 'price', 'category__tax_rate')
+    )
+
+    User.objects.bulk_create(
+        (User(username=f"{prefix}-user-{i}", password='!') for i in range(scale.users)),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    user_ids = list(User.objects.filter(username__startswith=f"{prefix}-user-").values_list('id', flat=True))
+
+    # Orders are created first so their ids can be paired with their lines
+    lines = []
+    orders = []
+    for user_id in user_ids:
+        for _ in range(scale.orders_per_user):
+            picked = rng.sample(products, min(scale.items_per_order, len(products)))
+            priced = pricing.price_lines([
+                pricing.Line(price, rng.randint(1, 3), tax_rate) for _, _, price, tax_rate in picked
+            ])
+            orders.append(Order(user_id=user_id, **pricing.order_fields(priced)))
+            lines.append(list(zip(picked, priced.lines)))
+    Order.objects.bulk_create(orders, batch_size=SEED_BATCH_SIZE)
+    if orders and orders[0].pk is None:
+        orders = list(Order.objects.filter(user_id__in=user_ids).order_by('id'))
+
+    OrderItem.objects.bulk_create(
+        (
+            OrderItem(order_id=order.pk, product_id=product[0], **pricing.item_fields(line))
+            for order, order_lines in zip(orders, lines)
+            for product, line in order_lines
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+
+    orders_by_user = {}
+    for order in orders:
+        orders_by_user.setdefault(order.user_id, []).append(order.pk)
+    return BenchData(
+        user_ids,
+        [pk for pk, _, _, _ in products],
+        [slug for _, slug, _, _ in products],
+        orders_by_user,
+    )
+
+
+# ================= SCENARIOS =================
+# Each scenario does its untimed setup and returns the request to time as
+# (method, path, POST data).
+
+class Context:
+    """Per-thread state: a signed-in client and its own random stream."""
+
+    def __init__(self, data, user_id, seed=0):
+        self.data = data
+        self.user_id = user_id
+        self.rng = random.Random(seed)
+        self.client = Client()
+        self.client.force_login(User.objects.get(pk=user_id))
+
+
+def _product_list(ctx):
+    sort = ctx.rng.choice(['newest', 'price_asc', 'price_desc'])
+    return 'get', f"{reverse('shop:product_list')}?sort={sort}", None
+
+
+def _product_detail(ctx):
+    return 'get', reverse('shop:product_detail', args=[ctx.rng.choice(ctx.data.product_slugs)]), None
+
+
+def _add_to_cart(ctx):
+    product_id = ctx.rng.choice(ctx.data.product_ids)
+    return 'post', reverse('shop:add_to_cart', args=[product_id]), {'quantity': 1}
+
+
+def _cart_view(ctx):
+    return 'get', reverse('shop:cart'), None
+
+
+def _place_order(ctx):
+    product_ids = ctx.rng.sample(ctx.data.product_ids, 3)
+    CartItem.objects.filter(user_id=ctx.user_id).delete()
+    CartItem.objects.bulk_create([CartItem(user_id=ctx.user_id, product_id=pk, quantity=1) for pk in product_ids])
+    return 'post', reverse('shop:place_order'), {}
+
+
+def _order_history(ctx):
+    return 'get', reverse('shop:order_history'), None
+
+
+def _download_invoice(ctx):
+    order_id = ctx.rng.choice(ctx.data.orders_by_user[ctx.user_id])
+    return 'get', reverse('shop:download_invoice', args=[order_id]), None
+
+
+SCENARIOS = {
+    'product_list': _product_list,
+    'product_detail': _product_detail,
+    'add_to_cart': _add_to_cart,
+    'cart_view': _cart_view,
+    'place_order': _place_order,
+    'order_history': _order_history,
+    'download_invoice': _download_invoice,
+}
+
+
+def measure(name, ctx):
+    method, path, data = SCENARIOS[name](ctx)
+    profile = Profile()
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(profile))
+        start = time.perf_counter()
+        response = getattr(ctx.client, method)(path, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        seconds = time.perf_counter() - start
+    return Sample(name, seconds, profile.sql_count, profile.duplicate_count(), response.status_code)
+
+
+# ================= RUNNERS =================
+
+def run_scenarios(data, names=None, iterations=20, seed=0):
+    """Run each scenario ``iterations`` times in turn on one client."""
+    ctx = Context(data, data.user_ids[0], seed)
+    samples = []
+    for name in names or SCENARIOS:
+        measure(name, ctx)  # warm-up: template loading, first invoice render
+        samples += [measure(name, ctx) for _ in range(iterations)]
+    return samples
+
+
+def run_load(data, names=None, concurrency=8, requests=500, seed=0):
+    """
+    Replay ``requests`` randomly mixed scenario runs from ``concurrency``
+    threads, each signed in as a different seeded user.
+
+    Returns ``(samples, elapsed seconds)``.
+    """
+    names = list(names or SCENARIOS)
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker(index):
+        ctx = Context(data, data.user_ids[index % len(data.user_ids)], seed + index)
+        samples = []
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return samples
+                    remaining[0] -= 1
+                samples.append(measure(ctx.rng.choice(names), ctx))
+        finally:
+            close_old_connections()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return [sample for samples in results for sample in samples], elapsed
+
+
+# ================= CONTENTION =================
+
+Drop = namedtuple('Drop', 'shoppers threads stock reserved sold_out errors elapsed latencies problems')
+
+
+def run_drop(shoppers=300, threads=32, stock=100, quantity=1, prefix='drop'):
+    """
+    A limited drop: ``shoppers`` users, spread over ``threads`` threads,
+    each try to reserve ``quantity`` units of one product that has ``stock``.
+
+    Afterwards the winners release their holds again. ``problems`` lists any
+    broken invariant: oversold units, holds out of step with
+    ``Product.reserved``, or errors such as deadlocks.
+    """
+    category, _ = Category.objects.get_or_create(slug=f'{prefix}-category', defaults={'name': 'Drop'})
+    product = Product.objects.create(
+        category=category, name=f"{prefix.title()} edition", slug=f'{prefix}-edition',
+        price=Decimal('999.00'), stock=stock,
+    )
+    User.objects.bulk_create(
+        (User(username=f"{prefix}-user-{i}", password='!') for i in range(shoppers)),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    user_ids = list(User.objects.filter(username__startswith=f"{prefix}-user-").values_list('id', flat=True))
+
+    def attempt(user_id):
+        start = time.perf_counter()
+        try:
+            outcome = reservations.reserve(user_id, product, quantity)
+        except Exception as exc:
+            outcome = exc
+        finally:
+            close_old_connections()
+        return outcome, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(attempt, user_ids))
+    elapsed = time.perf_counter() - start
+
+    winners = [user_id for user_id, (outcome, _) in zip(user_ids, results) if outcome is True]
+    errors = [outcome for outcome, _ in results if isinstance(outcome, Exception)]
+    product.refresh_from_db()
+    held = StockReservation.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+
+    problems = [f"{type(exc).__name__}: {exc}" for exc in errors[:5]]
+    expected = min(len(user_ids), stock // quantity) * quantity
+    if product.reserved != held or held != len(winners) * quantity:
+        problems.append(f"reserved={product.reserved} but holds add up to {held} for {len(winners)} winners")
+    elif held > stock:
+        problems.append(f"oversold: {held} units held, {stock} in stock")
+    elif held != expected and not errors:
+        problems.append(f"only {held} of {expected} units were reserved")
+
+    def give_back(user_id):
+        try:
+            reservations.release(user_id, product)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(give_back, winners))
+    product.refresh_from_db()
+    if product.reserved or StockReservation.objects.filter(product=product).exists():
+        problems.append(f"{product.reserved} units still reserved after every winner released")
+
+    return Drop(
+        shoppers=len(user_ids), threads=threads, stock=stock,
+        reserved=len(winners), sold_out=len(results) - len(winners) - len(errors), errors=len(errors),
+        elapsed=elapsed, latencies=sorted(seconds for _, seconds in results), problems=problems,
+    )
+
+
+# ================= REPORTING =================
+
+Summary = namedtuple('Summary', 'scenario count errors p50 p90 p99 mean max_queries duplicates')
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    by_name = {}
+    for sample in samples:
+        by_name.setdefault(sample.scenario, []).append(sample)
+
+    summaries = []
+    for name, group in by_name.items():
+        seconds = sorted(sample.seconds for sample in group)
+        summaries.append(Summary(
+            scenario=name,
+            count=len(group),
+            errors=sum(1 for sample in group if sample.status >= 400),
+            p50=_percentile(seconds, 0.5),
+            p90=_percentile(seconds, 0.9),
+            p99=_percentile(seconds, 0.99),
+            mean=sum(seconds) / len(seconds),
+            max_queries=max(sample.queries for sample in group),
+            duplicates=max(sample.duplicates for sample in group),
+        ))
+    return summaries
+
+
+def over_budget(summaries, budgets=QUERY_BUDGETS):
+    """Summaries whose worst-case query count exceeds the scenario's budget."""
+    return [s for s in summaries if s.scenario in budgets and s.max_queries > budgets[s.scenario]]
@@ -0,0 +1,158 @@
+"""
+Catalog page caching.
+
+Full pages are cached for anonymous visitors only, keyed by URL + query
+string plus the current version of every namespace the page depends on
+("catalog", "hero", "product:<slug>"). Model signals bump those versions, so
+invalidation touches one small key per namespace and stale pages simply stop
+being addressed and age out of the cache.
+
+Every worker has to see a bump, so the page cache needs a cache shared
+between processes (Redis, Memcached, database). It is off by default with a
+per-process backend such as LocMemCache, where a bump in one worker leaves
+the others serving stale pages until they time out.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.checks import Tags, Warning, register
+
+from .cart import CART_COOKIE
+from .profiling import timer
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 60 * 10)
+VERSION_TIMEOUT = None  # versions never expire on their own
+
+# Backends that keep their entries inside one process
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def shared_cache():
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+# None: on whenever the default cache is shared between processes
+PAGE_CACHE_ENABLED = getattr(settings, 'CATALOG_PAGE_CACHE', None)
+if PAGE_CACHE_ENABLED is None:
+    PAGE_CACHE_ENABLED = shared_cache()
+
+
+@register(Tags.caches)
+def check_page_cache_backend(app_configs, **kwargs):
+    if PAGE_CACHE_ENABLED and not shared_cache():
+        return [Warning(
+            "The catalog page cache is on with a per-process cache backend: other "
+            "workers never see a version bump and keep serving stale pages.",
+            hint="Set REDIS_URL (or another shared CACHES backend), or run a single worker.",
+            id='shop.W001',
+        )]
+    return []
+
+
+def _version_key(namespace):
+    return f"cache-version:{namespace}"
+
+
+def get_versions(namespaces):
+    keys = {_version_key(ns): ns for ns in namespaces}
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, VERSION_TIMEOUT)
+        found.update(missing)
+    return [str(found[key]) for key in keys]
+
+
+async def aget_versions(namespaces):
+    keys = {_version_key(ns): ns for ns in namespaces}
+    found = await cache.aget_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        await cache.aset_many(missing, VERSION_TIMEOUT)
+        found.update(missing)
+    return [str(found[key]) for key in keys]
+
+
+def bump(*namespaces):
+    # A timestamp rather than a counter, so a version key that was evicted
+    # can never come back with a value an old page was stored under.
+    now = time.time_ns()
+    cache.set_many({_version_key(ns): now for ns in namespaces}, VERSION_TIMEOUT)
+
+
+def _cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and CART_COOKIE not in request.COOKIES
+        and 'messages' not in request.COOKIES
+    )
+
+
+async def _acacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or CART_COOKIE in request.COOKIES or 'messages' in request.COOKIES:
+        return False
+    user = await request.auser()
+    return not user.is_authenticated
+
+
+def _cacheable_response(response):
+    return response.status_code == 200 and not response.cookies and not response.streaming
+
+
+def _page_key(request, versions):
+    url = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    # Pages link content-hashed assets; a deploy with new assets starts fresh
+    assets = getattr(staticfiles_storage, 'manifest_hash', '')
+    return f"page:{url}:{assets}:{':'.join(versions)}"
+
+
+def cache_page_for_anonymous(namespaces, timeout=PAGE_CACHE_TIMEOUT):
+    """
+    Cache a view's full response for anonymous visitors.
+
+    ``namespaces`` is a function of the view's keyword arguments returning
+    the version namespaces the page depends on. Works for sync and async
+    views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not PAGE_CACHE_ENABLED or not await _acacheable_request(request):
+                    return await view(request, *args, **kwargs)
+                with timer('cache'):
+                    key = _page_key(request, await aget_versions(namespaces(**kwargs)))
+                    response = await cache.aget(key)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if _cacheable_response(response):
+                        await cache.aset(key, response, timeout)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not PAGE_CACHE_ENABLED or not _cacheable_request(request):
+                return view(request, *args, **kwargs)
+            with timer('cache'):
+                key = _page_key(request, get_versions(namespaces(**kwargs)))
+                response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if _cacheable_response(response):
+                    cache.set(key, response, timeout)
+            return response
+
+        return wrapper
+    return decorator
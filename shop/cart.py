@@ -0,0 +1,394 @@
+"""
+Cart service.
+
+Two interchangeable storage backends sit behind ``get_cart(request)``:
+
+* ``CookieCart`` keeps anonymous carts in a signed cookie of their own, so
+  browsing and adding to cart touches no database tables, not even the
+  sessions table. ``CartCookieMiddleware`` writes the cookie back.
+* ``DatabaseCart`` stores ``CartItem`` rows for logged-in users.
+
+When a user logs in, ``merge_cookie_cart`` folds the cookie cart into
+their ``CartItem`` rows with a single bulk upsert and holds the added units.
+
+Database cart mutations never exceed ``Product.stock`` and hold the line's
+units for the user (see ``shop.reservations``); ``InsufficientStock`` is
+raised when the units are not free. Cookie carts hold nothing until checkout.
+
+Database totals are computed with one aggregate query and the per-user
+summary (item count + total) is kept in Django's cache so the navbar badge
+costs nothing on most requests. Every database cart mutation must call
+``invalidate_cart_summary``.
+"""
+import json
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DateTimeField, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import reservations
+from .models import CartItem, Product, StockReservation
+from .profiling import timer
+
+CART_SUMMARY_TIMEOUT = 60 * 15
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'shop.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+EMPTY_SUMMARY = {'count': 0, 'total': Decimal('0.00')}
+
+
+def _summary_key(user_id):
+    return f"cart-summary:{user_id}"
+
+
+def cart_lines(user):
+    """The user's lines with ``available`` units and when their hold (if any) runs out."""
+    now = timezone.now()
+    held_until = StockReservation.objects.filter(
+        user=OuterRef('user_id'), product=OuterRef('product_id'), expires_at__gt=now,
+    ).values('expires_at')
+    return (
+        CartItem.objects.filter(user=user).select_related('product')
+        .annotate(
+            available=reservations.available('product', now),
+            held_until=Subquery(held_until, output_field=DateTimeField()),
+        )
+        .order_by('added_at', 'id')
+    )
+
+
+def compute_cart_summary(user):
+    return CartItem.objects.filter(user=user).aggregate(
+        count=Coalesce(Sum('quantity'), 0),
+        total=Coalesce(
+            Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+def cart_summary(user):
+    if not user.is_authenticated:
+        return EMPTY_SUMMARY
+
+    key = _summary_key(user.pk)
+    with timer('cache'):
+        summary = cache.get(key)
+    if summary is None:
+        summary = compute_cart_summary(user)
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(user_id):
+    cache.delete(_summary_key(user_id))
+
+
+# ================= WRITES =================
+
+class CartError(Exception):
+    pass
+
+
+class InsufficientStock(CartError):
+    def __init__(self, product, available=None):
+        self.product = product
+        self.available = product.stock if available is None else available
+        super().__init__(f"Only {self.available} of {product.name} left in stock")
+
+
+def _check_stock(product, quantity):
+    if quantity < 1:
+        raise CartError("Quantity must be at least 1")
+    if quantity > product.stock:
+        raise InsufficientStock(product)
+
+
+def _upsert_add(user_id, product_id, quantity):
+    """
+    Add ``quantity`` to the user's line for ``product_id`` in one statement.
+
+    The increment happens in SQL (``quantity = quantity + excluded.quantity``)
+    so concurrent adds cannot overwrite each other, and both the insert and
+    the update only go through while the line stays within ``Product.stock``.
+    ``bulk_create(update_conflicts=True)`` can only assign the new value, not
+    increment it, hence the raw ``ON CONFLICT`` upsert. Returns False when the
+    stock condition rejected the write.
+    """
+    vendor = connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        return _add_fallback(user_id, product_id, quantity)
+
+    qn = connection.ops.quote_name
+    cart_table = qn(CartItem._meta.db_table)
+    product_table = qn(Product._meta.db_table)
+    stock = f"(SELECT {qn('stock')} FROM {product_table} WHERE {qn('id')} = %s)"
+    columns = ', '.join(qn(column) for column in ('user_id', 'product_id', 'quantity', 'added_at', 'updated_at'))
+    sql = (
+        f"INSERT INTO {cart_table} ({columns}) "
+        f"SELECT %s, %s, %s, %s, %s WHERE %s <= {stock} "
+        f"ON CONFLICT ({qn('user_id')}, {qn('product_id')}) DO UPDATE "
+        f"SET {qn('quantity')} = {cart_table}.{qn('quantity')} + excluded.{qn('quantity')}, "
+        f"{qn('updated_at')} = excluded.{qn('updated_at')} "
+        f"WHERE {cart_table}.{qn('quantity')} + excluded.{qn('quantity')} <= {stock}"
+    )
+    now = timezone.now()
+    params = [user_id, product_id, quantity, now, now, quantity, product_id, product_id]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
+def _add_fallback(user_id, product_id, quantity):
+    # Backends without INSERT ... ON CONFLICT: conditional F() update, and
+    # insert only when the line does not exist yet.
+    items = CartItem.objects.filter(
+        user_id=user_id,
+        product_id=product_id,
+        product__stock__gte=F('quantity') + quantity,
+    )
+    if items.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+        return True
+    if CartItem.objects.filter(user_id=user_id, product_id=product_id).exists():
+        return False
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(user_id=user_id, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        return bool(items.update(quantity=F('quantity') + quantity, updated_at=timezone.now()))
+    return True
+
+
+# ================= BACKENDS =================
+
+class DatabaseCart:
+    def __init__(self, user):
+        self.user = user
+
+    def lines(self):
+        return cart_lines(self.user)
+
+    def summary(self):
+        return cart_summary(self.user)
+
+    def add(self, product, quantity):
+        _check_stock(product, quantity)
+        with transaction.atomic():
+            if not _upsert_add(self.user.pk, product.pk, quantity):
+                raise InsufficientStock(product)
+            if not reservations.reserve(self.user.pk, product, quantity):
+                raise InsufficientStock(product, reservations.units_available(product.pk))
+        invalidate_cart_summary(self.user.pk)
+
+    def update(self, product_id, quantity):
+        items = CartItem.objects.filter(user=self.user, product_id=product_id)
+        product = Product.objects.only('name', 'slug', 'stock').filter(pk=product_id).first()
+        with transaction.atomic():
+            if product is None:
+                items.delete()
+            elif quantity > 0:
+                # One UPDATE; the stock condition is evaluated by the database
+                if not items.filter(product__stock__gte=quantity).update(quantity=quantity, updated_at=timezone.now()):
+                    if items.exists():
+                        raise InsufficientStock(product)
+                elif not reservations.set_hold(self.user.pk, product, quantity):
+                    raise InsufficientStock(product, reservations.units_available(product.pk))
+            else:
+                items.delete()
+                reservations.release(self.user.pk, product)
+        invalidate_cart_summary(self.user.pk)
+
+
+class CookieCartLine:
+    held_until = None
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.available = product.available
+
+    def subtotal(self):
+        return self.product.price * self.quantity
+
+
+def _read_cookie(request):
+    raw = request.get_signed_cookie(CART_COOKIE, default=None, salt=CART_COOKIE_SALT)
+    try:
+        data = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class CookieCart:
+    """
+    ``{product_id: {"quantity": n, "price": "9.99"}}`` stored in the signed
+    ``cart`` cookie. Changes are kept on the request until
+    ``CartCookieMiddleware`` sets the cookie on the response.
+
+    The price is a snapshot used only for the navbar summary; ``lines()``
+    refreshes it from the current product prices.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def data(self):
+        if not hasattr(self.request, '_cart_data'):
+            self.request._cart_data = _read_cookie(self.request)
+        return self.request._cart_data
+
+    def _save(self, data):
+        self.request._cart_data = data
+        self.request._cart_changed = True
+
+    def lines(self):
+        data = self.data
+        products = Product.objects.annotate(available=reservations.available()).in_bulk([int(pk) for pk in data])
+
+        lines = []
+        fresh = {}
+        for pk, entry in data.items():
+            product = products.get(int(pk))
+            if product is None:
+                continue
+            lines.append(CookieCartLine(product, entry['quantity']))
+            fresh[pk] = {'quantity': entry['quantity'], 'price': str(product.price)}
+
+        if fresh != data:
+            self._save(fresh)
+        return lines
+
+    def summary(self):
+        data = self.data
+        return {
+            'count': sum(entry['quantity'] for entry in data.values()),
+            'total': sum(
+                (Decimal(entry['price']) * entry['quantity'] for entry in data.values()),
+                Decimal('0.00'),
+            ),
+        }
+
+    def add(self, product, quantity):
+        data = dict(self.data)
+        entry = data.get(str(product.pk), {'quantity': 0})
+        _check_stock(product, entry['quantity'] + quantity)
+        data[str(product.pk)] = {'quantity': entry['quantity'] + quantity, 'price': str(product.price)}
+        self._save(data)
+
+    def update(self, product_id, quantity):
+        data = dict(self.data)
+        key = str(product_id)
+        if key not in data:
+            return
+        product = Product.objects.only('name', 'stock').filter(pk=product_id).first()
+        if product is not None and quantity > 0:
+            _check_stock(product, quantity)
+            data[key] = {**data[key], 'quantity': quantity}
+        else:
+            # Removed, or the product no longer exists
+            del data[key]
+        self._save(data)
+
+    def clear(self):
+        if self.data:
+            self._save({})
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return DatabaseCart(request.user)
+    return CookieCart(request)
+
+
+def merge_cookie_cart(request, user):
+    """
+    Fold the request's anonymous cart into ``user``'s CartItem rows with a
+    single bulk upsert, holding the added units like any other add. Lines
+    are capped at the units still free; returns the products that could not
+    be added in full.
+    """
+    cookie_cart = CookieCart(request)
+    quantities = {int(pk): entry['quantity'] for pk, entry in cookie_cart.data.items()}
+    if not quantities:
+        return []
+
+    products = (
+        Product.objects.annotate(available=reservations.available())
+        .only('name', 'slug', 'stock').in_bulk(list(quantities))
+    )
+    short = []
+    with transaction.atomic():
+        existing = dict(
+            CartItem.objects.filter(user=user, product_id__in=products)
+            .values_list('product_id', 'quantity')
+        )
+        added = {}
+        for pk, product in products.items():
+            extra = max(0, min(quantities[pk], product.available, product.stock - existing.get(pk, 0)))
+            if extra < quantities[pk]:
+                short.append(product)
+            if extra:
+                added[pk] = extra
+
+        CartItem.objects.bulk_create(
+            [CartItem(user=user, product_id=pk, quantity=existing.get(pk, 0) + extra) for pk, extra in added.items()],
+            update_conflicts=True,
+            unique_fields=['user', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        for pk, extra in added.items():
+            if reservations.reserve(user.pk, products[pk], extra):
+                continue
+            # Taken by another shopper since ``available`` was read
+            line = CartItem.objects.filter(user=user, product_id=pk)
+            if existing.get(pk):
+                line.update(quantity=existing[pk], updated_at=timezone.now())
+            else:
+                line.delete()
+            short.append(products[pk])
+
+    cookie_cart.clear()
+    invalidate_cart_summary(user.pk)
+    return short
+
+
+class CartCookieMiddleware:
+    """Set (or delete) the cart cookie when a ``CookieCart`` changed. Sync and async capable."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._finish(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._finish(request, await self.get_response(request))
+
+    def _finish(self, request, response):
+        if not getattr(request, '_cart_changed', False):
+            return response
+        if request._cart_data:
+            response.set_signed_cookie(
+                CART_COOKIE, json.dumps(request._cart_data, separators=(',', ':')), salt=CART_COOKIE_SALT,
+                max_age=CART_COOKIE_MAX_AGE, secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(CART_COOKIE, samesite='Lax')
+        return response
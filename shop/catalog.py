@@ -0,0 +1,130 @@
+"""
+Catalog listing queries.
+
+Pages are fetched with keyset (cursor) pagination instead of OFFSET, so the
+cost of a page does not depend on how deep into the catalog it is: every sort
+order maps onto a composite index that ends in ``id`` and the cursor carries
+the sort key of the last row shown.
+"""
+import base64
+import json
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .models import Category, Product
+
+PAGE_SIZE = 24
+
+# Columns needed by product_card.html (updated_at keys its fragment cache)
+CARD_FIELDS = (
+    'id', 'name', 'slug', 'price', 'image', 'image_variants', 'created_at', 'updated_at',
+    'category__name', 'category__slug',
+)
+
+# sort name -> (label, key field, descending)
+SORTS = {
+    'newest': ('Newest', 'created_at', True),
+    'oldest': ('Oldest', 'created_at', False),
+    'price_asc': ('Price: Low to High', 'price', False),
+    'price_desc': ('Price: High to Low', 'price', True),
+}
+DEFAULT_SORT = 'newest'
+
+ProductPage = namedtuple('ProductPage', 'products next_cursor filters')
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([str(value) if isinstance(value, Decimal) else value.isoformat(), pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field, model=Product):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = model._meta.get_field(field).to_python(value)
+        return value, int(pk)
+    except (ValueError, TypeError, InvalidOperation, ValidationError):
+        return None
+
+
+def _decimal(value):
+    try:
+        number = Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+    # NaN and Infinity parse, but cannot be compared with a price column
+    return number if number is not None and number.is_finite() else None
+
+
+def parse_filters(params):
+    sort = params.get('sort') or DEFAULT_SORT
+    return {
+        'category': params.get('category') or '',
+        'min_price': _decimal(params.get('min_price')),
+        'max_price': _decimal(params.get('max_price')),
+        'sort': sort if sort in SORTS else DEFAULT_SORT,
+    }
+
+
+def filtered_products(filters):
+    products = Product.objects.select_related('category').only(*CARD_FIELDS)
+
+    if filters['category']:
+        products = products.filter(category__slug=filters['category'])
+    if filters['min_price'] is not None:
+        products = products.filter(price__gte=filters['min_price'])
+    if filters['max_price'] is not None:
+        products = products.filter(price__lte=filters['max_price'])
+
+    return products
+
+
+def page_queryset(params, page_size=PAGE_SIZE):
+    """The query for one page of products, with one extra row to detect a next page."""
+    filters = parse_filters(params)
+    _, field, descending = SORTS[filters['sort']]
+    products = filtered_products(filters)
+
+    cursor = decode_cursor(params.get('cursor') or '', field)
+    if cursor is not None:
+        value, pk = cursor
+        op = 'lt' if descending else 'gt'
+        products = products.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk})
+        )
+
+    prefix = '-' if descending else ''
+    return products.order_by(f'{prefix}{field}', f'{prefix}id')[:page_size + 1], filters
+
+
+def _page(rows, filters, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        _, field, _ = SORTS[filters['sort']]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return ProductPage(rows, next_cursor, filters)
+
+
+def product_page(params, page_size=PAGE_SIZE):
+    """Return one page of products for the query parameters in ``params``."""
+    products, filters = page_queryset(params, page_size)
+    return _page(list(products), filters, page_size)
+
+
+async def aproduct_page(params, page_size=PAGE_SIZE):
+    products, filters = page_queryset(params, page_size)
+    return _page([product async for product in products.aiterator()], filters, page_size)
+
+
+def category_choices():
+    return Category.objects.only('name', 'slug').order_by('name')
+
+
+async def acategory_choices():
+    return [category async for category in category_choices().aiterator()]
@@ -0,0 +1,148 @@
+"""
+Checkout engine.
+
+``place_order`` turns a user's cart into an ``Order`` inside one transaction
+with a fixed number of queries regardless of cart size: one cart fetch, one
+hold fetch, one order insert, one bulk insert of order lines, one
+conditional stock update covering every product, one cart delete, one hold
+delete and one job insert. The stock update consumes the user's stock
+reservations (see ``shop.reservations``). Totals and GST are computed by
+``shop.pricing`` and stored with the order.
+The cached cart summary and the products' pages are dropped once the
+transaction commits.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+
+from . import pricing, reservations
+from .caching import bump
+from .cart import invalidate_cart_summary
+from .models import CartItem, Order, OrderItem, Product
+from .tasks import enqueue
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ", ".join(product.name for product in products)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+class _StockConflict(Exception):
+    pass
+
+
+def _cart_for_update(user):
+    cart_items = CartItem.objects.filter(user=user).select_related('product__category').order_by('id')
+    features = connection.features
+    if features.has_select_for_update:
+        # Lock only the cart rows; stock is protected by the conditional
+        # UPDATE below, so product rows stay free for other shoppers.
+        if features.has_select_for_update_of:
+            cart_items = cart_items.select_for_update(of=('self',))
+        else:
+            cart_items = cart_items.select_for_update()
+    return list(cart_items)
+
+
+def _in_stock(pk, quantity, held):
+    # Held units are already set aside in ``reserved``; only the rest must be free
+    if quantity <= held:
+        return Q(pk=pk, stock__gte=quantity)
+    return Q(pk=pk, stock__gte=F('reserved') + (quantity - held))
+
+
+def _decrement(field, quantities):
+    return Case(
+        *(When(pk=pk, then=F(field) - qty) for pk, qty in quantities.items()),
+        default=F(field), output_field=PositiveIntegerField(),
+    )
+
+
+def _reserve_stock(quantities, held):
+    """
+    Decrement stock for every product in one statement, consuming the units
+    the user holds (``held``, by product id). Held products that are no
+    longer in the cart just get their units back.
+
+    Each product only matches when it still has enough stock, so if fewer rows
+    are updated than requested some product ran out and the caller's
+    transaction must be rolled back.
+    """
+    products = quantities.keys() | held.keys()
+    in_stock = reduce(or_, (_in_stock(pk, quantities.get(pk, 0), held.get(pk, 0)) for pk in products))
+    changes = {'stock': _decrement('stock', quantities)}
+    if held:
+        changes['reserved'] = _decrement('reserved', held)
+    updated = Product.objects.filter(in_stock).update(**changes)
+    return updated == len(products)
+
+
+def place_order(user, discount=pricing.ZERO):
+    """Turn ``user``'s cart into an order; ``discount`` is an order-level amount."""
+    try:
+        with transaction.atomic():
+            cart_items = _cart_for_update(user)
+            if not cart_items:
+                raise EmptyCart("Cart is empty")
+            holds = reservations.claim(user)
+            held = {hold.product_id: hold.quantity for hold in holds}
+
+            quantities = {}
+            for item in cart_items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+            priced = pricing.price_lines([
+                pricing.Line(item.product.price, item.quantity, item.product.category.tax_rate)
+                for item in cart_items
+            ], discount)
+
+            order = Order.objects.create(user=user, **pricing.order_fields(priced))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item.product, **pricing.item_fields(line))
+                for item, line in zip(cart_items, priced.lines)
+            ])
+
+            if not _reserve_stock(quantities, held):
+                raise _StockConflict
+
+            CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
+            reservations.clear(user)
+            enqueue('invoice', order_id=order.id)
+            transaction.on_commit(lambda: invalidate_cart_summary(user.pk))
+            # Availability is shown on the product pages
+            slugs = {item.product.slug for item in cart_items} | {hold.slug for hold in holds}
+            transaction.on_commit(lambda: bump(*(f'product:{slug}' for slug in slugs)))
+    except _StockConflict:
+        # Stock is read after the rollback so the report reflects what is
+        # actually left, not the partial decrement.
+        raise OutOfStock(_short_products(cart_items, quantities, held)) from None
+
+    return order
+
+
+def _short_products(cart_items, quantities, held):
+    levels = {
+        pk: (stock, reserved)
+        for pk, stock, reserved in Product.objects.filter(pk__in=quantities).values_list('pk', 'stock', 'reserved')
+    }
+    seen = {}
+    for item in cart_items:
+        pk = item.product_id
+        in_stock, reserved = levels.get(pk, (0, 0))
+        need, own = quantities[pk], held.get(pk, 0)
+        free = in_stock if need <= own else in_stock - reserved + own
+        if free < need:
+            seen.setdefault(pk, item.product)
+    return list(seen.values())
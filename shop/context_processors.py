@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
+
+
+def cart(request):
+    # Lazy so responses that never render the navbar skip the cache lookup
+    return {
+        'cart_summary': SimpleLazyObject(lambda: get_cart(request).summary()),
+    }
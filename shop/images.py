@@ -0,0 +1,132 @@
+"""
+Responsive image derivatives.
+
+For every uploaded ``Product.image`` / ``HeroSection.background_image`` we
+store resized copies at a few widths in modern formats next to the original,
+under ``derivatives/<content hash>/<width>.<ext>``. Because the path is
+content-addressed, identical uploads share derivatives and an unchanged
+image is never processed twice.
+
+Generation never happens on the request path: saving a model enqueues an
+``image_variants`` job, and ``manage.py generate_thumbnails`` backfills in a
+process pool. The result is written to the model's ``*_variants`` JSON field
+so templates can build ``srcset`` without touching storage.
+"""
+import hashlib
+from functools import cache
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .caching import bump
+from .models import HeroSection, Product
+
+WIDTHS = (320, 640, 1024, 1600)
+
+
+@cache
+def formats():
+    """(format, extension, mime type, save options), best first."""
+    # Pillow is only needed by the workers generating variants, so it is
+    # not imported with the models' signal handlers
+    from PIL import features
+
+    found = [
+        ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+        ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    ]
+    if features.check('avif'):
+        found.insert(0, ('AVIF', 'avif', 'image/avif', {'quality': 60}))
+    return found
+
+
+# model label -> (model, image field, variants field, cache namespaces)
+TARGETS = {
+    'product': (Product, 'image', 'image_variants', lambda obj: ['catalog', f'product:{obj.slug}']),
+    'hero': (HeroSection, 'background_image', 'background_variants', lambda obj: ['hero']),
+}
+
+
+def _target_widths(original_width):
+    widths = {width for width in WIDTHS if width < original_width}
+    widths.add(min(original_width, WIDTHS[-1]))
+    return sorted(widths)
+
+
+def build_variants(field_file, storage=default_storage):
+    """
+    Return the variants dict for ``field_file``, creating missing files.
+
+    ``{"source": name, "hash": ..., "width": w, "height": h,
+    "formats": {"image/webp": {"320": name, ...}, ...}}``
+    """
+    with field_file.open('rb') as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        original_width, original_height = image.size
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        manifest = {}
+        for fmt, ext, mime, options in formats():
+            names = {}
+            for width in _target_widths(original_width):
+                name = f"derivatives/{digest}/{width}.{ext}"
+                if not storage.exists(name):
+                    height = round(original_height * width / original_width)
+                    resized = image.resize((width, height), Image.LANCZOS)
+                    if fmt == 'JPEG':
+                        resized = resized.convert('RGB')
+                    buffer = BytesIO()
+                    resized.save(buffer, fmt, **options)
+                    saved = storage.save(name, ContentFile(buffer.getvalue()))
+                    if saved != name:
+                        # Another worker wrote the same derivative first
+                        storage.delete(saved)
+                names[str(width)] = name
+            manifest[mime] = names
+
+    return {
+        'source': field_file.name,
+        'hash': digest,
+        'width': original_width,
+        'height': original_height,
+        'formats': manifest,
+    }
+
+
+def refresh_variants(label, pk):
+    """Regenerate variants for one object if its image changed; returns True if updated."""
+    model, image_field, variants_field, namespaces = TARGETS[label]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return False
+
+    field_file = getattr(obj, image_field)
+    if not needs_refresh(obj, label):
+        return False
+    variants = build_variants(field_file) if field_file else {}
+
+    # update() rather than save() so no signal re-enqueues this job; bumping
+    # updated_at still retires the cached product card fragment.
+    changes = {variants_field: variants}
+    if any(field.name == 'updated_at' for field in model._meta.fields):
+        changes['updated_at'] = timezone.now()
+    model.objects.filter(pk=pk).update(**changes)
+
+    bump(*namespaces(obj))
+    return True
+
+
+def needs_refresh(obj, label):
+    _, image_field, variants_field, _ = TARGETS[label]
+    field_file = getattr(obj, image_field)
+    current = getattr(obj, variants_field) or {}
+    return (field_file.name or '') != current.get('source', '')
@@ -0,0 +1,246 @@
+"""
+Bulk catalog import.
+
+CSV and JSONL files are parsed one record at a time and written in batches:
+categories are resolved by slug from an in-memory map (missing ones are
+created with a single ``bulk_create`` per batch) and products are upserted by
+slug with ``bulk_create(update_conflicts=True)``. Only one batch is ever held
+in memory, so the size of the file does not matter.
+
+A record that fails validation is reported and skipped; if the database
+rejects a whole batch, its rows are retried one by one so only the offending
+rows are lost. Bulk writes fire no model signals, so every batch refreshes the
+search index and page cache versions itself.
+
+Columns: ``category`` (slug), ``category_name`` (optional), ``name``,
+``slug`` (optional, derived from the name), ``description``, ``price``,
+``stock``. Images are not imported; upload them through the admin.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import DatabaseError, transaction
+from django.utils.text import slugify
+
+from .caching import bump
+from .models import Category, Product
+from .search import index_queryset
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'jsonl')
+
+UPDATE_FIELDS = ['category', 'name', 'description', 'price', 'stock', 'updated_at']
+
+
+class ImportReport:
+    """Counts and the first ``MAX_REPORTED_ERRORS`` row errors of an import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.categories_created = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+# ================= PARSING =================
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def iter_records(stream, fmt):
+    """Yield ``(line number, record dict or error message)`` from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as exc:
+            yield line, f"Invalid JSON: {exc}"
+            continue
+        yield line, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def _text(record, key):
+    value = record.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def clean_record(record):
+    """Return a dict of cleaned product values or raise ``ValidationError``."""
+    name = _text(record, 'name')
+    if not name:
+        raise ValidationError("name is required")
+    if len(name) > 200:
+        raise ValidationError("name is longer than 200 characters")
+
+    slug = _text(record, 'slug') or slugify(name)
+    category = _text(record, 'category')
+    if not category:
+        raise ValidationError("category is required")
+    for label, value in (('slug', slug), ('category', category)):
+        try:
+            validate_slug(value)
+        except ValidationError:
+            raise ValidationError(f"{label} {value!r} is not a valid slug")
+
+    try:
+        price = Decimal(_text(record, 'price')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValidationError(f"price {record.get('price')!r} is not a number")
+    # NaN survives quantize(), and comparing it raises InvalidOperation
+    if not price.is_finite():
+        raise ValidationError(f"price {record.get('price')!r} is not a number")
+    if price < 0 or price >= Decimal('1e8'):
+        raise ValidationError(f"price {price} is out of range")
+
+    try:
+        stock = int(_text(record, 'stock') or 0)
+    except ValueError:
+        raise ValidationError(f"stock {record.get('stock')!r} is not an integer")
+    if stock < 0:
+        raise ValidationError("stock cannot be negative")
+
+    return {
+        'slug': slug,
+        'name': name,
+        'description': _text(record, 'description'),
+        'price': price,
+        'stock': stock,
+        'category': category,
+        'category_name': _text(record, 'category_name')[:100] or category.replace('-', ' ').title(),
+    }
+
+
+# ================= WRITING =================
+
+def _resolve_categories(rows, category_ids, report):
+    missing = {}
+    for row in rows:
+        if row['category'] not in category_ids:
+            missing.setdefault(row['category'], row['category_name'])
+    if not missing:
+        return
+
+    existing = dict(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+    new = {slug: name for slug, name in missing.items() if slug not in existing}
+    if new:
+        # ignore_conflicts silently drops slugs another import has created
+        # since the lookup above, so count what the insert actually added
+        created = Category.objects.filter(slug__in=new)
+        before = created.count()
+        Category.objects.bulk_create(
+            [Category(slug=slug, name=name) for slug, name in new.items()], ignore_conflicts=True,
+        )
+        found = dict(created.values_list('slug', 'id'))
+        report.categories_created += len(found) - before
+        existing.update(found)
+    category_ids.update(existing)
+
+
+def _product(row, category_ids):
+    return Product(
+        category_id=category_ids[row['category']],
+        name=row['name'],
+        slug=row['slug'],
+        description=row['description'],
+        price=row['price'],
+        stock=row['stock'],
+    )
+
+
+def _upsert(products):
+    Product.objects.bulk_create(
+        products,
+        update_conflicts=True,
+        unique_fields=['slug'],
+        update_fields=UPDATE_FIELDS,
+    )
+
+
+def _write_batch(batch, category_ids, report):
+    # Later rows win when a file repeats a slug within one batch
+    rows = {row['slug']: (line, row) for line, row in batch}
+
+    with transaction.atomic():
+        _resolve_categories([row for _, row in rows.values()], category_ids, report)
+
+    written = []
+    try:
+        with transaction.atomic():
+            _upsert([_product(row, category_ids) for _, row in rows.values()])
+        written = list(rows)
+    except DatabaseError:
+        for slug, (line, row) in rows.items():
+            try:
+                with transaction.atomic():
+                    _upsert([_product(row, category_ids)])
+                written.append(slug)
+            except DatabaseError as exc:
+                report.error(line, str(exc))
+
+    if written:
+        index_queryset(Product.objects.filter(slug__in=written))
+        bump('catalog', *(f'product:{slug}' for slug in written))
+    report.imported += len(written)
+
+
+def import_catalog(stream, fmt='csv', batch_size=BATCH_SIZE, progress=None):
+    """
+    Import products from a text ``stream`` in ``fmt`` ('csv' or 'jsonl').
+
+    ``progress`` is called with the report after every batch.
+    """
+    report = ImportReport()
+    category_ids = {}
+    batch = []
+
+    for line, record in iter_records(stream, fmt):
+        report.rows += 1
+        if isinstance(record, str):
+            report.error(line, record)
+            continue
+        try:
+            batch.append((line, clean_record(record)))
+        except ValidationError as exc:
+            report.error(line, '; '.join(exc.messages))
+            continue
+
+        if len(batch) >= batch_size:
+            _write_batch(batch, category_ids, report)
+            batch = []
+            if progress:
+                progress(report)
+
+    if batch:
+        _write_batch(batch, category_ids, report)
+        if progress:
+            progress(report)
+    return report
+
+
+def import_uploaded_file(uploaded, fmt=None):
+    """Import a Django ``UploadedFile`` without reading it into memory."""
+    fmt = fmt or detect_format(uploaded.name)
+    stream = io.TextIOWrapper(uploaded.file, encoding='utf-8-sig', newline='')
+    try:
+        return import_catalog(stream, fmt)
+    finally:
+        stream.detach()
@@ -1,66 +1,247 @@
+import asyncio
+import hashlib
+import os
+from functools import cache
 from io import BytesIO
-from decimal import Decimal
 
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import connections
+
+from .models import Order
+from .profiling import timer
+
+
+def _items(order):
+    # Uses the prefetch cache when the caller already loaded items__product
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        return list(order.items.all())
+    return list(order.items.select_related('product'))
+
+
+def invoice_hash(order, items=None):
+    """Content hash of everything printed on the invoice."""
+    items = _items(order) if items is None else items
+    digest = hashlib.sha256()
+    digest.update(f"{LAYOUT_VERSION}|{order.id}|{order.status}|{order.created_at.isoformat()}|{order.user_id}".encode())
+    digest.update(f"|{order.subtotal}:{order.discount_total}:{order.tax_total}:{order.total_price}".encode())
+    for item in items:
+        digest.update(
+            f"|{item.id}:{item.product.name}:{item.price}:{item.quantity}:{item.tax_rate}:{item.tax}:{item.total}".encode()
+        )
+    return digest.hexdigest()[:32]
+
+
+# ================= RENDERING =================
+# Fonts and the logo are loaded once per process, the letterhead is drawn
+# once per document as a reusable form, and pagination is worked out before
+# drawing so every page can say "Page n of N" in a single pass.
+
+# Bump when the layout changes so cached PDFs are re-rendered
+LAYOUT_VERSION = 3
+
+MARGIN = 40
+ROW = 15
+TABLE_BOTTOM = 70
+COLUMNS = {'product': 40, 'price': 215, 'qty': 290, 'rate': 325, 'tax': 365, 'total': 450}
+PRODUCT_WIDTH = COLUMNS['price'] - COLUMNS['product'] - 10
+# Blank row plus subtotal, discount, GST and total
+TOTALS_ROWS = 6
+# Logo box in points, and pixels per point it is rasterised at (216 dpi)
+LOGO_SIZE = (120, 50)
+LOGO_SCALE = 3
+
+
+class InvoiceResources:
+    def __init__(self, regular, bold, currency, logo):
+        self.regular = regular
+        self.bold = bold
+        self.currency = currency
+        self.logo = logo
+
+
+@cache
+def resources():
+    """Fonts and logo, loaded once per process."""
+    from reportlab import rl_config
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    regular, bold = 'Helvetica', 'Helvetica-Bold'
+    # The standard PDF fonts have no rupee sign
+    currency = 'Rs.'
+    fonts = (getattr(settings, 'INVOICE_FONT', ''), getattr(settings, 'INVOICE_FONT_BOLD', ''))
+    if all(fonts) and all(os.path.exists(path) for path in fonts):
+        regular, bold = 'Invoice', 'Invoice-Bold'
+        pdfmetrics.registerFont(TTFont(regular, fonts[0]))
+        pdfmetrics.registerFont(TTFont(bold, fonts[1]))
+        currency = '₹'
+
+    # Binary streams as-is rather than ASCII85-encoded: smaller and faster
+    rl_config.useA85 = 0
+
+    logo = None
+    logo_path = getattr(settings, 'INVOICE_LOGO', os.path.join(settings.BASE_DIR, 'static', 'images', 'logo.png'))
+    if os.path.exists(logo_path):
+        from PIL import Image
+
+        # Scaled to print resolution once, so each invoice embeds (and
+        # compresses) a small image instead of the full-size original
+        with Image.open(logo_path) as image:
+            image.thumbnail((LOGO_SIZE[0] * LOGO_SCALE, LOGO_SIZE[1] * LOGO_SCALE))
+            logo = ImageReader(image.convert('RGB'))
+
+    return InvoiceResources(regular, bold, currency, logo)
+
+
+def _paginate(item_count, first_rows, rows):
+    """``[(start, end)]`` item ranges per page; the totals go after the last row."""
+    pages, start, capacity = [], 0, first_rows
+    while True:
+        end = min(item_count, start + capacity)
+        pages.append((start, end))
+        if end == item_count:
+            if capacity - (end - start) < TOTALS_ROWS:
+                pages.append((end, end))
+            return pages
+        start, capacity = end, rows
 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 
+def _rows_below(header_y):
+    """Item rows that fit between a table header at ``header_y`` and the footer."""
+    return int((header_y - 20 - TABLE_BOTTOM) // ROW) + 1
+
+
+def _fit(text, font, size, width):
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    if stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + '…', font, size) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _draw_letterhead(p, res, height):
+    p.beginForm('letterhead')
+    if res.logo is not None:
+        p.drawImage(res.logo, MARGIN, height - 80, *LOGO_SIZE, preserveAspectRatio=True)
+    p.setFont(res.bold, 14)
+    p.drawString(200, height - 50, "Art Gallery")
+    p.setFont(res.regular, 10)
+    p.drawString(200, height - 65, "Hyderabad, India")
+    p.drawString(200, height - 80, "Email: support@artgallery.com")
+    p.endForm()
+
+
+def _draw_table_header(p, res, y):
+    p.setFont(res.bold, 10)
+    p.drawString(COLUMNS['product'], y, "Product")
+    p.drawString(COLUMNS['price'], y, "Price")
+    p.drawString(COLUMNS['qty'], y, "Qty")
+    p.drawString(COLUMNS['rate'], y, "GST %")
+    p.drawString(COLUMNS['tax'], y, "GST")
+    p.drawString(COLUMNS['total'], y, "Total")
+    p.line(MARGIN, y - 5, 550, y - 5)
+
+
+def _order_info(order):
+    lines = [
+        f"Order Date: {order.created_at.strftime('%d %b %Y')}",
+        f"Status: {order.status}",
+        f"Customer: {order.user.username}",
+    ]
+    if order.user.email:
+        lines.append(f"Email: {order.user.email}")
+    return lines
+
+
+def _totals(order, items):
+    """(label, amount) rows for the totals block."""
+    rows = [("Subtotal:", order.subtotal)]
+    if order.discount_total:
+        rows.append(("Discount:", -order.discount_total))
+    rates = {item.tax_rate for item in items}
+    gst = f"GST ({rates.pop().normalize():f}%):" if len(rates) == 1 else "GST:"
+    rows.append((gst, order.tax_total))
+    rows.append(("Total Payable:", order.total_price))
+    return rows
+
+
+@timer('pdf')
+def generate_invoice_pdf(order, items=None):
+    # Imported here so that loading the views (e.g. on a serverless cold
+    # start) does not pay for ReportLab
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    items = _items(order) if items is None else items
+    res = resources()
+    width, height = A4
+    money = res.currency
+
+    info = _order_info(order)
+    # Page 1 has the order details between the title and the table
+    first_header_y = height - 150 - 15 * (len(info) - 1) - 30
+    next_header_y = height - 160
+    pages = _paginate(len(items), _rows_below(first_header_y), _rows_below(next_header_y))
 
-def generate_invoice_pdf(order):
     buffer = BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+    p.setTitle(f"Invoice for Order #{order.id}")
+    _draw_letterhead(p, res, height)
+
+    for number, (start, end) in enumerate(pages, 1):
+        p.doForm('letterhead')
+
+        p.setFont(res.bold, 12)
+        if number == 1:
+            p.drawString(MARGIN, height - 130, f"Invoice for Order #{order.id}")
+            p.setFont(res.regular, 10)
+            for i, line in enumerate(info):
+                p.drawString(MARGIN, height - 150 - 15 * i, line)
+            y = first_header_y
+        else:
+            p.drawString(MARGIN, height - 130, f"Invoice for Order #{order.id} (continued)")
+            y = next_header_y
+
+        _draw_table_header(p, res, y)
 
-    # ===== HEADER =====
-    p.setFont("Helvetica-Bold", 18)
-    p.drawString(40, height - 50, "ARTISTRY HUB")
-
-    p.setFont("Helvetica", 10)
-    p.drawString(40, height - 70, f"Invoice ID: {order.id}")
-    p.drawString(40, height - 85, f"Date: {order.created_at.strftime('%d-%m-%Y')}")
-
-    # ===== CUSTOMER =====
-    p.drawString(40, height - 120, f"Customer: {order.user.username}")
-    p.drawString(40, height - 135, f"Email: {order.user.email}")
-
-    # ===== TABLE HEADER =====
-    y = height - 180
-    p.setFont("Helvetica-Bold", 11)
-    p.drawString(40, y, "Product")
-    p.drawString(280, y, "Qty")
-    p.drawString(330, y, "Price")
-    p.drawString(420, y, "Total")
-    p.line(40, y - 5, 550, y - 5)
-
-    # ===== ITEMS =====
-    p.setFont("Helvetica", 10)
-    y -= 25
-
-    grand_total = Decimal("0.00")
-
-    for item in order.items.all():
-        line_total = item.price * item.quantity
-        grand_total += line_total
-
-        p.drawString(40, y, item.product.name)
-        p.drawString(280, y, str(item.quantity))
-        p.drawString(330, y, f"₹{item.price}")
-        p.drawString(420, y, f"₹{line_total}")
+        # ===== ITEMS =====
+        p.setFont(res.regular, 10)
         y -= 20
+        for item in items[start:end]:
+            p.drawString(COLUMNS['product'], y, _fit(item.product.name, res.regular, 10, PRODUCT_WIDTH))
+            p.drawString(COLUMNS['price'], y, f"{money} {item.price}")
+            p.drawString(COLUMNS['qty'], y, str(item.quantity))
+            p.drawString(COLUMNS['rate'], y, f"{item.tax_rate.normalize():f}%")
+            p.drawString(COLUMNS['tax'], y, f"{money} {item.tax}")
+            p.drawString(COLUMNS['total'], y, f"{money} {item.total}")
+            y -= ROW
 
-    # ===== TOTAL =====
-    p.line(330, y - 10, 550, y - 10)
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(330, y - 30, "Grand Total:")
-    p.drawString(420, y - 30, f"₹{grand_total}")
+        # ===== TOTALS =====
+        # The amounts stored at checkout; the invoice never re-prices an order
+        if number == len(pages):
+            y -= 20
+            p.setFont(res.bold, 10)
+            for label, amount in _totals(order, items):
+                p.drawString(COLUMNS['tax'], y, label)
+                p.drawString(COLUMNS['total'], y, f"{money} {amount}")
+                y -= ROW
 
-    # ===== FOOTER =====
-    p.setFont("Helvetica", 9)
-    p.drawString(40, 40, "Thank you for shopping with Artistry Hub!")
+        # ===== FOOTER =====
+        p.setFont(res.regular, 9)
+        p.drawString(MARGIN, 40, "Thank you for shopping with Art Gallery!")
+        if len(pages) > 1:
+            p.drawRightString(550, 40, f"Page {number} of {len(pages)}")
 
-    p.showPage()
+        p.showPage()
     p.save()
 
     pdf = buffer.getvalue()
@@ -68,15 +249,120 @@ def generate_invoice_pdf(order):
     return pdf
 
 
-def send_invoice_email(order, pdf_bytes):
-    if not order.user.email:
+# ================= BATCH =================
+# Month-end regeneration: chunks of orders rendered on a process pool, each
+# worker loading fonts and the logo once.
+
+BATCH_CHUNK_SIZE = 200
+
+
+def invoice_filename(order_id):
+    return f"Invoice_Order_{order_id}.pdf"
+
+
+def _init_worker():
+    # Forked children must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def render_chunk(order_ids):
+    """``[(order_id, pdf)]`` for ``order_ids``, loading the orders in one pass."""
+    orders = (
+        Order.objects.select_related('user')
+        .prefetch_related('items__product')
+        .filter(id__in=order_ids)
+        .order_by('id')
+    )
+    return [(order.id, generate_invoice_pdf(order)) for order in orders]
+
+
+def render_invoices(order_ids, workers=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Yield ``(order_id, pdf)`` for ``order_ids``, in order. Chunks render on
+    ``workers`` processes (default: CPU count); ``workers=1`` renders in
+    this process.
+    """
+    chunks = [order_ids[i:i + chunk_size] for i in range(0, len(order_ids), chunk_size)]
+    if workers == 1:
+        for chunk in chunks:
+            yield from render_chunk(chunk)
         return
 
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for rendered in pool.map(render_chunk, chunks):
+            yield from rendered
+
+
+# ================= CACHE =================
+# Rendered PDFs are stored once per (order, content hash) in the "invoices"
+# storage. The hash covers the order status, so a status change produces a
+# new file and the old ones are purged by the Order signal handlers.
+
+def _storage():
+    return storages['invoices']
+
+
+def cached_invoice(order):
+    """
+    Return ``(name, etag)`` for the stored invoice, rendering it only when no
+    file exists for the current content hash.
+    """
+    items = _items(order)
+    etag = invoice_hash(order, items)
+    name = f"{order.id}/{etag}.pdf"
+
+    storage = _storage()
+    if not storage.exists(name):
+        pdf = generate_invoice_pdf(order, items)
+        saved = storage.save(name, ContentFile(pdf))
+        if saved != name:
+            # Another request stored the same content first
+            storage.delete(saved)
+
+    return name, etag
+
+
+def open_invoice(name):
+    return _storage().open(name, 'rb')
+
+
+def invoice_modified_time(name):
+    return _storage().get_modified_time(name)
+
+
+def get_invoice_pdf(order):
+    name, _ = cached_invoice(order)
+    with open_invoice(name) as fh:
+        return fh.read()
+
+
+def purge_invoice_cache(order_id):
+    storage = _storage()
+    directory = str(order_id)
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        storage.delete(f"{directory}/{filename}")
+
+
+# ================= EMAIL =================
+
+def build_invoice_email(order, pdf_bytes, connection=None):
+    from django.core.mail import EmailMessage
+
     email = EmailMessage(
         subject=f"Invoice for Order #{order.id}",
-        body="Thank you for your purchase. Your invoice is attached.",
+        body=(
+            f"Thank you for your purchase. Your order total is ₹{order.total_price}, "
+            f"including ₹{order.tax_total} GST. Your invoice is attached."
+        ),
         from_email=settings.EMAIL_HOST_USER,
         to=[order.user.email],
+        connection=connection,
     )
 
     email.attach(
@@ -84,5 +370,38 @@ def send_invoice_email(order, pdf_bytes):
         pdf_bytes,
         "application/pdf",
     )
+    return email
+
+
+def send_invoice_email(order, pdf_bytes, connection=None):
+    if not order.user.email:
+        return
+
+    build_invoice_email(order, pdf_bytes, connection=connection).send()
+
+
+async def asend_invoice_email(order, pdf_bytes):
+    # SMTP round trips hold no database state, so they can run off the
+    # request's thread and overlap with each other
+    await sync_to_async(send_invoice_email, thread_sensitive=False)(order, pdf_bytes)
+
+
+async def asend_invoice_emails(orders, concurrency=8):
+    """
+    Mail the invoices for ``orders`` (loaded with ``user`` and, ideally,
+    ``items__product``) with up to ``concurrency`` messages in flight.
+    Returns ``{order_id: exception}`` for the ones that failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = {}
+
+    async def send(order):
+        async with semaphore:
+            try:
+                pdf_bytes = await sync_to_async(get_invoice_pdf)(order)
+                await asend_invoice_email(order, pdf_bytes)
+            except Exception as exc:
+                errors[order.id] = exc
 
-    email.send()
+    await asyncio.gather(*(send(order) for order in orders))
+    return errors
@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from shop import benchmark
+
+
+def _budget(value):
+    name, _, limit = value.partition('=')
+    if name not in benchmark.SCENARIOS or not limit.isdigit():
+        raise CommandError(f"Invalid budget {value!r}; expected <scenario>=<queries>")
+    return name, int(limit)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a synthetic catalog and drive the storefront views "
+        "sequentially and under concurrent load, then race shoppers for a limited drop; "
+        "fails when a query budget is exceeded or the drop oversells."
+    )
+
+    def add_arguments(self, parser):
+        defaults = benchmark.DEFAULT_SCALE
+        parser.add_argument('--categories', type=int, default=defaults.categories)
+        parser.add_argument('--products', type=int, default=defaults.products)
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--orders-per-user', type=int, default=defaults.orders_per_user)
+        parser.add_argument('--items-per-order', type=int, default=defaults.items_per_order)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--scenario', action='append', choices=list(benchmark.SCENARIOS),
+            help="Scenario to run (repeatable); default: all.",
+        )
+        parser.add_argument('--iterations', type=int, default=20, help="Sequential runs per scenario.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Load generator threads; 0 skips the load test.")
+        parser.add_argument('--requests', type=int, default=500, help="Total requests in the load test.")
+        parser.add_argument('--drop-shoppers', type=int, default=300, help="Shoppers racing for the drop; 0 skips it.")
+        parser.add_argument('--drop-threads', type=int, default=32, help="Threads the drop's shoppers run on.")
+        parser.add_argument('--drop-stock', type=int, default=100, help="Units on sale in the drop.")
+        parser.add_argument(
+            '--budget', action='append', type=_budget, default=[],
+            help="Override a query budget, e.g. --budget cart_view=3 (repeatable).",
+        )
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        scale = benchmark.Scale(
+            options['categories'], options['products'], options['users'],
+            options['orders_per_user'], options['items_per_order'],
+        )
+        budgets = {**benchmark.QUERY_BUDGETS, **dict(options['budget'])}
+
+        with tempfile.TemporaryDirectory(prefix='shop-bench-') as tmp:
+            storage = {
+                "BACKEND": "django.core.files.storage.FileSystemStorage",
+                "OPTIONS": {"location": tmp},
+            }
+            overrides = override_settings(
+                STORAGES={
+                    "default": storage,
+                    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+                    "invoices": storage,
+                },
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                ALLOWED_HOSTS=['*'],
+            )
+            old_name = self._create_database(tmp)
+            mirrored = self._mirror_replicas()
+            try:
+                with overrides:
+                    cache.clear()
+                    results = self._run(scale, options, budgets)
+            finally:
+                for alias, name in mirrored.items():
+                    connections[alias].close()
+                    connections[alias].settings_dict['NAME'] = name
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+        failed = results['over_budget']
+        if failed:
+            raise CommandError("Query budget exceeded: " + ", ".join(
+                f"{s['scenario']} ran {s['max_queries']} queries (budget {budgets[s['scenario']]})"
+                for s in failed
+            ))
+        if results['drop'] and results['drop']['problems']:
+            raise CommandError("Drop failed: " + "; ".join(results['drop']['problems']))
+
+    def _create_database(self, tmp):
+        # A file rather than SQLite's shared in-memory test database, so the
+        # load generator's threads do not hit table-level locks.
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        self.stdout.write(f"Creating benchmark database for {connection.alias!r}...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name
+
+    def _mirror_replicas(self):
+        # Replicas read the benchmark database too, like TEST["MIRROR"] does
+        # for the test runner; returns their original names.
+        mirrored = {}
+        for alias in connections:
+            if alias != connection.alias:
+                connections[alias].close()
+                mirrored[alias] = connections[alias].settings_dict['NAME']
+                connections[alias].settings_dict['NAME'] = connection.settings_dict['NAME']
+        return mirrored
+
+    def _run(self, scale, options, budgets):
+        self.stdout.write(f"Seeding {scale}...")
+        data = benchmark.seed(scale, seed=options['seed'])
+
+        samples = benchmark.run_scenarios(data, options['scenario'], options['iterations'], options['seed'])
+        sequential = benchmark.summarize(samples)
+        self._table("Sequential", sequential, budgets)
+
+        load, throughput = [], None
+        if options['concurrency'] > 0:
+            samples, elapsed = benchmark.run_load(
+                data, options['scenario'], options['concurrency'], options['requests'], options['seed'],
+            )
+            load = benchmark.summarize(samples)
+            throughput = len(samples) / elapsed
+            self._table(f"Load ({options['concurrency']} threads)", load, budgets)
+            self.stdout.write(f"Throughput: {throughput:.1f} req/s over {elapsed:.1f}s")
+
+        drop = None
+        if options['drop_shoppers'] > 0:
+            drop = benchmark.run_drop(options['drop_shoppers'], options['drop_threads'], options['drop_stock'])
+            self._drop(drop)
+
+        return {
+            'scale': scale._asdict(),
+            'sequential': [s._asdict() for s in sequential],
+            'load': [s._asdict() for s in load],
+            'throughput': throughput,
+            'over_budget': [s._asdict() for s in benchmark.over_budget(sequential + load, budgets)],
+            'drop': drop and {key: value for key, value in drop._asdict().items() if key != 'latencies'},
+        }
+
+    def _drop(self, drop):
+        self.stdout.write(f"\nDrop ({drop.shoppers} shoppers on {drop.threads} threads, {drop.stock} units)")
+        latencies = drop.latencies
+        line = (
+            f"reserved {drop.reserved}, sold out {drop.sold_out}, errors {drop.errors} "
+            f"in {drop.elapsed:.2f}s ({drop.shoppers / drop.elapsed:.0f} attempts/s); "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:.1f} ms"
+        )
+        self.stdout.write(self.style.ERROR(line) if drop.problems else line)
+        for problem in drop.problems:
+            self.stdout.write(self.style.ERROR(f"  {problem}"))
+
+    def _table(self, title, summaries, budgets):
+        self.stdout.write(f"\n{title}")
+        self.stdout.write(
+            f"{'scenario':<18}{'n':>6}{'err':>5}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+            f"{'mean ms':>9}{'queries':>9}{'budget':>8}{'dup':>5}"
+        )
+        for s in summaries:
+            budget = budgets.get(s.scenario)
+            line = (
+                f"{s.scenario:<18}{s.count:>6}{s.errors:>5}{s.p50 * 1000:>9.1f}{s.p90 * 1000:>9.1f}"
+                f"{s.p99 * 1000:>9.1f}{s.mean * 1000:>9.1f}{s.max_queries:>9}{budget or '-':>8}{s.duplicates:>5}"
+            )
+            over = budget is not None and s.max_queries > budget
+            self.stdout.write(self.style.ERROR(line) if over or s.errors else line)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Product
+
+# argv for each server; {port} and {workers}/{threads} are filled in
+SERVERS = {
+    'wsgi': [
+        sys.executable, '-m', 'gunicorn', 'ecommerce_site.wsgi:application',
+        '--bind', '127.0.0.1:{port}', '--workers', '{workers}',
+        '--worker-class', 'gthread', '--threads', '{threads}', '--log-level', 'warning',
+    ],
+    'asgi': [
+        sys.executable, '-m', 'uvicorn', 'ecommerce_site.asgi:application',
+        '--host', '127.0.0.1', '--port', '{port}', '--workers', '{workers}', '--log-level', 'warning',
+    ],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _request(host, port, path, slow_client):
+    """One GET over a fresh connection; returns the status code."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\n".encode())
+        if slow_client:
+            # A slow client trickling its headers in holds a WSGI thread
+            await writer.drain()
+            await asyncio.sleep(slow_client)
+        writer.write(f"Host: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        while await reader.read(65536):
+            pass
+    finally:
+        writer.close()
+    return int(status_line.split()[1])
+
+
+async def _load(host, port, paths, connections, total, slow_client, timeout):
+    """``connections`` concurrent clients sharing ``total`` requests."""
+    latencies, errors = [], 0
+    issued = 0
+
+    async def client():
+        nonlocal issued, errors
+        while issued < total:
+            path = paths[issued % len(paths)]
+            issued += 1
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(_request(host, port, path, slow_client), timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                errors += 1
+                continue
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def _summary(label, latencies, errors, elapsed):
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+    return {
+        'server': label,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': pct(0.50),
+        'p90': pct(0.90),
+        'p99': pct(0.99),
+        'mean': statistics.fmean(latencies) if latencies else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a running server with many concurrent HTTP connections, or with --compare "
+        "start gunicorn (WSGI) and uvicorn (ASGI) in turn and compare their throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server to load when not using --compare.")
+        parser.add_argument('--compare', action='store_true', help="Start a WSGI and an ASGI server and load both.")
+        parser.add_argument('--path', action='append', dest='paths', help="Path to request (repeatable); default: storefront pages.")
+        parser.add_argument('--connections', type=int, default=64, help="Concurrent client connections.")
+        parser.add_argument('--requests', type=int, default=2000, help="Total requests per server.")
+        parser.add_argument('--slow-client', type=float, default=0.0, help="Seconds each client pauses mid-request.")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Per-request timeout in seconds.")
+        parser.add_argument('--workers', type=int, default=1, help="Server processes with --compare.")
+        parser.add_argument('--threads', type=int, default=4, help="Threads per gunicorn worker with --compare.")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self._default_paths()
+        load = (paths, options['connections'], options['requests'], options['slow_client'], options['timeout'])
+
+        if options['compare']:
+            results = [self._serve_and_load(mode, load, options) for mode in SERVERS]
+        else:
+            url = urlsplit(options['url'])
+            results = [self._run(url.netloc, url.hostname, url.port or 80, load)]
+
+        self._table(results, options)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+    def _default_paths(self):
+        slugs = list(Product.objects.order_by('-id').values_list('slug', flat=True)[:5])
+        return ['/', '/products/'] + [f'/product/{slug}/' for slug in slugs]
+
+    def _run(self, label, host, port, load):
+        self.stdout.write(f"Loading {label}...")
+        return _summary(label, *asyncio.run(_load(host, port, *load)))
+
+    def _serve_and_load(self, mode, load, options):
+        port = _free_port()
+        argv = [
+            arg.format(port=port, workers=options['workers'], threads=options['threads'])
+            for arg in SERVERS[mode]
+        ]
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'ecommerce_site.settings'),
+            'DJANGO_ASYNC_VIEWS': '1' if mode == 'asgi' else '0',
+        }
+        env.setdefault('PROFILING_SAMPLE_RATE', '0')
+
+        self.stdout.write(f"Starting {mode} server: {' '.join(argv[1:])}")
+        server = subprocess.Popen(argv, cwd=settings.BASE_DIR, env=env)
+        try:
+            self._wait_for(server, port)
+            return self._run(mode, '127.0.0.1', port, load)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def _wait_for(self, server, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"Server exited with status {server.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"Server did not start listening on port {port} within {timeout}s")
+
+    def _table(self, results, options):
+        self.stdout.write(
+            f"\n{options['connections']} connections, {options['requests']} requests"
+            + (f", {options['slow_client']}s slow clients" if options['slow_client'] else "")
+        )
+        self.stdout.write(
+            f"{'server':<22}{'n':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'mean ms':>9}"
+        )
+        for r in results:
+            line = (
+                f"{r['server']:<22}{r['requests']:>7}{r['errors']:>6}{r['throughput']:>9.1f}"
+                f"{r['p50'] * 1000:>9.1f}{r['p90'] * 1000:>9.1f}{r['p99'] * 1000:>9.1f}{r['mean'] * 1000:>9.1f}"
+            )
+            self.stdout.write(self.style.ERROR(line) if r['errors'] else line)
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop import reservations
+
+
+class Command(BaseCommand):
+    help = "Return the units of expired stock reservations to their products (run it from cron, or with --interval)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=reservations.SWEEP_BATCH_SIZE, help="Holds released per transaction.",
+        )
+        parser.add_argument('--interval', type=float, help="Keep sweeping every this many seconds.")
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="First reset Product.reserved from the hold rows (after holds were deleted by hand).",
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f"Recounted reserved units of {reservations.recount()} product(s)")
+
+        while True:
+            removed = reservations.expire(batch_size=options['batch_size'])
+            if removed or options['interval'] is None:
+                self.stdout.write(f"Released {removed} expired hold(s)")
+            if options['interval'] is None:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,101 @@
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from shop import analytics, catalog, orders
+from shop.cart import cart_lines
+from shop.models import HeroSection, Job, Order, OrderItem, Product
+
+# Full table scans: SQLite "SCAN <table>" without an index, PostgreSQL "Seq Scan"
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT)(\w+)(?! USING)(?:\s|$)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+# Sorts the index could not provide
+SORT = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'\bSort\b'),
+}
+
+
+def hot_queries():
+    """(view, description, queryset) for the queries behind the busiest pages."""
+    user = User(pk=1)
+    now = timezone.now()
+    today = timezone.localdate()
+    price_cursor = catalog.encode_cursor(Decimal('100.00'), 1000)
+    date_cursor = catalog.encode_cursor(now, 1000)
+
+    def page(params):
+        return catalog.page_queryset(params)[0]
+
+    return [
+        ('index', "active hero", HeroSection.objects.filter(is_active=True).order_by('-id')[:1]),
+        ('product_list', "newest", page({})),
+        ('product_list', "newest, next page", page({'cursor': date_cursor})),
+        ('product_list', "price ascending, next page", page({'sort': 'price_asc', 'cursor': price_cursor})),
+        ('product_list', "category, newest", page({'category': 'paintings'})),
+        ('product_list', "category, price descending", page({'category': 'paintings', 'sort': 'price_desc'})),
+        ('product_detail', "by slug", Product.objects.filter(slug='example')),
+        ('cart_view', "cart lines", cart_lines(user)),
+        ('order_history', "order page", orders.orders_for_user(user)[:orders.HISTORY_PAGE_SIZE]),
+        ('order_history', "order lines prefetch",
+         OrderItem.objects.filter(order_id__in=[1, 2, 3]).select_related('product').order_by('id')),
+        ('order_detail', "order by id", Order.objects.filter(user=user, id=1)),
+        ('download_invoice', "order by id", Order.objects.select_related('user').filter(id=1, user=user)),
+        ('run_worker', "due jobs", Job.objects.filter(
+            Q(status='Pending', run_at__lte=now) | Q(status='Running', locked_at__lt=now - timedelta(minutes=10))
+        ).order_by('run_at', 'id')[:50]),
+        ('export_orders', "date range", Order.objects.filter(
+            created_at__gte=now - timedelta(days=7), created_at__lt=now,
+        )),
+        ('sales dashboard', "top products", analytics._rollups(
+            analytics.ProductSalesDay, today - timedelta(days=29), today, ['Placed', 'Shipped', 'Delivered'],
+        ).values('product_id').annotate()),
+    ]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the queries behind the busiest views and flag full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan, not just problems.")
+        parser.add_argument('--strict', action='store_true', help="Exit with an error if any full scan is found.")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN:
+            raise CommandError(f"explain_hot_queries supports SQLite and PostgreSQL, not {vendor}")
+        if vendor == 'postgresql':
+            self.stdout.write(
+                "Note: on near-empty tables PostgreSQL prefers sequential scans; "
+                "run ANALYZE on realistic data before trusting the plans."
+            )
+
+        scans = 0
+        for view, description, queryset in hot_queries():
+            plan = queryset.explain()
+            full = sorted(set(FULL_SCAN[vendor].findall(plan)))
+            sort = bool(SORT[vendor].search(plan))
+
+            label = f"{view}: {description}"
+            if full:
+                scans += 1
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {label} ({', '.join(full)})"))
+            elif sort:
+                self.stdout.write(self.style.WARNING(f"SORT       {label}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {label}"))
+
+            if full or sort or options['verbose_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if scans and options['strict']:
+            raise CommandError(f"{scans} quer{'y' if scans == 1 else 'ies'} with full table scans")
@@ -0,0 +1,45 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import CHUNK_SIZE, FORMATS, export_rows, iter_export
+from shop.models import Order
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Stream orders and their lines as CSV or JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', type=_date, help="First order date to include (YYYY-MM-DD).")
+        parser.add_argument('--until', type=_date, help="Last order date to include (YYYY-MM-DD).")
+        parser.add_argument(
+            '--status', action='append', choices=[choice for choice, _ in Order.STATUS_CHOICES],
+            help="Only include orders with this status (repeatable).",
+        )
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout).")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        rows = export_rows(
+            since=options['since'],
+            until=options['until'],
+            statuses=options['status'],
+            chunk_size=options['chunk_size'],
+        )
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in iter_export(rows, options['format']):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,63 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.images import TARGETS, needs_refresh, refresh_variants
+
+
+def _init_worker():
+    # Forked children must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def _refresh(label, pks):
+    # Objects sharing a source file are handled by one worker, so the first
+    # one renders the derivatives and the rest find them already stored.
+    results = []
+    for pk in pks:
+        try:
+            results.append((label, pk, refresh_variants(label, pk), None))
+        except Exception as exc:
+            results.append((label, pk, False, repr(exc)))
+    return results
+
+
+class Command(BaseCommand):
+    help = "Generate responsive image derivatives for products and hero sections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count).")
+        parser.add_argument('--model', choices=sorted(TARGETS), action='append', help="Limit to a model.")
+
+    def handle(self, *args, **options):
+        labels = options['model'] or sorted(TARGETS)
+
+        pending = defaultdict(list)
+        for label in labels:
+            model, image_field, variants_field, _ = TARGETS[label]
+            objects = model.objects.only('id', image_field, variants_field).iterator(chunk_size=2000)
+            for obj in objects:
+                if needs_refresh(obj, label):
+                    pending[(label, getattr(obj, image_field).name)].append(obj.pk)
+
+        if not pending:
+            self.stdout.write("All derivatives are up to date")
+            return
+
+        connections.close_all()
+        updated = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(_refresh, label, pks) for (label, _), pks in pending.items()]
+            for future in as_completed(futures):
+                for label, pk, changed, error in future.result():
+                    if error:
+                        failed += 1
+                        self.stderr.write(f"{label} #{pk}: {error}")
+                    elif changed:
+                        updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} object(s), {failed} failure(s)"))
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.imports import BATCH_SIZE, FORMATS, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Upsert categories and products from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path == '-' else detect_format(path))
+
+        def progress(report):
+            self.stderr.write(f"{report.rows} row(s) read, {report.imported} imported, {report.error_count} error(s)")
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            report = import_catalog(stream, fmt, options['batch_size'], progress)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for line, message in report.errors:
+            self.stderr.write(self.style.ERROR(f"line {line}: {message}"))
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... and {report.error_count - len(report.errors)} more error(s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.imported} product(s) from {report.rows} row(s); "
+            f"{report.categories_created} new category(ies), {report.error_count} error(s)"
+        ))
@@ -0,0 +1,24 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import analytics
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the order tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=_date, help="First day to rebuild (YYYY-MM-DD); default: all.")
+        parser.add_argument('--until', type=_date, help="Last day to rebuild (YYYY-MM-DD); default: all.")
+
+    def handle(self, *args, **options):
+        count = analytics.rebuild(options['since'], options['until'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} rollup row(s)"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = "Drop and rebuild the product full-text search index."
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write("Full-text search is not supported on this database; nothing to do.")
+            return
+
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} product(s)"))
@@ -0,0 +1,67 @@
+import os
+import sys
+import time as clock
+import zipfile
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.invoice import BATCH_CHUNK_SIZE, invoice_filename, render_invoices
+from shop.models import Order
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class Command(BaseCommand):
+    help = "Render invoice PDFs for a date range in parallel, into a directory or a zip file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=_date, required=True, help="First order date to include (YYYY-MM-DD).")
+        parser.add_argument('--until', type=_date, help="Last order date to include (YYYY-MM-DD).")
+        parser.add_argument(
+            '--status', action='append', choices=[choice for choice, _ in Order.STATUS_CHOICES],
+            help="Only include orders with this status (repeatable).",
+        )
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count).")
+        parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help="Orders per work unit.")
+        output = parser.add_mutually_exclusive_group(required=True)
+        output.add_argument('--output-dir', help="Directory to write the PDFs to.")
+        output.add_argument('--zip', dest='zip_path', help="Zip file to write, or - for stdout.")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.filter(created_at__gte=_day_start(options['since']))
+        if options['until']:
+            orders = orders.filter(created_at__lt=_day_start(options['until'] + timedelta(days=1)))
+        if options['status']:
+            orders = orders.filter(status__in=options['status'])
+        order_ids = list(orders.order_by('id').values_list('id', flat=True))
+
+        rendered = render_invoices(order_ids, workers=options['workers'], chunk_size=options['chunk_size'])
+        start = clock.perf_counter()
+        if options['output_dir']:
+            os.makedirs(options['output_dir'], exist_ok=True)
+            for order_id, pdf in rendered:
+                with open(os.path.join(options['output_dir'], invoice_filename(order_id)), 'wb') as fh:
+                    fh.write(pdf)
+        else:
+            out = sys.stdout.buffer if options['zip_path'] == '-' else options['zip_path']
+            # PDF streams are already compressed
+            with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for order_id, pdf in rendered:
+                    archive.writestr(invoice_filename(order_id), pdf)
+
+        elapsed = clock.perf_counter() - start
+        # Progress goes to stderr so a zip on stdout stays clean
+        self.stderr.write(self.style.SUCCESS(
+            f"Rendered {len(order_ids)} invoice(s) in {elapsed:.1f}s ({len(order_ids) / elapsed if elapsed else 0:.0f}/s)"
+        ))
@@ -0,0 +1,65 @@
+import logging
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop.tasks import claim_jobs, run_jobs
+
+logger = logging.getLogger(__name__)
+
+
+def _run_group(jobs):
+    try:
+        run_jobs(jobs)
+    except Exception:
+        # Recording an outcome failed (e.g. the database went away); the
+        # jobs stay Running and are reclaimed once stale
+        logger.exception("Could not record the outcome of %s job(s) %s", len(jobs), [job.id for job in jobs])
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Process background jobs (invoice PDFs and emails) from the job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Size of the thread pool.")
+        parser.add_argument('--batch-size', type=int, default=50, help="Jobs claimed per poll.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+
+    def handle(self, *args, **options):
+        worker_id = uuid.uuid4().hex
+        workers = options['workers']
+        self.stdout.write(f"Worker {worker_id} started with {workers} threads")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                jobs = claim_jobs(limit=options['batch_size'], worker_id=worker_id)
+
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # Group by job name so batch handlers (e.g. invoice emails)
+                # share one SMTP connection, then spread chunks over the pool.
+                groups = defaultdict(list)
+                for job in jobs:
+                    groups[job.name].append(job)
+
+                futures = []
+                for group in groups.values():
+                    chunk_size = max(1, -(-len(group) // workers))
+                    for start in range(0, len(group), chunk_size):
+                        futures.append(pool.submit(_run_group, group[start:start + chunk_size]))
+
+                for future in futures:
+                    future.result()
+
+                self.stdout.write(f"Processed {len(jobs)} job(s)")
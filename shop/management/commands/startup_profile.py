@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Only needed by invoice, image and MySQL code paths; a cold start that
+# imports them has regressed
+LAZY_PACKAGES = ('reportlab', 'PIL', 'pymysql', 'crispy_forms')
+
+# Runs in a fresh interpreter: load the entry point, then serve one request
+CHILD = '''
+import importlib, io, json, sys, time
+start = time.perf_counter()
+application = importlib.import_module(sys.argv[1]).application
+loaded = time.perf_counter()
+statuses = []
+environ = {
+    "REQUEST_METHOD": "GET", "PATH_INFO": sys.argv[2], "QUERY_STRING": "",
+    "SERVER_NAME": "localhost", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+    "HTTP_HOST": "localhost", "wsgi.input": io.BytesIO(), "wsgi.url_scheme": "http",
+    "wsgi.errors": sys.stderr,
+}
+response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+b"".join(response)
+response.close()
+served = time.perf_counter()
+print(json.dumps({"load": loaded - start, "first_request": served - loaded, "status": statuses[0]}))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, parent)] from ``-X importtime`` output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+
+    # Children are printed before their parent, one level deeper
+    parsed, parents = [], {}
+    for module, self_us, cumulative_us, depth in reversed(entries):
+        parents[depth] = module
+        parsed.append((module, self_us, cumulative_us, parents.get(depth - 1) if depth else None))
+    parsed.reverse()
+    return parsed
+
+
+def _root(module):
+    return module.split('.')[0] if module else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the site in a fresh interpreter under -X importtime, serve one request "
+        "and report where the cold-start time goes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--serverless', action='store_true', help="Profile the Vercel entry point (api/index.py).")
+        parser.add_argument('--path', default='/', help="Path of the first request.")
+        parser.add_argument('--top', type=int, default=15, help="Rows per table.")
+        parser.add_argument('--budget-ms', type=float, help="Fail if load + first request takes longer.")
+        parser.add_argument('--strict', action='store_true', help=f"Fail if any of {', '.join(LAZY_PACKAGES)} is imported.")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        entry = 'api.index' if options['serverless'] else 'ecommerce_site.wsgi'
+        env = {**os.environ, 'PROFILING_SAMPLE_RATE': '0'}
+        if not options['serverless']:
+            env.pop('DJANGO_SERVERLESS', None)
+
+        start = time.perf_counter()
+        child = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD, entry, options['path']],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - start
+        if child.returncode:
+            raise CommandError(f"{entry} failed to start:\n{child.stderr[-2000:]}")
+        phases = json.loads(child.stdout.strip().splitlines()[-1])
+        imports = parse_importtime(child.stderr)
+
+        by_package = defaultdict(int)
+        for module, self_us, _, _ in imports:
+            by_package[_root(module)] += self_us
+        # Where a package is first pulled in from outside itself
+        entry_points = sorted(
+            (entry for entry in imports if _root(entry[0]) != _root(entry[3])),
+            key=lambda entry: entry[2], reverse=True,
+        )
+        lazy = sorted({_root(module) for module, _, _, _ in imports} & set(LAZY_PACKAGES))
+
+        self._report(entry, wall, phases, imports, by_package, entry_points, lazy, options['top'])
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump({
+                    'entry': entry,
+                    'wall': wall,
+                    **phases,
+                    'modules': len(imports),
+                    'packages': dict(sorted(by_package.items(), key=lambda item: -item[1])),
+                    'lazy_imported': lazy,
+                }, fh, indent=2)
+
+        failures = []
+        elapsed_ms = (phases['load'] + phases['first_request']) * 1000
+        if options['budget_ms'] is not None and elapsed_ms > options['budget_ms']:
+            failures.append(f"startup took {elapsed_ms:.0f} ms (budget {options['budget_ms']:.0f} ms)")
+        if options['strict'] and lazy:
+            failures.append(f"imported at startup: {', '.join(lazy)}")
+        if failures:
+            raise CommandError("; ".join(failures))
+
+    def _report(self, entry, wall, phases, imports, by_package, entry_points, lazy, top):
+        total_us = sum(by_package.values())
+        self.stdout.write(f"Entry point: {entry} (first request: {phases['status']})")
+        self.stdout.write(
+            f"Process {wall * 1000:.0f} ms = interpreter + load {phases['load'] * 1000:.0f} ms"
+            f" + first request {phases['first_request'] * 1000:.0f} ms"
+        )
+        self.stdout.write(f"{len(imports)} modules imported in {total_us / 1000:.0f} ms")
+
+        self.stdout.write("\nSelf time by top-level package")
+        self.stdout.write(f"{'package':<32}{'ms':>9}{'share':>8}")
+        for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"{package:<32}{self_us / 1000:>9.1f}{self_us / total_us:>8.1%}")
+
+        self.stdout.write("\nSlowest imports from another package (cumulative)")
+        self.stdout.write(f"{'module':<40}{'ms':>9}  imported by")
+        for module, _, cumulative_us, parent in entry_points[:top]:
+            self.stdout.write(f"{module:<40}{cumulative_us / 1000:>9.1f}  {parent or '-'}")
+
+        if lazy:
+            self.stdout.write(self.style.WARNING(
+                f"\nImported at startup but only needed on specific code paths: {', '.join(lazy)}"
+            ))
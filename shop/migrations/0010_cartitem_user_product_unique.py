@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('user_id', 'product_id')
+        .annotate(rows=Count('id'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates:
+        rows = CartItem.objects.filter(user_id=dup['user_id'], product_id=dup['product_id']).order_by('id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        CartItem.objects.filter(pk=keep.pk).update(quantity=dup['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_product_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='shop_cartitem_user_product_uniq'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 6.0 on 2026-10-18 20:18
+
+from django.db import migrations
+
+
+# The DDL is spelled out here rather than imported from shop.search, so
+# later changes to that module cannot alter what this migration does.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+    "name, description, category, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts_vocab USING fts5vocab(shop_product_fts, 'row')",
+]
+SQLITE_DROP = [
+    "DROP TABLE IF EXISTS shop_product_fts_vocab",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+POSTGRES_CREATE = [
+    "CREATE TABLE IF NOT EXISTS shop_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE "
+    "DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS shop_product_search_document_gin ON shop_product_search USING GIN (document)",
+]
+POSTGRES_DROP = [
+    "DROP TABLE IF EXISTS shop_product_search",
+]
+
+
+def _run(schema_editor, sqlite, postgresql):
+    statements = {'sqlite': sqlite, 'postgresql': postgresql}.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    _run(schema_editor, SQLITE_CREATE, POSTGRES_CREATE)
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, SQLITE_DROP, POSTGRES_DROP)
+
+
+def index_existing_products(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('sqlite', 'postgresql'):
+        return
+
+    if schema_editor.connection.vendor == 'sqlite':
+        sql = "INSERT INTO shop_product_fts (rowid, name, description, category) VALUES (%s, %s, %s, %s)"
+    else:
+        sql = (
+            "INSERT INTO shop_product_search (product_id, document) VALUES (%s, "
+            "setweight(to_tsvector('simple', %s), 'A') || "
+            "setweight(to_tsvector('simple', %s), 'C') || "
+            "setweight(to_tsvector('simple', %s), 'B'))"
+        )
+
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.select_related('category').order_by('id').iterator(chunk_size=2000)
+    batch = []
+    with schema_editor.connection.cursor() as cursor:
+        for product in products:
+            batch.append((product.pk, product.name, product.description or '', product.category.name))
+            if len(batch) >= 2000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='herosection',
+            name='background_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
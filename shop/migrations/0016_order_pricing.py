@@ -0,0 +1,120 @@
+# Generated by Django 6.0 on 2026-10-18 20:44
+
+from decimal import ROUND_HALF_UP, Decimal
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+# The rate invoices printed before rates were stored per category
+LEGACY_RATE = Decimal('18.00')
+CENT = Decimal('0.01')
+
+
+def backfill_order_pricing(apps, schema_editor):
+    """
+    Store the amounts existing orders' invoices showed: total_price held the
+    pre-tax subtotal and GST was 18% of it, rounded once per order (with
+    Decimal's default half-even rounding). The order's GST is spread over its
+    lines so they add up to it.
+    """
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    qn = schema_editor.quote_name
+    # executemany() rather than bulk_update(): its CASE WHEN per row costs
+    # more to build than the update itself at a few hundred thousand lines
+    update_order = (
+        f"UPDATE {qn(Order._meta.db_table)} SET subtotal = %s, tax_total = %s, total_price = %s, "
+        "item_count = %s WHERE id = %s"
+    )
+    update_item = f"UPDATE {qn(OrderItem._meta.db_table)} SET tax_rate = %s, tax = %s, total = %s WHERE id = %s"
+
+    last_pk = 0
+    while True:
+        orders = list(Order.objects.filter(pk__gt=last_pk).order_by('pk').prefetch_related('items')[:BATCH_SIZE])
+        if not orders:
+            break
+        last_pk = orders[-1].pk
+
+        order_rows, item_rows = [], []
+        for order in orders:
+            items = sorted(order.items.all(), key=lambda item: item.pk)
+            subtotals = [(item.price * item.quantity).quantize(CENT) for item in items]
+            subtotal = sum(subtotals, Decimal('0.00')) if items else order.total_price
+            tax = (subtotal * LEGACY_RATE / 100).quantize(CENT) if items else Decimal('0.00')
+
+            shares = [
+                (tax * line / subtotal).quantize(CENT, rounding=ROUND_HALF_UP) if subtotal else Decimal('0.00')
+                for line in subtotals
+            ]
+            if shares:
+                largest = max(range(len(shares)), key=subtotals.__getitem__)
+                shares[largest] += tax - sum(shares, Decimal('0.00'))
+            item_rows += [
+                (LEGACY_RATE, share, line + share, item.pk)
+                for item, line, share in zip(items, subtotals, shares)
+            ]
+            order_rows.append((subtotal, tax, subtotal + tax, len(items), order.pk))
+
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(update_order, order_rows)
+            cursor.executemany(update_item, item_rows)
+
+
+def restore_pretax_totals(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.update(total_price=models.F('subtotal'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_query_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=2, default=Decimal('18.00'), help_text='GST rate in percent', max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='tax_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='tax',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='tax_rate',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_order_pricing, restore_pretax_totals),
+    ]
@@ -1,9 +1,15 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
+    tax_rate = models.DecimalField(
+        max_digits=5, decimal_places=2, default=Decimal('18.00'), help_text="GST rate in percent",
+    )
 
     def __str__(self):
         return self.name
@@ -16,23 +22,77 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.PositiveIntegerField(default=0)
+    # Sum of the product's StockReservation rows, kept in step by shop.reservations
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Keyset pagination in shop.catalog: every sort key ends with id
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='shop_prod_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='shop_prod_cat_created_idx'),
+            models.Index(fields=['price', 'id'], name='shop_prod_price_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='shop_prod_cat_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # ``reserved`` only changes through F() updates; writing back the
+        # value loaded with the instance would undo concurrent reservations
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reserved'
+            ]
+        super().save(*args, **kwargs)
+
 
 # models.py
 class CartItem(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
+    # Lookups by user use the (user, product) unique index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
+    # Versions the API's ETags: writes that bypass save() must set it too
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='shop_cartitem_user_product_uniq'),
+        ]
 
     def subtotal(self):
         return self.product.price * self.quantity
 
+
+class StockReservation(models.Model):
+    """Units of a product held for one user's cart until ``expires_at``."""
+    # Lookups by user use the (user, product) unique index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations', db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations', db_index=False)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='shop_resv_user_product_uniq'),
+        ]
+        indexes = [
+            # Active holds per product (availability) and the expiry sweep
+            models.Index(fields=['product', 'expires_at'], name='shop_resv_product_exp_idx'),
+            models.Index(fields=['expires_at'], name='shop_resv_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for user {self.user_id}"
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('Placed', 'Placed'),
@@ -41,10 +101,31 @@ class Order(models.Model):
         ('Cancelled', 'Cancelled'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Lookups by user use the (user, -created_at, -id) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    # Computed once at checkout by shop.pricing; total_price includes GST
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    tax_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    item_count = models.PositiveIntegerField(default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Placed')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Versions the API's ETags: writes that bypass save() must set it too
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Order history: one user's orders newest first. On PostgreSQL the
+            # included columns let the page be read from the index alone.
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                include=['total_price', 'status'],
+                name='shop_order_user_created_idx',
+            ),
+            # Date-range exports, admin date filters and rollup rebuilds
+            models.Index(fields=['created_at'], name='shop_order_created_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -52,6 +133,11 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Stored by shop.pricing at checkout; total = subtotal - discount + tax
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     def subtotal(self):
         return self.price * self.quantity
@@ -63,8 +149,87 @@ class HeroSection(models.Model):
     button_text = models.CharField(max_length=50, default="View Artwork")
     button_link = models.CharField(max_length=200, default="/products/")
     background_image = models.ImageField(upload_to="hero/")
+    background_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # The home page shows the newest active hero; inactive rows are not indexed
+            models.Index(fields=['-id'], condition=models.Q(is_active=True), name='shop_hero_active_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+
+
+class Job(models.Model):
+    """A unit of background work picked up by ``manage.py run_worker``."""
+
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Dead', 'Dead'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='shop_job_status_run_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+# ================= SALES ROLLUPS =================
+
+class SalesRollup(models.Model):
+    """Sales of one local calendar day for one order status (see ``shop.analytics``)."""
+
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SalesDay(SalesRollup):
+    class Meta:
+        # The admin shows the sales dashboard in place of this change list
+        verbose_name_plural = 'sales dashboard'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='shop_salesday_uniq'),
+        ]
+
+
+class ProductSalesDay(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status', 'product'], name='shop_productsalesday_uniq'),
+        ]
+
+
+class CategorySalesDay(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status', 'category'], name='shop_categorysalesday_uniq'),
+        ]
@@ -0,0 +1,49 @@
+"""
+Order history queries.
+
+Every order list is scoped to one user and prefetched with items + products,
+so templates never fall back to per-order queries. Item counts and totals are
+stored on the order at checkout (see ``shop.pricing``).
+"""
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+
+HISTORY_PAGE_SIZE = 20
+
+
+def _items_prefetch():
+    return Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id'))
+
+
+def orders_for_user(user):
+    return (
+        Order.objects.filter(user=user)
+        .prefetch_related(_items_prefetch())
+        .order_by('-created_at', '-id')
+    )
+
+
+def order_history_page(user, page_number, page_size=HISTORY_PAGE_SIZE):
+    """One page of ``user``'s orders: a COUNT, the page query and one prefetch."""
+    return Paginator(orders_for_user(user), page_size).get_page(page_number)
+
+
+async def aorder_history_page(user, page_number, page_size=HISTORY_PAGE_SIZE):
+    """Async ``order_history_page``; the page's orders are loaded eagerly."""
+    orders = orders_for_user(user)
+    paginator = Paginator(orders, page_size)
+    # Paginator.count is a cached property that would query synchronously
+    paginator.count = await orders.acount()
+    page = paginator.get_page(page_number)
+    page.object_list = [order async for order in page.object_list.aiterator(chunk_size=page_size)]
+    return page
+
+
+def order_for_user(user, order_id):
+    return (
+        Order.objects.filter(user=user)
+        .prefetch_related(_items_prefetch())
+        .get(id=order_id)
+    )
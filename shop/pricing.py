@@ -0,0 +1,92 @@
+"""
+Pricing engine.
+
+``price_lines`` works out every amount an order carries once, at checkout:
+line subtotals, the share of any order discount, GST at the product
+category's rate, and the order totals. ``place_order`` stores the result on
+``Order`` and ``OrderItem``; invoices, order history, the admin, exports and
+the sales rollups read the stored values, so every place shows the same
+numbers and none of them re-aggregate order lines.
+
+Amounts are rounded to the paisa per line and order totals are the sums of
+the rounded line amounts, so lines always add up to the order.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+# tax_rate is a percentage, as stored on Category
+Line = namedtuple('Line', 'price quantity tax_rate')
+PricedLine = namedtuple('PricedLine', 'price quantity subtotal discount tax_rate tax total')
+Pricing = namedtuple('Pricing', 'lines subtotal discount tax total item_count')
+
+
+def _round(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def allocate(amount, weights):
+    """
+    Split ``amount`` across ``weights`` proportionally, in paise, so the
+    shares add up to exactly ``amount``; the largest weight takes the
+    rounding remainder.
+    """
+    total = sum(weights, ZERO)
+    if not amount or not total:
+        return [ZERO] * len(weights)
+    shares = [_round(amount * weight / total) for weight in weights]
+    largest = max(range(len(weights)), key=weights.__getitem__)
+    shares[largest] += amount - sum(shares, ZERO)
+    return shares
+
+
+def price_lines(lines, discount=ZERO):
+    """
+    Price ``lines`` (``Line`` tuples, in order). ``discount`` is an
+    order-level amount, capped at the subtotal and spread over the lines
+    before tax.
+    """
+    subtotals = [_round(line.price * line.quantity) for line in lines]
+    discounts = allocate(min(discount, sum(subtotals, ZERO)), subtotals)
+
+    priced = []
+    for line, subtotal, line_discount in zip(lines, subtotals, discounts):
+        taxable = subtotal - line_discount
+        tax = _round(taxable * line.tax_rate / 100)
+        priced.append(PricedLine(
+            line.price, line.quantity, subtotal, line_discount, line.tax_rate, tax, taxable + tax,
+        ))
+
+    return Pricing(
+        lines=priced,
+        subtotal=sum(subtotals, ZERO),
+        discount=sum(discounts, ZERO),
+        tax=sum((line.tax for line in priced), ZERO),
+        total=sum((line.total for line in priced), ZERO),
+        item_count=len(priced),
+    )
+
+
+def order_fields(pricing):
+    """Keyword arguments for ``Order`` from a ``Pricing``."""
+    return {
+        'subtotal': pricing.subtotal,
+        'discount_total': pricing.discount,
+        'tax_total': pricing.tax,
+        'total_price': pricing.total,
+        'item_count': pricing.item_count,
+    }
+
+
+def item_fields(line):
+    """Keyword arguments for ``OrderItem`` from a ``PricedLine``."""
+    return {
+        'price': line.price,
+        'quantity': line.quantity,
+        'discount': line.discount,
+        'tax_rate': line.tax_rate,
+        'tax': line.tax,
+        'total': line.total,
+    }
@@ -0,0 +1,322 @@
+"""
+Request profiling.
+
+``ProfilingMiddleware`` measures a sampled fraction of requests
+(``PROFILING_SAMPLE_RATE``, 0..1): wall time, the number and total time of
+SQL queries on every database connection (through an execute wrapper,
+including queries the async ORM runs on worker threads), repeated identical statements (the N+1
+signature), and the time spent in named sections such as template rendering
+(``ProfiledDjangoTemplates``), invoice PDF generation and cache lookups
+(``timer()``).
+
+Sampled responses carry a ``Server-Timing`` header, and the measurements are
+aggregated per view in process memory and exposed in the Prometheus text
+format by ``metrics_view`` at ``/metrics``. Each worker process reports its
+own numbers; Prometheus sums them across scrape targets. The page is open
+to staff users and to scrapers sending ``Authorization: Bearer
+<METRICS_TOKEN>``; an IP allowlist (``METRICS_ALLOWED_IPS``) is opt-in.
+"""
+import hmac
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+DUPLICATE_QUERY_THRESHOLD = getattr(settings, 'PROFILING_DUPLICATE_QUERY_THRESHOLD', 3)
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', [])
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Named sections reported besides SQL: Server-Timing name -> description
+SECTIONS = {
+    'tpl': 'template render',
+    'pdf': 'invoice PDF',
+    'cache': 'cache',
+}
+
+# Not reported as duplicates: every transaction repeats them
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+_current = ContextVar('shop_profile', default=None)
+
+
+class Profile:
+    """Measurements for one request."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.sections = defaultdict(float)
+
+    def duplicates(self):
+        """Statements run at least ``DUPLICATE_QUERY_THRESHOLD`` times."""
+        return {sql: n for sql, n in self.statements.items() if n >= DUPLICATE_QUERY_THRESHOLD}
+
+    def duplicate_count(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+            if not sql.startswith(TRANSACTION_STATEMENTS):
+                self.statements[sql] += 1
+
+
+@contextmanager
+def timer(section):
+    """Add the time spent in the block to ``section`` of the current profile, if any."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[section] += time.perf_counter() - start
+
+
+# ================= TEMPLATES =================
+
+class _ProfiledTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timer('tpl'):
+            return self.template.render(context, request)
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """``DjangoTemplates`` whose top-level renders are timed (includes are part of their parent)."""
+
+    def from_string(self, template_code):
+        return _ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _ProfiledTemplate(super().get_template(template_name))
+
+
+# ================= AGGREGATION =================
+
+class _ViewStats:
+    def __init__(self):
+        self.requests = Counter()  # (method, status) -> count
+        self.buckets = [0] * len(BUCKETS)
+        self.seconds = 0.0
+        self.count = 0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.duplicate_queries = 0
+        self.sections = defaultdict(float)
+
+
+_lock = threading.Lock()
+_stats = defaultdict(_ViewStats)
+
+
+def record(view, method, status, elapsed, profile):
+    with _lock:
+        stats = _stats[view]
+        stats.requests[(method, status)] += 1
+        stats.count += 1
+        stats.seconds += elapsed
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                stats.buckets[i] += 1
+        stats.sql_queries += profile.sql_count
+        stats.sql_seconds += profile.sql_time
+        stats.duplicate_queries += profile.duplicate_count()
+        for section, seconds in profile.sections.items():
+            stats.sections[section] += seconds
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """All per-view measurements in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = dict(_stats)
+        lines = [
+            '# HELP shop_requests_total Sampled requests by view, method and status.',
+            '# TYPE shop_requests_total counter',
+        ]
+        for view, stats in snapshot.items():
+            for (method, status), n in sorted(stats.requests.items()):
+                lines.append(
+                    f'shop_requests_total{{view="{_label(view)}",method="{method}",status="{status}"}} {n}'
+                )
+
+        lines += [
+            '# HELP shop_request_duration_seconds Wall time of sampled requests.',
+            '# TYPE shop_request_duration_seconds histogram',
+        ]
+        for view, stats in snapshot.items():
+            label = f'view="{_label(view)}"'
+            for bound, n in zip(BUCKETS, stats.buckets):
+                lines.append(f'shop_request_duration_seconds_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'shop_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.count}')
+            lines.append(f'shop_request_duration_seconds_sum{{{label}}} {stats.seconds:.6f}')
+            lines.append(f'shop_request_duration_seconds_count{{{label}}} {stats.count}')
+
+        for name, attr, kind, help_text in (
+            ('shop_sql_queries_total', 'sql_queries', 'counter', 'SQL queries run by sampled requests.'),
+            ('shop_sql_seconds_total', 'sql_seconds', 'counter', 'Time spent in SQL by sampled requests.'),
+            ('shop_duplicate_sql_queries_total', 'duplicate_queries', 'counter',
+             'Repeated identical SQL statements within one request (N+1 candidates).'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for view, stats in snapshot.items():
+                lines.append(f'{name}{{view="{_label(view)}"}} {getattr(stats, attr)}')
+
+        lines += [
+            '# HELP shop_section_seconds_total Time spent in named sections by sampled requests.',
+            '# TYPE shop_section_seconds_total counter',
+        ]
+        for view, stats in snapshot.items():
+            for section, seconds in sorted(stats.sections.items()):
+                lines.append(
+                    f'shop_section_seconds_total{{view="{_label(view)}",section="{section}"}} {seconds:.6f}'
+                )
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+# ================= MIDDLEWARE =================
+
+def _server_timing(elapsed, profile):
+    parts = [
+        f'total;dur={elapsed * 1000:.1f}',
+        f'sql;desc="{profile.sql_count} queries";dur={profile.sql_time * 1000:.1f}',
+    ]
+    duplicates = profile.duplicate_count()
+    if duplicates:
+        parts.append(f'dupsql;desc="{duplicates} repeated queries"')
+    for section, seconds in profile.sections.items():
+        parts.append(f'{section};desc="{SECTIONS.get(section, section)}";dur={seconds * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def _execute(execute, sql, params, many, context):
+    # Installed once per connection; connections are per thread, and the
+    # async ORM queries from a worker thread, so the request's Profile is
+    # found through the context variable rather than attached per request.
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+connection_created.connect(_install)
+
+
+@contextmanager
+def _profiled():
+    """Make a fresh Profile current for the duration of the block and yield it."""
+    profile = Profile()
+    # Connections this thread opened before the signal handler existed
+    for conn in connections.all():
+        _install(conn)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+def _finish(request, response, profile, elapsed):
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unresolved'
+    record(view, request.method, response.status_code, elapsed, profile)
+    response['Server-Timing'] = _server_timing(elapsed, profile)
+
+    for sql, count in profile.duplicates().items():
+        logger.warning("%s ran the same query %d times: %s", view, count, sql)
+    return response
+
+
+def _sampled():
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    """Profile a sample of requests; should be the first middleware. Sync and async capable."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _sampled():
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with _profiled() as profile:
+            response = self.get_response(request)
+        return _finish(request, response, profile, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not _sampled():
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        with _profiled() as profile:
+            response = await self.get_response(request)
+        return _finish(request, response, profile, time.perf_counter() - start)
+
+
+def _may_scrape(request):
+    if request.user.is_staff:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if METRICS_TOKEN and scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return True
+    # Behind a reverse proxy every client shares its address: only for
+    # scrapers that reach the app directly
+    return request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    if not _may_scrape(request):
+        raise PermissionDenied
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
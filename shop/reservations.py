@@ -0,0 +1,272 @@
+"""
+Stock reservations.
+
+Adding a product to a signed-in user's cart holds those units for
+``STOCK_HOLD_SECONDS``: one ``StockReservation`` row per user and product.
+``Product.reserved`` is the sum of a product's hold rows and is kept in step
+with them in the same transaction. A reservation is therefore one
+conditional ``UPDATE ... SET reserved = reserved + n WHERE stock - reserved
+>= n`` on the product row. Concurrent shoppers queue on that single row lock
+and the database decides who gets the last unit.
+
+Every path takes locks in the same order: cart rows, then hold rows, then
+product rows. That covers the cart, the checkout (which consumes the holds
+in its stock update, see ``shop.checkout``) and the sweeper, so they cannot
+deadlock each other.
+
+Expired holds keep their units until ``manage.py expire_reservations``
+returns them. A reservation that finds a product sold out first sweeps that
+product's expired holds and then tries once more. Pages show
+``available()``, which is ``stock`` less the active holds computed by one
+aggregate, so expired holds are not shown as taken.
+"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+HOLD_SECONDS = getattr(settings, 'STOCK_HOLD_SECONDS', 60 * 15)
+SWEEP_BATCH_SIZE = 500
+
+Hold = namedtuple('Hold', 'product_id slug quantity')
+
+
+def _lock(queryset, skip_locked=False):
+    features = connection.features
+    if not features.has_select_for_update:
+        return queryset
+    options = {}
+    if skip_locked and features.has_select_for_update_skip_locked:
+        options['skip_locked'] = True
+    if features.has_select_for_update_of:
+        # Only the hold rows; products are locked by their own UPDATE
+        options['of'] = ('self',)
+    return queryset.select_for_update(**options)
+
+
+def _changed(slugs):
+    # Imported here: shop.caching imports shop.cart, which imports this module
+    from .caching import bump
+
+    namespaces = {f'product:{slug}' for slug in slugs}
+    if namespaces:
+        transaction.on_commit(lambda: bump(*namespaces))
+
+
+# ================= AVAILABILITY =================
+
+def available(product='', now=None):
+    """
+    Units free to reserve, as an expression: ``stock`` less the units on
+    active holds, summed by one correlated aggregate. ``product`` is the path
+    to the product when annotating another model (``'product'`` on CartItem).
+    """
+    prefix = f'{product}__' if product else ''
+    held = (
+        StockReservation.objects.filter(product=OuterRef(f'{prefix}pk'), expires_at__gt=now or timezone.now())
+        .order_by().values('product').annotate(units=Sum('quantity')).values('units')
+    )
+    return Greatest(F(f'{prefix}stock') - Coalesce(Subquery(held, output_field=IntegerField()), 0), 0)
+
+
+def units_available(product_id):
+    return (
+        Product.objects.filter(pk=product_id).annotate(units=available())
+        .values_list('units', flat=True).first()
+    ) or 0
+
+
+# ================= HOLDS =================
+
+def _take(product_id, quantity):
+    """Move ``quantity`` free units of ``product_id`` into holds, if there are that many."""
+    return bool(
+        Product.objects.filter(pk=product_id, stock__gte=F('reserved') + quantity)
+        .update(reserved=F('reserved') + quantity)
+    )
+
+
+def _give_back(quantities):
+    """Return held units, ``{product_id: quantity}``, in one statement."""
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            reserved=Case(*(When(pk=pk, then=F('reserved') - qty) for pk, qty in quantities.items()))
+        )
+
+
+def _upsert_hold(user_id, product_id, quantity, expires_at):
+    """Add ``quantity`` to the user's hold and restart its TTL in one statement."""
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return _upsert_fallback(user_id, product_id, quantity, expires_at)
+
+    qn = connection.ops.quote_name
+    table = qn(StockReservation._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} ({qn('user_id')}, {qn('product_id')}, {qn('quantity')}, {qn('expires_at')}) "
+        f"VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT ({qn('user_id')}, {qn('product_id')}) DO UPDATE "
+        f"SET {qn('quantity')} = {table}.{qn('quantity')} + excluded.{qn('quantity')}, "
+        f"{qn('expires_at')} = excluded.{qn('expires_at')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, product_id, quantity, expires_at])
+
+
+def _upsert_fallback(user_id, product_id, quantity, expires_at):
+    holds = StockReservation.objects.filter(user_id=user_id, product_id=product_id)
+    if holds.update(quantity=F('quantity') + quantity, expires_at=expires_at):
+        return
+    try:
+        with transaction.atomic():
+            StockReservation.objects.create(
+                user_id=user_id, product_id=product_id, quantity=quantity, expires_at=expires_at,
+            )
+    except IntegrityError:
+        holds.update(quantity=F('quantity') + quantity, expires_at=expires_at)
+
+
+def _reserve(user_id, product_id, quantity):
+    # No savepoint (and so no exception to roll back to it): a cart add
+    # already runs in a transaction and every statement counts there
+    with transaction.atomic(savepoint=False):
+        _upsert_hold(user_id, product_id, quantity, timezone.now() + timedelta(seconds=HOLD_SECONDS))
+        if _take(product_id, quantity):
+            return True
+        # Undo the hold; only its refreshed TTL remains
+        holds = StockReservation.objects.filter(user_id=user_id, product_id=product_id)
+        holds.update(quantity=F('quantity') - quantity)
+        holds.filter(quantity=0).delete()
+        return False
+
+
+def reserve(user_id, product, quantity):
+    """
+    Hold ``quantity`` more units of ``product`` for ``user_id`` and restart
+    the hold's TTL. Returns False when fewer are free; the hold then keeps
+    its previous quantity.
+    """
+    # Units may still sit in holds that expired since the last sweep
+    reserved = _reserve(user_id, product.pk, quantity) or (
+        expire(product_id=product.pk) > 0 and _reserve(user_id, product.pk, quantity)
+    )
+    if reserved:
+        _changed([product.slug])
+    return reserved
+
+
+def release(user_id, product, quantity=None):
+    """Give back ``quantity`` held units (all of them if None); returns how many were released."""
+    with transaction.atomic(savepoint=False):
+        hold = _lock(StockReservation.objects.filter(user_id=user_id, product_id=product.pk)).first()
+        if hold is None:
+            return 0
+        released = hold.quantity if quantity is None else min(quantity, hold.quantity)
+        if released == hold.quantity:
+            hold.delete()
+        else:
+            StockReservation.objects.filter(pk=hold.pk).update(quantity=F('quantity') - released)
+        _give_back({product.pk: released})
+    _changed([product.slug])
+    return released
+
+
+def set_hold(user_id, product, quantity):
+    """Make the user's hold on ``product`` exactly ``quantity`` units; False if not enough are free."""
+    held = (
+        StockReservation.objects.filter(user_id=user_id, product_id=product.pk)
+        .values_list('quantity', flat=True).first()
+    ) or 0
+    if quantity > held:
+        return reserve(user_id, product, quantity - held)
+    if quantity < held:
+        release(user_id, product, held - quantity)
+    return True
+
+
+# ================= CHECKOUT =================
+
+def claim(user):
+    """
+    Lock ``user``'s holds for checkout, expired ones included: their units
+    are still counted in ``Product.reserved`` until swept.
+    """
+    return [
+        Hold(*row) for row in
+        _lock(StockReservation.objects.filter(user=user)).values_list('product_id', 'product__slug', 'quantity')
+    ]
+
+
+def clear(user):
+    """Delete ``user``'s holds once checkout has taken their units out of ``reserved``."""
+    StockReservation.objects.filter(user=user).delete()
+
+
+def release_user(user):
+    """Give back every unit ``user`` holds, expired holds included; used when the user is deleted."""
+    with transaction.atomic(savepoint=False):
+        rows = list(
+            _lock(StockReservation.objects.filter(user=user))
+            .values_list('id', 'product_id', 'product__slug', 'quantity')
+        )
+        if not rows:
+            return
+        quantities = defaultdict(int)
+        for _, pk, _, quantity in rows:
+            quantities[pk] += quantity
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        _give_back(quantities)
+    _changed({slug for _, _, slug, _ in rows})
+
+
+# ================= EXPIRY =================
+
+def expire(now=None, product_id=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Return the units of holds that expired before ``now`` to their products,
+    ``batch_size`` holds per transaction; returns the number removed.
+
+    Holds locked by a checkout or reservation in progress are skipped.
+    """
+    now = now or timezone.now()
+    removed = 0
+    while True:
+        with transaction.atomic(savepoint=False):
+            expired = StockReservation.objects.filter(expires_at__lte=now)
+            if product_id is not None:
+                expired = expired.filter(product_id=product_id)
+            rows = list(
+                _lock(expired, skip_locked=True).order_by('expires_at', 'id')
+                .values_list('id', 'product_id', 'product__slug', 'quantity')[:batch_size]
+            )
+            if not rows:
+                break
+
+            quantities = defaultdict(int)
+            for _, pk, _, quantity in rows:
+                quantities[pk] += quantity
+            StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+            _give_back(quantities)
+            _changed({slug for _, _, slug, _ in rows})
+
+        removed += len(rows)
+        if len(rows) < batch_size:
+            break
+    return removed
+
+
+def recount():
+    """
+    Reset every ``Product.reserved`` from the hold rows, e.g. after holds were
+    deleted outside this module (by raw SQL or a database-level cascade).
+    """
+    held = (
+        StockReservation.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(units=Sum('quantity')).values('units')
+    )
+    return Product.objects.update(reserved=Coalesce(Subquery(held, output_field=IntegerField()), 0))
@@ -0,0 +1,109 @@
+"""
+Primary/replica database routing.
+
+When a ``replica`` database is configured, reads from safe (GET/HEAD)
+requests go to it: catalog pages, search, cart and order history. Everything
+else reads the primary:
+
+* unsafe requests (add to cart, checkout, admin saves) from their start, so
+  the cart locked by checkout is the one it writes back;
+* anything inside a transaction on the primary;
+* code running outside a request (management commands, the job worker);
+* for ``REPLICA_PIN_SECONDS`` after an unsafe request or any request that
+  wrote through the ORM, so the page a POST redirects to shows the user's
+  own change despite replication lag (read-your-writes). A short-lived cookie
+  carries this to the next request. Unsafe requests always pin because some
+  writes (the cart upsert) use raw SQL, which bypasses the router.
+
+Writes always go to the primary.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'db_pin'
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+# None outside requests: read the primary
+_state = ContextVar('shop_db_state', default=None)
+
+
+class _RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def _replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None
+            or state.pinned
+            or not _replica_configured()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+class ReplicaPinMiddleware:
+    """Decide per request whether reads may use the replica. Sync and async capable."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        unsafe, token = self._begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            state = _state.get()
+            _state.reset(token)
+        return self._finish(response, unsafe, state)
+
+    async def __acall__(self, request):
+        unsafe, token = self._begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = _state.get()
+            _state.reset(token)
+        return self._finish(response, unsafe, state)
+
+    def _begin(self, request):
+        unsafe = request.method not in ('GET', 'HEAD', 'OPTIONS')
+        return unsafe, _state.set(_RequestState(unsafe or PIN_COOKIE in request.COOKIES))
+
+    def _finish(self, response, unsafe, state):
+        if (unsafe or state.wrote) and _replica_configured():
+            response.set_cookie(PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
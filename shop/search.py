@@ -0,0 +1,235 @@
+"""
+Product full-text search.
+
+The inverted index lives next to the product table and is kept in sync by
+signals (see ``shop.signals``):
+
+* SQLite: an FTS5 virtual table whose rowid is the product id, plus an
+  ``fts5vocab`` view of its terms for typo correction.
+* PostgreSQL: a ``tsvector`` document per product with a GIN index.
+
+Every query term is prefix-matched; results are ranked with BM25 (SQLite) or
+``ts_rank_cd`` (PostgreSQL). When nothing matches, each term is replaced by
+its closest indexed spelling and the search is retried once. Other database
+backends fall back to ``icontains`` on the product name.
+
+``manage.py rebuild_search_index`` recreates the index from scratch.
+"""
+import difflib
+import re
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .catalog import CARD_FIELDS
+from .models import Product
+
+FTS_TABLE = 'shop_product_fts'
+VOCAB_TABLE = 'shop_product_fts_vocab'
+PG_TABLE = 'shop_product_search'
+
+MAX_TERMS = 8
+RESULT_LIMIT = 48
+INDEX_BATCH_SIZE = 2000
+
+SearchResult = namedtuple('SearchResult', 'products query corrected')
+
+
+def _vendor(conn=None):
+    return (conn or connection).vendor
+
+
+def is_supported(conn=None):
+    return _vendor(conn) in ('sqlite', 'postgresql')
+
+
+# ================= SCHEMA =================
+
+def create_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if _vendor(conn) == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "name, description, category, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')"
+            )
+        elif _vendor(conn) == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {PG_TABLE} ("
+                "product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE "
+                "DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_TABLE}_document_gin ON {PG_TABLE} USING GIN (document)"
+            )
+
+
+def drop_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if _vendor(conn) == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {VOCAB_TABLE}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif _vendor(conn) == 'postgresql':
+            cursor.execute(f"DROP TABLE IF EXISTS {PG_TABLE}")
+
+
+# ================= INDEXING =================
+
+def _rows(products):
+    return [
+        (product.pk, product.name, product.description or '', product.category.name)
+        for product in products
+    ]
+
+
+def index_products(products):
+    """Insert or refresh the index entries for ``products``."""
+    if not is_supported():
+        return
+    rows = _rows(products)
+    if not rows:
+        return
+
+    # One transaction for the batch: in autocommit mode SQLite would commit
+    # (and sync) after every row.
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {PG_TABLE} (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'C') || "
+                "setweight(to_tsvector('simple', %s), 'B')) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = excluded.document",
+                rows,
+            )
+
+
+def remove_products(product_ids):
+    if not is_supported() or not product_ids:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+        else:
+            cursor.execute(f"DELETE FROM {PG_TABLE} WHERE product_id = ANY(%s)", [list(product_ids)])
+
+
+def index_queryset(queryset):
+    """Index a product queryset in bounded-memory batches; returns the count."""
+    count = 0
+    batch = []
+    for product in queryset.select_related('category').only(
+        'id', 'name', 'description', 'category__name'
+    ).iterator(chunk_size=INDEX_BATCH_SIZE):
+        batch.append(product)
+        if len(batch) >= INDEX_BATCH_SIZE:
+            index_products(batch)
+            count += len(batch)
+            batch = []
+    index_products(batch)
+    return count + len(batch)
+
+
+def rebuild_index():
+    drop_index()
+    create_index()
+    return index_queryset(Product.objects.order_by('id'))
+
+
+# ================= QUERYING =================
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _search_ids(terms, limit):
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 4.0) LIMIT %s",
+                [match, limit],
+            )
+        else:
+            tsquery = ' & '.join(f"{term}:*" for term in terms)
+            cursor.execute(
+                f"SELECT product_id FROM {PG_TABLE}, to_tsquery('simple', %s) query "
+                "WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC LIMIT %s",
+                [tsquery, limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _vocabulary(initial, length):
+    """Indexed terms starting with ``initial`` whose length is close to ``length``."""
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            cursor.execute(
+                f"SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s "
+                "AND length(term) BETWEEN %s AND %s",
+                [initial, chr(ord(initial) + 1), length - 2, length + 2],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # ts_stat scans every document, so the PostgreSQL vocabulary is cached.
+    key = f"search-vocab:{initial}"
+    words = cache.get(key)
+    if words is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT word FROM ts_stat('SELECT document FROM {PG_TABLE}') WHERE word LIKE %s",
+                [initial + '%'],
+            )
+            words = [row[0] for row in cursor.fetchall()]
+        cache.set(key, words, 60 * 60)
+    return [word for word in words if abs(len(word) - length) <= 2]
+
+
+def _correct(terms):
+    corrected = []
+    for term in terms:
+        candidates = _vocabulary(term[0], len(term)) if len(term) > 2 else []
+        match = difflib.get_close_matches(term, candidates, n=1, cutoff=0.7)
+        corrected.append(match[0] if match else term)
+    return corrected
+
+
+def _load(ids):
+    products = Product.objects.select_related('category').only(*CARD_FIELDS).in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+def search_products(query, limit=RESULT_LIMIT):
+    terms = _terms(query)
+    if not terms:
+        return SearchResult([], query, None)
+
+    if not is_supported():
+        products = Product.objects.select_related('category').only(*CARD_FIELDS)
+        for term in terms:
+            products = products.filter(name__icontains=term)
+        return SearchResult(list(products.order_by('-created_at')[:limit]), query, None)
+
+    ids = _search_ids(terms, limit)
+    corrected = None
+    if not ids:
+        fixed = _correct(terms)
+        if fixed != terms:
+            ids = _search_ids(fixed, limit)
+            corrected = ' '.join(fixed)
+
+    return SearchResult(_load(ids), query, corrected)
@@ -0,0 +1,142 @@
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import analytics, reservations
+from .caching import bump
+from .cart import merge_cookie_cart
+from .images import needs_refresh
+from .invoice import purge_invoice_cache
+from .search import index_products, remove_products
+from .tasks import enqueue
+from .models import Category, HeroSection, Order, Product
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._previous_status = None
+        return
+    instance._previous_status = (
+        Order.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Order)
+def order_status_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_status', None)
+    if created or previous is None or previous == instance.status:
+        return
+
+    # Cached invoices print the status, so they are stale now
+    transaction.on_commit(lambda: purge_invoice_cache(instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def release_user_holds(sender, instance, **kwargs):
+    # The cascade would delete the holds without returning their units
+    reservations.release_user(instance)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    short = merge_cookie_cart(request, user)
+    if short:
+        names = ", ".join(product.name for product in short)
+        messages.warning(request, f"Not enough stock left to add all of: {names}", fail_silently=True)
+
+
+# ================= SALES ROLLUPS =================
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, created, **kwargs):
+    # Order lines are written after the order itself, so the rollups are read
+    # once the transaction has committed. The status is captured now so a
+    # later change in the same transaction is not counted twice.
+    status = instance.status
+    previous = getattr(instance, '_previous_status', None)
+    if created:
+        transaction.on_commit(lambda: analytics.record_order(instance.pk, status))
+    elif previous is not None and previous != status:
+        transaction.on_commit(lambda: analytics.move_order(instance.pk, previous, status))
+
+
+@receiver(pre_delete, sender=Order)
+def remember_order_sales(sender, instance, **kwargs):
+    instance._sales_snapshot = analytics.snapshot(instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_sales(sender, instance, **kwargs):
+    snap = getattr(instance, '_sales_snapshot', None)
+    transaction.on_commit(lambda: analytics.apply(snap, sign=-1))
+
+
+# ================= PAGE CACHE =================
+
+@receiver(pre_save, sender=Product)
+def remember_product_slug(sender, instance, **kwargs):
+    instance._previous_slug = (
+        Product.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    namespaces = {'catalog', f'product:{instance.slug}'}
+    previous = getattr(instance, '_previous_slug', None)
+    if previous:
+        namespaces.add(f'product:{previous}')
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump('catalog'))
+
+
+@receiver(post_save, sender=HeroSection)
+@receiver(post_delete, sender=HeroSection)
+def hero_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump('hero'))
+
+
+# ================= SEARCH INDEX =================
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: index_products([instance]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    # delete() clears instance.pk before the commit callbacks run
+    pk = instance.pk
+    transaction.on_commit(lambda: remove_products([pk]))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    # A category can hold many products; reindex them off the request path
+    if not created:
+        enqueue('reindex_category', category_id=instance.pk)
+
+
+# ================= IMAGE DERIVATIVES =================
+
+@receiver(post_save, sender=Product)
+def product_image_changed(sender, instance, **kwargs):
+    if needs_refresh(instance, 'product'):
+        enqueue('image_variants', model='product', pk=instance.pk)
+
+
+@receiver(post_save, sender=HeroSection)
+def hero_image_changed(sender, instance, **kwargs):
+    if needs_refresh(instance, 'hero'):
+        enqueue('image_variants', model='hero', pk=instance.pk)
@@ -0,0 +1,184 @@
+"""
+Database-backed background jobs.
+
+Views call ``enqueue()`` to record work in the ``Job`` table and return
+immediately; ``manage.py run_worker`` claims due jobs, runs them on a thread
+pool and retries failures with exponential backoff until ``max_attempts`` is
+reached, after which the job is parked in the ``Dead`` state.
+"""
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, Order, Product
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 30)
+RETRY_MAX_SECONDS = getattr(settings, 'JOB_RETRY_MAX_SECONDS', 3600)
+STALE_AFTER = timedelta(seconds=getattr(settings, 'JOB_STALE_SECONDS', 600))
+
+# name -> (handler, is_batch)
+_HANDLERS = {}
+
+
+def task(name, batch=False):
+    """
+    Register a job handler.
+
+    Plain handlers receive one ``Job``. Batch handlers receive a list of jobs
+    with the same name and return ``{job.id: exception}`` for the ones that
+    failed, so a single bad job does not fail its neighbours.
+    """
+    def decorator(func):
+        _HANDLERS[name] = (func, batch)
+        return func
+    return decorator
+
+
+def enqueue(name, max_attempts=5, run_at=None, **payload):
+    if name not in _HANDLERS:
+        raise ValueError(f"Unknown job: {name}")
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def claim_jobs(limit=50, worker_id=None):
+    """
+    Atomically mark up to ``limit`` due jobs as Running for this worker.
+
+    Jobs left Running by a crashed worker are picked up again once they are
+    older than ``JOB_STALE_SECONDS``. A claim uses up an attempt, so a job
+    that keeps taking its worker down goes Dead like any other failure.
+    """
+    worker_id = worker_id or uuid.uuid4().hex
+    now = timezone.now()
+    stale = Q(status='Running', locked_at__lt=now - STALE_AFTER)
+    due = Q(status='Pending', run_at__lte=now) | stale
+
+    with transaction.atomic():
+        candidates = Job.objects.filter(due).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:limit])
+        Job.objects.filter(stale, id__in=ids, attempts__gte=F('max_attempts')).update(
+            status='Dead', locked_by='', locked_at=None,
+            last_error="Worker stopped or timed out while running the last attempt",
+        )
+        # The status filter makes the claim conditional, so two workers racing
+        # for the same rows on backends without SKIP LOCKED cannot both win.
+        Job.objects.filter(due, id__in=ids).update(
+            status='Running', locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+        )
+
+    return list(Job.objects.filter(status='Running', locked_by=worker_id, locked_at=now))
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def _finish(job, error=None):
+    # job.attempts was counted when the job was claimed
+    job.locked_by = ''
+    job.locked_at = None
+
+    if error is None:
+        job.status = 'Done'
+        job.last_error = ''
+    else:
+        job.last_error = ''.join(traceback.format_exception(error))[-4000:]
+        if job.attempts >= job.max_attempts:
+            job.status = 'Dead'
+            logger.error("Job %s is dead after %s attempts", job, job.attempts)
+        else:
+            job.status = 'Pending'
+            job.run_at = timezone.now() + _backoff(job.attempts)
+            logger.warning("Job %s failed, retrying at %s", job, job.run_at)
+
+    job.save(update_fields=['status', 'attempts', 'run_at', 'locked_by', 'locked_at', 'last_error'])
+
+
+def run_jobs(jobs):
+    """Run claimed jobs that share a name and record the outcome of each."""
+    if not jobs:
+        return
+
+    handler, is_batch = _HANDLERS.get(jobs[0].name, (None, False))
+    if handler is None:
+        for job in jobs:
+            _finish(job, LookupError(f"No handler registered for {job.name}"))
+        return
+
+    if is_batch:
+        try:
+            errors = handler(jobs) or {}
+        except Exception as exc:
+            errors = {job.id: exc for job in jobs}
+        for job in jobs:
+            _finish(job, errors.get(job.id))
+        return
+
+    for job in jobs:
+        try:
+            handler(job)
+        except Exception as exc:
+            _finish(job, exc)
+        else:
+            _finish(job)
+
+
+# ================= HANDLERS =================
+
+@task('invoice', batch=True)
+def send_invoices(jobs):
+    """Mail cached invoices over a single reused SMTP connection."""
+    from .invoice import build_invoice_email, get_invoice_pdf
+
+    orders = (
+        Order.objects.select_related('user')
+        .prefetch_related('items__product')
+        .in_bulk([job.payload['order_id'] for job in jobs])
+    )
+    errors = {}
+
+    with get_connection() as mail_connection:
+        for job in jobs:
+            order = orders.get(job.payload['order_id'])
+            if order is None:
+                errors[job.id] = Order.DoesNotExist(f"Order {job.payload['order_id']} not found")
+                continue
+            if not order.user.email:
+                continue
+            try:
+                pdf_bytes = get_invoice_pdf(order)
+                build_invoice_email(order, pdf_bytes, connection=mail_connection).send()
+            except Exception as exc:
+                errors[job.id] = exc
+
+    return errors
+
+
+@task('reindex_category')
+def reindex_category(job):
+    from .search import index_queryset
+
+    index_queryset(Product.objects.filter(category_id=job.payload['category_id']))
+
+
+@task('image_variants')
+def generate_image_variants(job):
+    from .images import refresh_variants
+
+    refresh_variants(job.payload['model'], job.payload['pk'])
@@ -0,0 +1,55 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+FALLBACK_TYPE = 'image/jpeg'
+
+
+def _srcset(names):
+    return ', '.join(
+        f"{default_storage.url(name)} {width}w"
+        for width, name in sorted(names.items(), key=lambda entry: int(entry[0]))
+    )
+
+
+@register.simple_tag
+def picture(field_file, variants=None, sizes='100vw', alt='', css_class='', loading='lazy'):
+    """
+    Render ``<picture>`` with one ``<source>`` per pre-generated format.
+
+    Falls back to the original upload when no derivatives exist yet and to
+    nothing at all when there is no image.
+    """
+    if not field_file:
+        return ''
+
+    formats = (variants or {}).get('formats') or {}
+    if not formats:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async">',
+            field_file.url, alt, css_class, loading,
+        )
+
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((mime, _srcset(names), sizes) for mime, names in formats.items() if mime != FALLBACK_TYPE),
+    )
+
+    fallback = formats.get(FALLBACK_TYPE) or {}
+    if fallback:
+        largest = max(fallback, key=int)
+        img = format_html(
+            '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" '
+            'loading="{}" decoding="async">',
+            default_storage.url(fallback[largest]), _srcset(fallback), sizes,
+            variants.get('width', ''), variants.get('height', ''), alt, css_class, loading,
+        )
+    else:
+        img = format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async">',
+            field_file.url, alt, css_class, loading,
+        )
+
+    return format_html('<picture>{}{}</picture>', sources, img)
@@ -0,0 +1,50 @@
+"""
+The benchmark suite (``shop.benchmark``) as a test, so query budgets gate CI.
+
+Seeding and timing take a while, so it only runs with ``SHOP_BENCHMARK=1``:
+
+    SHOP_BENCHMARK=1 python manage.py test shop.test_benchmark
+"""
+import os
+import tempfile
+import unittest
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from . import benchmark
+
+SCALE = benchmark.Scale(categories=3, products=60, users=3, orders_per_user=3, items_per_order=3)
+
+
+@unittest.skipUnless(os.environ.get('SHOP_BENCHMARK') == '1', "set SHOP_BENCHMARK=1 to run the benchmarks")
+class BenchmarkTests(TransactionTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory(prefix='shop-bench-')
+        self.addCleanup(tmp.cleanup)
+        storage = {"BACKEND": "django.core.files.storage.FileSystemStorage", "OPTIONS": {"location": tmp.name}}
+        overrides = override_settings(
+            STORAGES={
+                "default": storage,
+                "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+                "invoices": storage,
+            },
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+
+    def test_query_budgets(self):
+        data = benchmark.seed(SCALE)
+        summaries = benchmark.summarize(benchmark.run_scenarios(data, iterations=3))
+
+        self.assertEqual({s.scenario for s in summaries}, set(benchmark.SCENARIOS))
+        self.assertEqual([s for s in summaries if s.errors], [])
+        self.assertEqual(benchmark.over_budget(summaries), [])
+
+    def test_drop(self):
+        drop = benchmark.run_drop(shoppers=40, threads=8, stock=10)
+
+        self.assertEqual(drop.problems, [])
+        self.assertEqual(drop.reserved, 10)
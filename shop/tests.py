@@ -0,0 +1,1055 @@
+import csv
+import json
+import re
+import tempfile
+import threading
+import unittest
+import zlib
+from decimal import ROUND_HALF_UP, Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+
+from ecommerce_site import database
+
+from . import (
+    async_views, caching, cart, checkout, exports, imports, invoice, pricing, profiling, routers, search,
+    staticfiles,
+)
+from . import urls as shop_urls
+from .images import build_variants, formats, refresh_variants
+from .management.commands import explain_hot_queries, startup_profile
+from .models import (
+    CartItem, Category, CategorySalesDay, Order, OrderItem, Product, ProductSalesDay, SalesDay, StockReservation,
+)
+
+
+def make_product(name='Print', stock=10, price='100.00', category=None):
+    category = category or Category.objects.get_or_create(name='Prints', slug='prints')[0]
+    return Product.objects.create(
+        category=category, name=name, slug=name.lower().replace(' ', '-'), price=Decimal(price), stock=stock,
+    )
+
+
+def temp_storages(test):
+    """Point the default and invoices storages at a temporary directory for ``test``."""
+    tmp = tempfile.TemporaryDirectory(prefix='shop-test-')
+    test.addCleanup(tmp.cleanup)
+    storage = {"BACKEND": "django.core.files.storage.FileSystemStorage", "OPTIONS": {"location": tmp.name}}
+    overrides = override_settings(STORAGES={
+        "default": storage,
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+        "invoices": storage,
+    })
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+    return tmp.name
+
+
+def make_order(user, products, quantity=1):
+    order = Order.objects.create(
+        user=user, total_price=sum(product.price * quantity for product in products), item_count=len(products),
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, quantity=quantity, price=product.price) for product in products
+    )
+    return order
+
+
+def run_threads(target, count):
+    """Run ``target(i)`` on ``count`` threads released together; returns their results."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        try:
+            barrier.wait()
+            results[i] = target(i)
+        except Exception as exc:
+            results[i] = exc
+        finally:
+            # Each thread opened its own connection
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# ================= CHECKOUT =================
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    shoppers = 12
+    stock = 5
+
+    def test_no_oversell(self):
+        product = make_product(stock=self.stock)
+        users = [User.objects.create_user(f'shopper{i}') for i in range(self.shoppers)]
+        CartItem.objects.bulk_create(CartItem(user=user, product=product, quantity=1) for user in users)
+
+        def buy(i):
+            try:
+                return checkout.place_order(users[i])
+            except checkout.OutOfStock:
+                return None
+
+        results = run_threads(buy, self.shoppers)
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(sum(isinstance(result, Order) for result in results), self.stock)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+
+
+class CheckoutQueryTests(TestCase):
+    def _cart(self, name, lines):
+        user = User.objects.create_user(name)
+        category = Category.objects.create(name=name, slug=name)
+        products = Product.objects.bulk_create(
+            Product(category=category, name=f'{name} {i}', slug=f'{name}-{i}', price=Decimal('10.00'), stock=5)
+            for i in range(lines)
+        )
+        CartItem.objects.bulk_create(CartItem(user=user, product=product, quantity=2) for product in products)
+        return user
+
+    def test_constant_queries(self):
+        small, large = self._cart('small', 1), self._cart('large', 120)
+        with CaptureQueriesContext(connection) as queries:
+            checkout.place_order(small)
+
+        with self.assertNumQueries(len(queries)):
+            order = checkout.place_order(large)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 120)
+        self.assertFalse(Product.objects.filter(category__slug='large').exclude(stock=3).exists())
+
+
+# ================= PRICING =================
+
+D = Decimal
+
+
+class AllocateTests(SimpleTestCase):
+    def test_shares_add_up_exactly(self):
+        for amount, weights in [
+            (D('10.00'), [D('1'), D('1'), D('1')]),
+            (D('0.01'), [D('3'), D('5'), D('2')]),
+            (D('99.99'), [D('33.33'), D('0.01'), D('66.65'), D('12.50')]),
+        ]:
+            shares = pricing.allocate(amount, weights)
+            self.assertEqual(sum(shares), amount, weights)
+            self.assertTrue(all(share == share.quantize(pricing.CENT) for share in shares))
+
+    def test_largest_weight_takes_the_remainder(self):
+        self.assertEqual(pricing.allocate(D('10.00'), [D('1'), D('2'), D('1')]), [D('2.50'), D('5.00'), D('2.50')])
+        self.assertEqual(pricing.allocate(D('10.00'), [D('1'), D('1'), D('1')]), [D('3.34'), D('3.33'), D('3.33')])
+        self.assertEqual(pricing.allocate(D('0.01'), [D('5'), D('3'), D('2')]), [D('0.01'), D('0.00'), D('0.00')])
+
+    def test_nothing_to_split(self):
+        self.assertEqual(pricing.allocate(D('0.00'), [D('1'), D('2')]), [D('0.00'), D('0.00')])
+        self.assertEqual(pricing.allocate(D('5.00'), [D('0.00'), D('0.00')]), [D('0.00'), D('0.00')])
+        self.assertEqual(pricing.allocate(D('5.00'), []), [])
+
+
+class PriceLinesTests(SimpleTestCase):
+    def test_tax_rounds_half_up_per_line(self):
+        # 0.25 * 18% = 0.045: half-up gives 0.05 where half-even would give 0.04
+        result = pricing.price_lines([pricing.Line(D('0.25'), 1, D('18.00')), pricing.Line(D('0.25'), 1, D('18.00'))])
+        self.assertEqual([line.tax for line in result.lines], [D('0.05'), D('0.05')])
+        self.assertEqual((result.subtotal, result.tax, result.total), (D('0.50'), D('0.10'), D('0.60')))
+
+    def test_discount_is_spread_before_tax(self):
+        lines = [
+            pricing.Line(D('100.00'), 1, D('18.00')),
+            pricing.Line(D('33.33'), 3, D('5.00')),
+            pricing.Line(D('0.99'), 1, D('12.00')),
+        ]
+        result = pricing.price_lines(lines, discount=D('10.00'))
+
+        self.assertEqual(result.discount, D('10.00'))
+        # 4.98 + 4.98 + 0.05 rounds to a paisa too much; the largest line gives it back
+        self.assertEqual([line.discount for line in result.lines], [D('4.97'), D('4.98'), D('0.05')])
+        for line in result.lines:
+            taxable = line.subtotal - line.discount
+            self.assertEqual(line.tax, (taxable * line.tax_rate / 100).quantize(pricing.CENT, ROUND_HALF_UP))
+            self.assertEqual(line.total, taxable + line.tax)
+        self.assertEqual(result.total, sum(line.total for line in result.lines))
+        self.assertEqual(result.total, result.subtotal - result.discount + result.tax)
+        self.assertEqual(result.item_count, 3)
+
+    def test_discount_is_capped_at_the_subtotal(self):
+        result = pricing.price_lines([pricing.Line(D('20.00'), 2, D('18.00'))], discount=D('100.00'))
+        self.assertEqual((result.subtotal, result.discount, result.tax, result.total), (D('40.00'), D('40.00'), 0, 0))
+
+
+class OrderPricingBackfillTests(TransactionTestCase):
+    """Migration 0016 rewrites historical orders: total_price then held the pre-tax subtotal."""
+
+    before = [('shop', '0015_query_pattern_indexes')]
+    after = [('shop', '0016_order_pricing')]
+
+    def _migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('shop'))
+
+    def test_totals_include_legacy_gst(self):
+        apps = self._migrate(self.before)
+        Category, Product = apps.get_model('shop', 'Category'), apps.get_model('shop', 'Product')
+        Order, OrderItem = apps.get_model('shop', 'Order'), apps.get_model('shop', 'OrderItem')
+        user = apps.get_model('auth', 'User').objects.create(username='quinn')
+        category = Category.objects.create(name='Prints', slug='prints')
+        products = [
+            Product.objects.create(category=category, name=name, slug=name, price=price, stock=1)
+            for name, price in [('a', D('10.01')), ('b', D('20.02')), ('c', D('0.07'))]
+        ]
+        order = Order.objects.create(user=user, total_price=D('70.12'))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[0], quantity=1, price=D('10.01')),
+            OrderItem(order=order, product=products[1], quantity=3, price=D('20.02')),
+            OrderItem(order=order, product=products[2], quantity=1, price=D('0.05')),
+        ])
+        empty = Order.objects.create(user=user, total_price=D('5.00'))
+
+        apps = self._migrate(self.after)
+        Order, OrderItem = apps.get_model('shop', 'Order'), apps.get_model('shop', 'OrderItem')
+
+        order = Order.objects.get(pk=order.pk)
+        # 18% of 70.12 is 12.6216, rounded once for the order
+        self.assertEqual(
+            (order.subtotal, order.tax_total, order.total_price, order.item_count),
+            (D('70.12'), D('12.62'), D('82.74'), 3),
+        )
+        items = list(OrderItem.objects.filter(order=order).order_by('pk'))
+        self.assertEqual(sum(item.tax for item in items), order.tax_total)
+        self.assertEqual(sum(item.total for item in items), order.total_price)
+        self.assertTrue(all(item.tax_rate == D('18.00') for item in items))
+        self.assertEqual([item.tax for item in items], [D('1.80'), D('10.81'), D('0.01')])
+
+        empty = Order.objects.get(pk=empty.pk)
+        self.assertEqual((empty.subtotal, empty.tax_total, empty.total_price), (D('5.00'), 0, D('5.00')))
+
+
+# ================= CART =================
+
+class CookieCartTests(TestCase):
+    def test_anonymous_cart_is_a_cookie_merged_on_login(self):
+        product = make_product()
+        self.client.post(f'/add-to-cart/{product.pk}/')
+        self.client.post(f'/add-to-cart/{product.pk}/')
+        self.assertIn('cart', self.client.cookies)
+        self.assertFalse(Session.objects.exists())
+
+        User.objects.create_user('carol', password='secret')
+        response = self.client.post('/login/', {'username': 'carol', 'password': 'secret'})
+        self.assertEqual(response.cookies['cart'].value, '')
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(product.pk, 2)])
+        self.assertEqual(list(StockReservation.objects.values_list('product_id', 'quantity')), [(product.pk, 2)])
+
+        # The session is stored server side, so logging out revokes it
+        session_key = self.client.session.session_key
+        self.client.get('/logout/')
+        self.assertFalse(Session.objects.filter(session_key=session_key).exists())
+
+    def test_update_drops_a_deleted_product(self):
+        pk = make_product().pk
+        self.client.post(f'/add-to-cart/{pk}/')
+        Product.objects.filter(pk=pk).delete()
+
+        response = self.client.post(f'/update-cart/{pk}/', {'quantity': 3})
+        self.assertRedirects(response, '/cart/')
+        self.assertEqual(self.client.get('/cart/').context['cart_items'], [])
+
+    def test_merge_is_capped_at_free_units(self):
+        product = make_product(stock=3)
+        cart.DatabaseCart(User.objects.create_user('rival')).add(product, 2)
+        self.client.post(f'/add-to-cart/{product.pk}/', {'quantity': 2})
+
+        user = User.objects.create_user('frank', password='secret')
+        response = self.client.post('/login/', {'username': 'frank', 'password': 'secret'}, follow=True)
+
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 1)
+        self.assertEqual(StockReservation.objects.get(user=user).quantity, 1)
+        product.refresh_from_db()
+        self.assertEqual(product.reserved, 3)
+        self.assertContains(response, 'Not enough stock left')
+
+
+class CartTotalTests(TestCase):
+    def test_total_follows_a_price_change(self):
+        cache.clear()
+        product = make_product(price='100.00')
+        user = User.objects.create_user('hank')
+        cart.DatabaseCart(user).add(product, 2)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/cart/').context['total'], Decimal('200.00'))
+
+        product.price = Decimal('150.00')
+        product.save()
+        self.assertEqual(self.client.get('/cart/').context['total'], Decimal('300.00'))
+
+    def test_cookie_cart_total_follows_a_price_change(self):
+        product = make_product(price='100.00')
+        self.client.post(f'/add-to-cart/{product.pk}/', {'quantity': 2})
+
+        Product.objects.filter(pk=product.pk).update(price=Decimal('150.00'))
+        self.assertEqual(self.client.get('/cart/').context['total'], Decimal('300.00'))
+
+
+class CartInputTests(TestCase):
+    def test_bad_quantities_are_a_message(self):
+        product = make_product()
+        for value in ('', 'two', '1.5'):
+            response = self.client.post(f'/add-to-cart/{product.pk}/', {'quantity': value}, follow=True)
+            self.assertRedirects(response, '/cart/')
+            self.assertContains(response, 'Quantity must be a whole number')
+
+        self.client.post(f'/add-to-cart/{product.pk}/')
+        for data in ({}, {'quantity': 'x'}):
+            response = self.client.post(f'/update-cart/{product.pk}/', data, follow=True)
+            self.assertContains(response, 'Quantity must be a whole number')
+        self.assertEqual(response.context['cart_items'][0].quantity, 1)
+
+    def test_adding_needs_a_post(self):
+        product = make_product()
+        self.assertEqual(self.client.get(f'/add-to-cart/{product.pk}/').status_code, 405)
+        self.assertNotIn('cart', self.client.cookies)
+
+        response = self.client.get(f'/product/{product.slug}/')
+        self.assertContains(response, f'<form method="post" action="/add-to-cart/{product.pk}/">', html=False)
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    def test_no_lost_updates(self):
+        product = make_product(stock=500)
+        user = User.objects.create_user('dave')
+
+        def add(i):
+            for _ in range(10):
+                cart.DatabaseCart(user).add(product, 1)
+
+        results = run_threads(add, 20)
+
+        self.assertEqual([result for result in results if isinstance(result, Exception)], [])
+        self.assertEqual(CartItem.objects.get(user=user, product=product).quantity, 200)
+        self.assertEqual(StockReservation.objects.get(user=user, product=product).quantity, 200)
+        product.refresh_from_db()
+        self.assertEqual(product.reserved, 200)
+
+
+class CartStockTests(TestCase):
+    def test_rejects_more_than_stock(self):
+        product = make_product(stock=3)
+        user = User.objects.create_user('erin')
+        user_cart = cart.DatabaseCart(user)
+
+        user_cart.add(product, 2)
+        with self.assertRaises(cart.InsufficientStock):
+            user_cart.add(product, 2)
+        with self.assertRaises(cart.InsufficientStock):
+            user_cart.update(product.pk, 4)
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 2)
+
+        user_cart.update(product.pk, 3)
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 3)
+        product.refresh_from_db()
+        self.assertEqual(product.reserved, 3)
+
+    def test_deleting_a_user_gives_back_their_holds(self):
+        product = make_product(stock=5)
+        user = User.objects.create_user('gina')
+        cart.DatabaseCart(user).add(product, 4)
+
+        user.delete()
+        product.refresh_from_db()
+        self.assertEqual(product.reserved, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+# ================= ORDER HISTORY =================
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        products = [make_product(f'Print {i}') for i in range(3)]
+        cls.alice, cls.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        for user in (cls.alice, cls.bob):
+            for _ in range(22):
+                order = Order.objects.create(user=user, total_price=Decimal('300.00'), item_count=3)
+                OrderItem.objects.bulk_create(
+                    OrderItem(order=order, product=product, quantity=1, price=product.price) for product in products
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def test_fixed_queries_and_scoped_to_user(self):
+        # Session, user, COUNT, cart summary, the page and one items prefetch
+        with self.assertNumQueries(6):
+            response = self.client.get('/orders/')
+        orders = list(response.context['orders'])
+        self.assertEqual(len(orders), 20)
+        self.assertEqual({order.user_id for order in orders}, {self.alice.pk})
+        self.assertEqual(response.context['page_obj'].paginator.count, 22)
+
+        # The cart summary is cached now
+        with self.assertNumQueries(5):
+            response = self.client.get('/orders/', {'page': 2})
+        self.assertEqual([order.user_id for order in response.context['orders']], [self.alice.pk] * 2)
+
+
+# ================= INVOICES =================
+
+class InvoiceCacheTests(TestCase):
+    def setUp(self):
+        temp_storages(self)
+        self.user = User.objects.create_user('ivy')
+        self.order = make_order(self.user, [make_product()])
+
+    def _files(self):
+        return invoice._storage().listdir(str(self.order.pk))[1]
+
+    def test_rendered_once(self):
+        with mock.patch.object(invoice, 'generate_invoice_pdf', wraps=invoice.generate_invoice_pdf) as render:
+            first = invoice.cached_invoice(self.order)
+            second = invoice.cached_invoice(self.order)
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(self._files(), [f"{first[1]}.pdf"])
+
+    def test_download_revalidates_with_etag(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'/invoice/{self.order.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        response = self.client.get(f'/invoice/{self.order.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_status_change_purges(self):
+        old_name, old_etag = invoice.cached_invoice(self.order)
+
+        self.order.status = 'Shipped'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+        self.assertEqual(self._files(), [])
+
+        name, etag = invoice.cached_invoice(self.order)
+        self.assertNotEqual(etag, old_etag)
+        self.assertEqual(self._files(), [f"{etag}.pdf"])
+
+    def test_racing_miss_keeps_one_file(self):
+        name, _ = invoice.cached_invoice(self.order)
+        storage = invoice._storage()
+        exists = storage.exists
+        checks = []
+
+        def stale_exists(path):
+            # The first check answers as it did before the other request saved
+            checks.append(path)
+            return len(checks) > 1 and exists(path)
+
+        with mock.patch.object(storage, 'exists', side_effect=stale_exists):
+            self.assertEqual(invoice.cached_invoice(self.order)[0], name)
+        self.assertEqual(self._files(), [name.split('/')[1]])
+
+
+# ================= ASYNC VIEWS =================
+
+ASYNC_VIEW_NAMES = {'index', 'product_list', 'product_detail', 'order_history'}
+
+
+class AsyncUrls:
+    """The shop with its async read views, as ``shop.urls`` serves it under ASGI."""
+    urlpatterns = [
+        path('', include(([
+            path('', async_views.index, name='index'),
+            path('products/', async_views.product_list, name='product_list'),
+            path('product/<slug:slug>/', async_views.product_detail, name='product_detail'),
+            path('orders/', async_views.order_history, name='order_history'),
+            *[pattern for pattern in shop_urls.urlpatterns if pattern.name not in ASYNC_VIEW_NAMES],
+        ], 'shop'))),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(TestCase):
+    client_class = AsyncClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = make_product('Brass Lantern')
+        cls.user = User.objects.create_user('olga')
+        make_order(cls.user, [cls.product])
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_catalog_pages(self):
+        response = await self.client.get('/products/')
+        self.assertIs(response.resolver_match.func, async_views.product_list)
+        self.assertContains(response, 'Brass Lantern')
+        self.assertEqual([product.pk for product in response.context['products']], [self.product.pk])
+
+        response = await self.client.get(f'/product/{self.product.slug}/')
+        self.assertContains(response, 'Brass Lantern')
+        self.assertEqual(response.context['product'].available, 10)
+
+        self.assertEqual((await self.client.get('/product/missing/')).status_code, 404)
+        self.assertEqual((await self.client.get('/')).status_code, 200)
+
+    async def test_order_history_needs_login(self):
+        response = await self.client.get('/orders/')
+        self.assertEqual(response.status_code, 302)
+
+        await self.client.aforce_login(self.user)
+        response = await self.client.get('/orders/')
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertEqual([order.user_id for order in response.context['orders']], [self.user.pk])
+
+
+# ================= INDEXES =================
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "PostgreSQL plans need ANALYZE on realistic data")
+class HotQueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', strict=True, stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_full_scan_fails_strict_runs(self):
+        queries = [('product_list', "by description", Product.objects.filter(description='Brass'))]
+        with mock.patch.object(explain_hot_queries, 'hot_queries', return_value=queries):
+            call_command('explain_hot_queries', stdout=StringIO())
+            with self.assertRaisesMessage(CommandError, '1 query with full table scans'):
+                call_command('explain_hot_queries', strict=True, stdout=StringIO())
+
+
+def pdf_pages(pdf):
+    """The strings drawn on each page of an invoice PDF (built-in fonts only)."""
+    pages = []
+    for stream in re.findall(rb'stream\r?\n(.*?)endstream', pdf, re.S):
+        stream = zlib.decompressobj().decompress(stream)
+        # Page streams draw the letterhead form; the form itself does not
+        if b'/FormXob.letterhead Do' in stream:
+            pages.append([
+                re.sub(rb'\\(.)', rb'\1', text).decode('latin-1') for text in re.findall(rb'\((.*?)\) Tj', stream)
+            ])
+    return pages
+
+
+class InvoiceLayoutTests(TestCase):
+    def test_long_orders_continue_on_more_pages(self):
+        products = [make_product(f'Print {i:02}') for i in range(80)]
+        order = make_order(User.objects.create_user('pia'), products)
+
+        # 37 rows under the order details on page 1, 40 on later pages
+        pages = pdf_pages(invoice.generate_invoice_pdf(order))
+        self.assertEqual(len(pages), 3)
+
+        printed = [text for page in pages for text in page if text.startswith('Print ')]
+        self.assertEqual(printed, [product.name for product in products])
+        for number, page in enumerate(pages, 1):
+            self.assertIn(f'Page {number} of {len(pages)}', page)
+        self.assertIn(f'Invoice for Order #{order.pk} (continued)', pages[-1])
+
+    def test_paginate_covers_every_item_once(self):
+        for count in (0, 1, 5, 20, 21, 60, 101):
+            pages = invoice._paginate(count, 20, 40)
+            self.assertEqual([i for start, end in pages for i in range(start, end)], list(range(count)), count)
+            self.assertLessEqual(pages[0][1] - pages[0][0], 20)
+            self.assertTrue(all(end - start <= 40 for start, end in pages[1:]), count)
+
+
+# ================= CATALOG =================
+
+class IndexTests(TestCase):
+    def test_only_the_hero_is_queried(self):
+        cache.clear()
+        make_product()
+        with self.assertNumQueries(1):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('products', response.context)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(caching, 'PAGE_CACHE_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.product = make_product('Lantern')
+
+    def test_anonymous_pages_are_cached(self):
+        self.client.get('/products/')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get('/products/'), 'Lantern')
+
+        self.client.force_login(User.objects.create_user('kim'))
+        self.client.get('/products/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/products/')
+        self.assertTrue(queries)
+
+    def test_cart_and_messages_cookies_skip_the_cache(self):
+        self.client.get('/products/')
+        for name in ('cart', 'messages'):
+            self.client.cookies.clear()
+            self.client.cookies[name] = 'x'
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/products/')
+            self.assertTrue(queries, name)
+
+    def test_saving_a_product_bumps_its_pages(self):
+        self.assertContains(self.client.get('/products/'), 'Lantern')
+
+        self.product.name = 'Teapot'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get('/products/')
+        self.assertContains(response, 'Teapot')
+        self.assertNotContains(response, 'Lantern')
+
+    def test_off_with_a_per_process_cache(self):
+        self.assertFalse(caching.shared_cache())
+        self.assertEqual([w.id for w in caching.check_page_cache_backend(None)], ['shop.W001'])
+        with mock.patch.object(caching, 'PAGE_CACHE_ENABLED', False):
+            self.assertEqual(caching.check_page_cache_backend(None), [])
+
+
+class CatalogFilterTests(TestCase):
+    def test_non_finite_prices_are_ignored(self):
+        make_product()
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf', 'abc'):
+            response = self.client.get('/products/', {'min_price': value, 'max_price': value})
+            self.assertEqual(response.status_code, 200, value)
+            self.assertContains(response, 'Print')
+
+
+# ================= SALES ROLLUPS =================
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.product = make_product(price='100.00')
+        user = User.objects.create_user('mia')
+        cart.DatabaseCart(user).add(self.product, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = checkout.place_order(user)
+        lines = OrderItem.objects.filter(order=self.order)
+        self.revenue = sum(line.total - line.tax for line in lines)
+
+    def _rollups(self, model):
+        return list(model.objects.values_list('status', 'revenue', 'orders', 'units'))
+
+    def test_placing_records_the_order(self):
+        expected = [('Placed', self.revenue, 1, 3)]
+        for model in (SalesDay, ProductSalesDay, CategorySalesDay):
+            self.assertEqual(self._rollups(model), expected, model.__name__)
+
+    def test_status_change_moves_the_order(self):
+        self.order.status = 'Shipped'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+        self.assertEqual(
+            sorted(self._rollups(SalesDay)), [('Placed', 0, 0, 0), ('Shipped', self.revenue, 1, 3)],
+        )
+
+    def test_deleting_drops_the_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.delete()
+        for model in (SalesDay, ProductSalesDay, CategorySalesDay):
+            self.assertEqual(self._rollups(model), [('Placed', 0, 0, 0)], model.__name__)
+
+
+class SalesDashboardTests(TestCase):
+    def test_needs_view_permission(self):
+        staff = User.objects.create_user('nina', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/admin/shop/salesday/').status_code, 403)
+
+        staff.user_permissions.add(Permission.objects.get(codename='view_salesday'))
+        self.assertEqual(self.client.get('/admin/shop/salesday/').status_code, 200)
+
+
+# ================= SEARCH =================
+
+@unittest.skipUnless(search.is_supported(), "full-text search needs SQLite or PostgreSQL")
+class SearchTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lantern = make_product('Brass Lantern')
+            self.lamp = make_product('Desk Lamp')
+            self.lamp.description = 'Pairs well with a lantern.'
+            self.lamp.save()
+
+    def _names(self, query):
+        return [product.name for product in search.search_products(query).products]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self._names('lantern'), ['Brass Lantern', 'Desk Lamp'])
+
+    def test_terms_are_prefix_matched(self):
+        self.assertEqual(self._names('lant'), ['Brass Lantern', 'Desk Lamp'])
+        self.assertEqual(self._names('bra lan'), ['Brass Lantern'])
+
+    def test_typos_fall_back_to_the_closest_term(self):
+        result = search.search_products('lantren')
+        self.assertEqual(result.corrected, 'lantern')
+        self.assertEqual([product.name for product in result.products], ['Brass Lantern', 'Desk Lamp'])
+        self.assertIsNone(search.search_products('lantern').corrected)
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lantern.name = 'Brass Candlestick'
+            self.lantern.save()
+        self.assertEqual(self._names('candlestick'), ['Brass Candlestick'])
+        self.assertEqual(self._names('lantern'), ['Desk Lamp'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lamp.delete()
+        # _load() would hide a stale entry; look at the index itself
+        self.assertEqual(search._search_ids(['lamp'], 10), [])
+        self.assertEqual(self._names('lantern'), [])
+        self.assertEqual(self._names('brass'), ['Brass Candlestick'])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', "PostgreSQL only")
+    def test_postgres_vocabulary_is_cached(self):
+        cache.clear()
+        search.search_products('lantren')
+        self.assertIn('lantern', cache.get('search-vocab:l'))
+
+
+# ================= EXPORTS =================
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('lena', email='lena@example.com')
+        products = [make_product('Print A', price='10.10'), make_product('Print B', price='20.20')]
+        cls.placed = make_order(user, products, quantity=2)
+        cls.shipped = make_order(user, products[:1])
+        cls.shipped.status = 'Shipped'
+        cls.shipped.save()
+
+    def _body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_streams_one_row_per_line(self):
+        # The query runs as the body is consumed, not when the response is built
+        with self.assertNumQueries(0):
+            response = exports.streaming_export(exports.export_rows(), 'csv')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+
+        rows = list(csv.DictReader(StringIO(self._body(response))))
+        self.assertEqual(list(rows[0]), exports.HEADER)
+        self.assertEqual(
+            [(row['order_id'], row['product_name'], row['quantity'], row['price']) for row in rows],
+            [(str(self.placed.pk), 'Print A', '2', '10.10'), (str(self.placed.pk), 'Print B', '2', '20.20'),
+             (str(self.shipped.pk), 'Print A', '1', '10.10')],
+        )
+        self.assertEqual(rows[0]['order_created_at'], self.placed.created_at.isoformat())
+
+    def test_jsonl_matches_csv(self):
+        csv_rows = list(csv.DictReader(StringIO(self._body(exports.streaming_export(exports.export_rows(), 'csv')))))
+        response = exports.streaming_export(exports.export_rows(), 'jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        json_rows = [json.loads(line) for line in self._body(response).splitlines()]
+        self.assertEqual([{key: str(value) for key, value in row.items()} for row in json_rows], csv_rows)
+
+    def test_command_filters_by_status(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as out:
+            call_command('export_orders', format='jsonl', status=['Shipped'], output=out.name)
+            self.assertEqual([json.loads(line)['order_id'] for line in out], [self.shipped.pk])
+
+
+# ================= IMPORTS =================
+
+class ImportCatalogTests(TestCase):
+    def test_counts_only_categories_it_created(self):
+        Category.objects.create(name='Prints', slug='prints')
+        stream = StringIO(
+            "name,category,price,stock\n"
+            "Print,prints,10.00,1\n"
+            "Vase,ceramics,20.00,2\n"
+            "Bowl,ceramics,15.00,3\n"
+        )
+        report = imports.import_catalog(stream, 'csv')
+        self.assertEqual((report.imported, report.error_count, report.categories_created), (3, 0, 1))
+        self.assertTrue(Category.objects.filter(slug='ceramics').exists())
+
+        stream.seek(0)
+        self.assertEqual(imports.import_catalog(stream, 'csv').categories_created, 0)
+
+
+class CleanRecordTests(TestCase):
+    def test_rejects_non_finite_prices(self):
+        for price in ('NaN', 'sNaN', 'Infinity', '-inf'):
+            with self.assertRaises(ValidationError, msg=price):
+                imports.clean_record({'name': 'Print', 'category': 'prints', 'price': price})
+
+
+# ================= DATABASE ROUTING =================
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(routers, '_replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = routers.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def _call(self, request, write=False):
+        """Run a request through the middleware; returns the response and the alias a read used."""
+        seen = {}
+
+        def view(request):
+            if write:
+                seen['write'] = self.router.db_for_write(Product)
+            seen['read'] = self.router.db_for_read(Product)
+            return HttpResponse()
+
+        response = routers.ReplicaPinMiddleware(view)(request)
+        return response, seen
+
+    def test_writes_go_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        # Outside a request, e.g. in the job worker
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+        _, seen = self._call(self.factory.get('/products/'), write=True)
+        self.assertEqual(seen, {'write': 'default', 'read': 'default'})
+
+    def test_safe_requests_read_the_replica(self):
+        response, seen = self._call(self.factory.get('/products/'))
+        self.assertEqual(seen['read'], 'replica')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_a_write_pins_the_next_request(self):
+        response, seen = self._call(self.factory.post('/add-to-cart/1/'))
+        self.assertEqual(seen['read'], 'default')
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], routers.REPLICA_PIN_SECONDS)
+
+        response, _ = self._call(self.factory.get('/cart/'), write=True)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/cart/')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        _, seen = self._call(request)
+        self.assertEqual(seen['read'], 'default')
+
+
+class SqliteSettingsTests(SimpleTestCase):
+    def test_wal_is_opt_in(self):
+        def init_command():
+            return database.database_config('sqlite:////srv/shop/db.sqlite3')['OPTIONS']['init_command']
+
+        self.assertNotIn('journal_mode', init_command())
+        with mock.patch.object(database, 'SQLITE_WAL', True):
+            self.assertIn('PRAGMA journal_mode=WAL;', init_command())
+
+
+# ================= PROFILING =================
+
+class MetricsAccessTests(TestCase):
+    def test_local_address_alone_is_not_enough(self):
+        # What every request looks like behind a local reverse proxy
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_staff_and_bearer_token(self):
+        with mock.patch.object(profiling, 'METRICS_TOKEN', 's3cret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+# ================= IMAGES =================
+
+def png(width, height, color='teal'):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class BuildVariantsTests(TestCase):
+    def test_writes_every_format(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(location=tmp)
+            variants = build_variants(ContentFile(png(800, 600), name='products/teal.png'), storage)
+
+            self.assertEqual((variants['width'], variants['height']), (800, 600))
+            self.assertEqual(set(variants['formats']), {mime for _, _, mime, _ in formats()})
+            for names in variants['formats'].values():
+                self.assertEqual(list(names), ['320', '640', '800'])
+                self.assertTrue(all(storage.exists(name) for name in names.values()))
+
+    def test_identical_uploads_share_derivatives(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(location=tmp)
+            first = build_variants(ContentFile(png(400, 300), name='products/a.png'), storage)
+            with mock.patch.object(storage, 'save', wraps=storage.save) as save:
+                second = build_variants(ContentFile(png(400, 300), name='products/b.png'), storage)
+
+            self.assertEqual(second['formats'], first['formats'])
+            self.assertEqual(second['source'], 'products/b.png')
+            save.assert_not_called()
+
+    def test_refresh_writes_the_manifest_once(self):
+        temp_storages(self)
+        product = make_product()
+        product.image.save('teal.png', ContentFile(png(700, 350)), save=False)
+        Product.objects.filter(pk=product.pk).update(image=product.image.name)
+
+        self.assertTrue(refresh_variants('product', product.pk))
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertEqual(product.image_variants['height'], 350)
+        self.assertFalse(refresh_variants('product', product.pk))
+
+
+class PictureTagTests(SimpleTestCase):
+    TEMPLATE = Template('{% load shop_images %}{% picture product.image variants sizes="50vw" alt="Teal" %}')
+
+    def _render(self, image, variants=None):
+        return self.TEMPLATE.render(Context({'product': Product(image=image), 'variants': variants}))
+
+    def test_no_image_renders_nothing(self):
+        self.assertEqual(self._render(''), '')
+
+    def test_original_until_variants_exist(self):
+        self.assertHTMLEqual(
+            self._render('products/teal.png'),
+            '<img src="/media/products/teal.png" alt="Teal" class="" loading="lazy" decoding="async">',
+        )
+
+    def test_sources_and_fallback(self):
+        variants = {'width': 800, 'height': 600, 'formats': {
+            'image/webp': {'640': 'd/h/640.webp', '320': 'd/h/320.webp'},
+            'image/jpeg': {'320': 'd/h/320.jpg', '640': 'd/h/640.jpg'},
+        }}
+        self.assertHTMLEqual(self._render('products/teal.png', variants), (
+            '<picture>'
+            '<source type="image/webp" srcset="/media/d/h/320.webp 320w, /media/d/h/640.webp 640w" sizes="50vw">'
+            '<img src="/media/d/h/640.jpg" srcset="/media/d/h/320.jpg 320w, /media/d/h/640.jpg 640w" sizes="50vw" '
+            'width="800" height="600" alt="Teal" class="" loading="lazy" decoding="async">'
+            '</picture>'
+        ))
+
+
+# ================= STATIC FILES =================
+
+class StaticFilesTests(SimpleTestCase):
+    def _storage(self, hashed_files=None):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        storage = staticfiles.StaticFilesStorage(location=tmp.name, base_url='/static/')
+        storage.hashed_files = hashed_files or {}
+        return storage
+
+    def test_plain_urls_until_collectstatic(self):
+        self.assertEqual(self._storage().url('css/styles.css'), '/static/css/styles.css')
+        storage = self._storage({'css/styles.css': 'css/styles.3f2a9c1e0b7d.css'})
+        self.assertEqual(storage.url('css/styles.css'), '/static/css/styles.3f2a9c1e0b7d.css')
+
+    def test_manifest_check(self):
+        with mock.patch.object(staticfiles, 'staticfiles_storage', self._storage()):
+            self.assertEqual([e.id for e in staticfiles.check_static_manifest(None)], ['shop.E003'])
+        with mock.patch.object(staticfiles, 'staticfiles_storage', self._storage({'a.css': 'a.1.css'})):
+            self.assertEqual(staticfiles.check_static_manifest(None), [])
+
+    def test_template_check(self):
+        self.assertEqual(staticfiles.check_static_references(None), [])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            template = Path(tmp) / 'page.html'
+            template.write_text(
+                "{% load static %}\n"
+                "<link href=\"{% static 'css/styles.css' %}\">\n"
+                "<link href=\"/static/css/styles.css\">\n"
+                "<img src=\"{{ STATIC_URL }}logo.png\">\n"
+                "<script src=\"{% static 'js/missing.js' %}\"></script>\n"
+            )
+            with override_settings(BASE_DIR=tmp), \
+                    mock.patch.object(staticfiles, '_template_files', return_value=[template]):
+                errors = staticfiles.check_static_references(None)
+
+        self.assertEqual(
+            [(error.id, error.msg.split(' ')[0]) for error in errors],
+            [('shop.E001', 'page.html:3'), ('shop.E001', 'page.html:4'), ('shop.E002', 'page.html:5')],
+        )
+
+
+# ================= STARTUP =================
+
+class StartupProfileTests(SimpleTestCase):
+    def test_parse_importtime(self):
+        stderr = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     PIL._version\n"
+            "import time:       900 |       1020 |   PIL\n"
+            "import time:        50 |       1070 | shop.images\n"
+        )
+        self.assertEqual(startup_profile.parse_importtime(stderr), [
+            ('PIL._version', 120, 120, 'PIL'),
+            ('PIL', 900, 1020, 'shop.images'),
+            ('shop.images', 50, 1070, None),
+        ])
+
+    def test_serverless_start_skips_lazy_packages(self):
+        # Fails (CommandError) if ReportLab, Pillow, PyMySQL or crispy_forms load
+        with mock.patch.dict('os.environ', {'DJANGO_SERVERLESS': '1'}):
+            call_command('startup_profile', serverless=True, strict=True, stdout=StringIO())
+
+
+# ================= API =================
+
+class ApiProductTests(TestCase):
+    def test_invalid_price_filter_is_a_json_400(self):
+        make_product()
+        for value in ('NaN', 'Infinity', 'abc'):
+            response = self.client.get('/api/v1/products', {'min_price': value})
+            self.assertEqual(response.status_code, 400, value)
+            self.assertIn('min_price', response.json()['error'])
+        self.assertEqual(self.client.get('/api/v1/products', {'max_price': '500'}).status_code, 200)
+
+    def test_unchanged_product_is_not_modified(self):
+        product = make_product()
+        response = self.client.get(f'/api/v1/products/{product.slug}')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f'/api/v1/products/{product.slug}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
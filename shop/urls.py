@@ -1,17 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 from django.contrib.auth import views as auth_views
 
 
 app_name = 'shop'
 
+# Catalog pages and order history have async versions for ASGI deployments
+read_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('products/', views.product_list, name='product_list'),
-    path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('', read_views.index, name='index'),
+    path('products/', read_views.product_list, name='product_list'),
+    path('product/<slug:slug>/', read_views.product_detail, name='product_detail'),
+    path('search/', views.search, name='search'),
     path('cart/', views.cart_view, name='cart'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('orders/', views.order_history, name='order_history'),
+    path('update-cart/<int:product_id>/', views.update_cart, name='update_cart'),
+    path('orders/', read_views.order_history, name='order_history'),
     path("orders/<int:order_id>/", views.order_confirmation, name="order_detail"),
     path('place-order/', views.place_order, name='place_order'),
     path('invoice/<int:order_id>/', views.download_invoice, name='download_invoice'),